@@ -3,30 +3,58 @@
 Script de Auditoría de Integridad de Datos - TaxiFast Multi-tenant
 
 Este script detecta y opcionalmente repara:
-1. Datos sin organization_id (huérfanos)
-2. Referencias cruzadas inválidas (taxista_id, vehiculo_id, empresa_id)
-3. Usuarios sin organización que no son superadmin
+1. Usuarios sin organización que no son superadmin
+2. Datos sin organization_id (huérfanos)
+3. Referencias cruzadas inválidas (taxista_id, vehiculo_id, empresa_id, turno_id):
+   el documento referenciado no existe o es de otra organización
+
+Cada comprobación es una agregación en el servidor (anti-join con $lookup sobre
+_id), así que no se trae ninguna colección a memoria; las comprobaciones se
+ejecutan en paralelo.
 
 Ejecución:
     # Solo auditoría (modo lectura)
     python3 audit_data_integrity.py
-    
-    # Auditoría + reparación
+
+    # Solo documentos modificados desde la última auditoría registrada
+    python3 audit_data_integrity.py --incremental
+
+    # Auditoría + reparación (bulk writes por lotes)
     python3 audit_data_integrity.py --fix
-    
+
     # Con URL de MongoDB personalizada
     MONGO_URL="mongodb+srv://..." python3 audit_data_integrity.py
 
+Reparaciones (--fix):
+    - usuarios sin organización: se desactivan (requieren asignación manual)
+    - turnos/servicios sin organization_id: se les asigna la del taxista/turno
+      al que pertenecen, si existe
+    - el resto (referencias rotas, huérfanos sin padre): se marcan con
+      _audit_flags para revisión manual; no se borra ni se reescribe nada
+
+Cada ejecución se registra en la colección audit_runs (resultado por comprobación).
+
+Modo incremental: revisa los turnos/servicios con updated_at posterior al inicio
+de la última auditoría completada, los usuarios/vehículos/empresas creados desde
+entonces y los servicios que apuntan a turnos borrados (feed_tombstones). No ve
+ediciones ni borrados de usuarios/vehículos/empresas: conviene una auditoría
+completa periódica.
+
 Variables de entorno:
     MONGO_URL: URL de conexión a MongoDB (default: mongodb://localhost:27017)
     DB_NAME: Nombre de la base de datos (default: test_database)
 """
 
+import argparse
+import asyncio
 import os
 import sys
+import time
 from datetime import datetime
-from pymongo import MongoClient
+
 from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 
 # Configuración
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
@@ -56,239 +84,298 @@ def log_header(msg: str):
     print(f"{BLUE}{msg}{RESET}")
     print(f"{BLUE}{'='*60}{RESET}")
 
+MISSING_ORG = {"$or": [{"organization_id": None}, {"organization_id": ""}]}
+
+# Colecciones que mantienen updated_at en cada escritura (change feed)
+UPDATED_AT_COLLECTIONS = ("services", "turnos")
+
+class Check:
+    """
+    Una comprobación = una agregación sobre `collection`.
+      kind "user_without_org": usuarios no superadmin sin organización
+      kind "orphan_data": documentos sin organization_id; `parent` = (campo, colección)
+          de la que heredar la organización en --fix
+      kind "invalid_ref": `field` apunta a un _id de `target` que no existe o es de otra org
+    """
+
+    def __init__(self, key: str, kind: str, collection: str, title: str,
+                 field: str = None, target: str = None, parent: tuple = None):
+        self.key = key
+        self.kind = kind
+        self.collection = collection
+        self.title = title
+        self.field = field
+        self.target = target
+        self.parent = parent
+
+CHECKS = [
+    Check("users_without_org", "user_without_org", "users", "Usuarios sin organización (no superadmin)"),
+    Check("orphan_vehiculos", "orphan_data", "vehiculos", "vehiculos sin organization_id"),
+    Check("orphan_companies", "orphan_data", "companies", "companies sin organization_id"),
+    Check("orphan_turnos", "orphan_data", "turnos", "turnos sin organization_id", parent=("taxista_id", "users")),
+    Check("orphan_services", "orphan_data", "services", "services sin organization_id", parent=("turno_id", "turnos")),
+    Check("turnos_taxista_id", "invalid_ref", "turnos", "turnos.taxista_id", field="taxista_id", target="users"),
+    Check("turnos_vehiculo_id", "invalid_ref", "turnos", "turnos.vehiculo_id", field="vehiculo_id", target="vehiculos"),
+    Check("services_empresa_id", "invalid_ref", "services", "services.empresa_id", field="empresa_id", target="companies"),
+    Check("services_turno_id", "invalid_ref", "services", "services.turno_id", field="turno_id", target="turnos"),
+    Check("services_taxista_id", "invalid_ref", "services", "services.taxista_id", field="taxista_id", target="users"),
+    Check("services_vehiculo_id", "invalid_ref", "services", "services.vehiculo_id", field="vehiculo_id", target="vehiculos"),
+]
+
+def _lookup_parent(field: str, target: str) -> list:
+    """Anti-join: _parent_org = organization_id del documento referenciado, _parent_found si existe"""
+    return [
+        # Las referencias se guardan como string: a ObjectId (inválido -> null, no encuentra nada)
+        {"$addFields": {"_ref": {"$convert": {"input": f"${field}", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {
+            "from": target, "localField": "_ref", "foreignField": "_id",
+            "pipeline": [{"$project": {"organization_id": 1}}], "as": "_parent",
+        }},
+        {"$addFields": {
+            "_parent_found": {"$gt": [{"$size": "$_parent"}, 0]},
+            "_parent_org": {"$arrayElemAt": ["$_parent.organization_id", 0]},
+        }},
+    ]
+
+def build_pipeline(check: Check, scope: dict) -> list:
+    if check.kind == "user_without_org":
+        match = {"role": {"$ne": "superadmin"}, **MISSING_ORG}
+        return [{"$match": {"$and": [match, scope]}}, {"$project": {"username": 1, "role": 1}}]
+
+    if check.kind == "orphan_data":
+        pipeline = [{"$match": {"$and": [MISSING_ORG, scope]}}]
+        if check.parent:
+            field, target = check.parent
+            pipeline += [{"$project": {field: 1}}, *_lookup_parent(field, target), {"$project": {field: 1, "_parent_org": 1}}]
+        else:
+            pipeline.append({"$project": {"_id": 1}})
+        return pipeline
+
+    # invalid_ref
+    field = check.field
+    present = {field: {"$exists": True, "$nin": [None, ""]}}
+    return [
+        {"$match": {"$and": [present, scope]}},
+        {"$project": {field: 1, "organization_id": 1}},
+        *_lookup_parent(field, check.target),
+        {"$match": {"$expr": {"$or": [
+            {"$not": ["$_parent_found"]},
+            # Referencia a otra organización (sin organización a un lado: ya lo cubre orphan_data).
+            # En orden BSON null/ausente < "": "> ''" = string no vacío
+            {"$and": [
+                {"$gt": ["$organization_id", ""]}, {"$gt": ["$_parent_org", ""]},
+                {"$ne": ["$organization_id", "$_parent_org"]},
+            ]},
+        ]}}},
+        {"$project": {field: 1, "organization_id": 1, "_parent_found": 1, "_parent_org": 1}},
+    ]
+
+def describe(check: Check, doc: dict) -> str:
+    if check.kind == "user_without_org":
+        return f"Usuario '{doc.get('username')}' (rol: {doc.get('role')}) sin organization_id"
+    if check.kind == "orphan_data":
+        return "Documento sin organization_id"
+    if not doc.get("_parent_found"):
+        return f"{check.field} '{doc.get(check.field)}' no existe"
+    return f"{check.field} '{doc.get(check.field)}' es de otra organización ({doc.get('_parent_org')})"
+
+def fix_operation(check: Check, doc: dict, now: datetime):
+    """Operación de bulk_write que repara (o marca) el documento"""
+    if check.kind == "user_without_org":
+        return UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"activo": False, "_audit_disabled": True, "_audit_date": now}}
+        ), "desactivado"
+    # Como cualquier escritura de server.py: updated_at para que el change feed lo emita
+    touched = {"_audit_date": now}
+    if check.collection in UPDATED_AT_COLLECTIONS:
+        touched["updated_at"] = now
+    if check.kind == "orphan_data" and doc.get("_parent_org"):
+        # Solo si sigue sin organización (no pisar una asignación concurrente)
+        return UpdateOne(
+            {"_id": doc["_id"], **MISSING_ORG},
+            {"$set": {"organization_id": doc["_parent_org"], **touched}}
+        ), "organización heredada"
+    # Solo si no estaba ya marcado: no reemitir en el feed en cada auditoría
+    return UpdateOne(
+        {"_id": doc["_id"], "_audit_flags": {"$ne": check.key}},
+        {"$addToSet": {"_audit_flags": check.key}, "$set": touched}
+    ), "marcado para revisión"
+
 class DataAuditor:
-    def __init__(self, fix_mode: bool = False):
+    def __init__(self, fix_mode: bool = False, incremental: bool = False, parallel: int = 4,
+                 batch_size: int = 1000, sample: int = 5):
         self.fix_mode = fix_mode
-        self.client = MongoClient(MONGO_URL)
+        self.incremental = incremental
+        self.parallel = parallel
+        self.batch_size = batch_size
+        self.sample = sample
+        self.client = AsyncIOMotorClient(MONGO_URL)
         self.db = self.client[DB_NAME]
-        self.issues = []
-        self.fixes = []
-        
-    def run_full_audit(self):
-        """Ejecutar auditoría completa"""
+        self.results = {}
+
+    async def last_audit_start(self):
+        """Inicio de la última auditoría completada (los cambios durante ella se revisan de nuevo)"""
+        last = await self.db.audit_runs.find_one({"finished_at": {"$ne": None}}, sort=[("started_at", -1)])
+        return last["started_at"] if last else None
+
+    async def build_scopes(self, since: datetime) -> dict:
+        """Filtro por colección para el modo incremental ({} = colección completa)"""
+        if since is None:
+            return {}
+        org_ids = [str(org["_id"]) async for org in self.db.organizations.find({}, {"_id": 1})]
+        # organization_id primero: así usa idx_org_feed (organization_id, updated_at, _id)
+        changed = {"organization_id": {"$in": org_ids + [None, ""]}, "updated_at": {"$gte": since}}
+        created = {"_id": {"$gte": ObjectId.from_datetime(since)}}
+        scopes = {name: changed for name in UPDATED_AT_COLLECTIONS}
+        scopes.update({name: created for name in ("users", "vehiculos", "companies")})
+        # Servicios que apuntaban a turnos borrados desde entonces
+        deleted_turnos = await self.db.feed_tombstones.distinct("doc_id", {"coll": "turnos", "updated_at": {"$gte": since}})
+        if deleted_turnos:
+            scopes["services"] = {"$or": [changed, {"turno_id": {"$in": [str(d) for d in deleted_turnos]}}]}
+        return scopes
+
+    async def run_check(self, check: Check, scope: dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            started = time.monotonic()
+            now = datetime.utcnow()
+            result = {"count": 0, "samples": [], "fixed": {}, "error": None}
+            self.results[check.key] = result
+            pending = []
+
+            async def flush():
+                if pending:
+                    await self.db[check.collection].bulk_write([op for op, _ in pending], ordered=False)
+                    for _, label in pending:
+                        result["fixed"][label] = result["fixed"].get(label, 0) + 1
+                    pending.clear()
+
+            try:
+                cursor = self.db[check.collection].aggregate(
+                    build_pipeline(check, scope), allowDiskUse=True, batchSize=self.batch_size
+                )
+                async for doc in cursor:
+                    result["count"] += 1
+                    if len(result["samples"]) < self.sample:
+                        result["samples"].append(f"{doc['_id']}: {describe(check, doc)}")
+                    if self.fix_mode:
+                        pending.append(fix_operation(check, doc, now))
+                        if len(pending) >= self.batch_size:
+                            await flush()
+                await flush()
+            except Exception as e:
+                result["error"] = str(e)[:300]
+            result["seconds"] = round(time.monotonic() - started, 2)
+
+    async def run_full_audit(self):
+        """Ejecutar auditoría (completa o incremental)"""
         log_header("AUDITORÍA DE INTEGRIDAD DE DATOS - TaxiFast")
-        
+
         if self.fix_mode:
             log_warn("MODO FIX ACTIVADO - Se aplicarán correcciones")
         else:
             log_info("Modo lectura - No se modificarán datos")
-        
+
         print(f"\nConectado a: {MONGO_URL}")
         print(f"Base de datos: {DB_NAME}\n")
-        
-        # 1. Auditar usuarios sin organización
-        self.audit_users_without_org()
-        
-        # 2. Auditar datos huérfanos (sin organization_id)
-        self.audit_orphan_data()
-        
-        # 3. Auditar referencias cruzadas inválidas
-        self.audit_invalid_references()
-        
-        # 4. Auditar servicios con turno_id inválido
-        self.audit_service_turno_references()
-        
-        # Resumen
+
+        since = await self.last_audit_start() if self.incremental else None
+        if self.incremental and since is None:
+            log_warn("No hay auditorías anteriores registradas: se hace una auditoría completa")
+        elif since:
+            log_info(f"Modo incremental: cambios desde {since.isoformat()}")
+
+        started_at = datetime.utcnow()
+        run_id = (await self.db.audit_runs.insert_one({
+            "started_at": started_at, "finished_at": None, "since": since,
+            "mode": "incremental" if since else "full", "fix": self.fix_mode,
+        })).inserted_id
+
+        scopes = await self.build_scopes(since)
+        semaphore = asyncio.Semaphore(self.parallel)
+        await asyncio.gather(*[self.run_check(check, scopes.get(check.collection, {}), semaphore) for check in CHECKS])
+
+        self.print_results()
+        failed = any(result["error"] for result in self.results.values())
+        # Solo una auditoría sin errores sirve de punto de partida para la siguiente incremental
+        await self.db.audit_runs.update_one({"_id": run_id}, {"$set": {
+            "finished_at": None if failed else datetime.utcnow(),
+            "failed": failed,
+            "results": {key: {k: v for k, v in result.items() if k != "samples"} for key, result in self.results.items()},
+        }})
         self.print_summary()
-        
-    def audit_users_without_org(self):
-        """Auditar usuarios que no son superadmin y no tienen organización"""
-        log_header("1. USUARIOS SIN ORGANIZACIÓN")
-        
-        users_without_org = list(self.db.users.find({
-            "role": {"$ne": "superadmin"},
-            "$or": [
-                {"organization_id": None},
-                {"organization_id": {"$exists": False}}
-            ]
-        }))
-        
-        if not users_without_org:
-            log_ok("No hay usuarios problemáticos (sin org y no superadmin)")
-            return
-            
-        for user in users_without_org:
-            issue = f"Usuario '{user.get('username')}' (rol: {user.get('role')}) sin organization_id"
-            log_error(issue)
-            self.issues.append({
-                "type": "user_without_org",
-                "collection": "users",
-                "id": str(user["_id"]),
-                "details": issue
-            })
-            
-            if self.fix_mode:
-                # En modo fix, desactivar el usuario
-                self.db.users.update_one(
-                    {"_id": user["_id"]},
-                    {"$set": {"activo": False, "_audit_disabled": True, "_audit_date": datetime.utcnow()}}
-                )
-                log_warn(f"  → Usuario desactivado (requiere asignación manual de organización)")
-                self.fixes.append(f"Desactivado usuario {user.get('username')}")
-    
-    def audit_orphan_data(self):
-        """Auditar documentos sin organization_id en colecciones críticas"""
-        log_header("2. DATOS HUÉRFANOS (sin organization_id)")
-        
-        collections_to_check = ["vehiculos", "turnos", "services", "companies"]
-        
-        for coll_name in collections_to_check:
-            orphans = list(self.db[coll_name].find({
-                "$or": [
-                    {"organization_id": None},
-                    {"organization_id": {"$exists": False}}
-                ]
-            }))
-            
-            if orphans:
-                log_error(f"{coll_name}: {len(orphans)} documentos sin organization_id")
-                for doc in orphans[:5]:  # Mostrar solo los primeros 5
-                    self.issues.append({
-                        "type": "orphan_data",
-                        "collection": coll_name,
-                        "id": str(doc["_id"]),
-                        "details": f"Documento sin organization_id"
-                    })
-                if len(orphans) > 5:
-                    log_info(f"  ... y {len(orphans) - 5} más")
-            else:
-                log_ok(f"{coll_name}: OK - Todos los documentos tienen organization_id")
-    
-    def audit_invalid_references(self):
-        """Auditar referencias cruzadas inválidas"""
-        log_header("3. REFERENCIAS CRUZADAS INVÁLIDAS")
-        
-        # 3.1 Turnos con taxista_id que no existe
-        log_info("Verificando turnos.taxista_id...")
-        turnos = list(self.db.turnos.find({"taxista_id": {"$exists": True, "$ne": None}}))
-        invalid_taxista_refs = 0
-        for turno in turnos:
-            try:
-                taxista = self.db.users.find_one({"_id": ObjectId(turno["taxista_id"])})
-                if not taxista:
-                    invalid_taxista_refs += 1
-                    self.issues.append({
-                        "type": "invalid_ref",
-                        "collection": "turnos",
-                        "id": str(turno["_id"]),
-                        "details": f"taxista_id '{turno['taxista_id']}' no existe"
-                    })
-            except:
-                invalid_taxista_refs += 1
-                
-        if invalid_taxista_refs:
-            log_error(f"Turnos con taxista_id inválido: {invalid_taxista_refs}")
-        else:
-            log_ok("Turnos: Todas las referencias a taxistas son válidas")
-        
-        # 3.2 Turnos con vehiculo_id que no existe
-        log_info("Verificando turnos.vehiculo_id...")
-        turnos_with_vehiculo = list(self.db.turnos.find({"vehiculo_id": {"$exists": True, "$ne": None, "$ne": ""}}))
-        invalid_vehiculo_refs = 0
-        for turno in turnos_with_vehiculo:
-            try:
-                vehiculo = self.db.vehiculos.find_one({"_id": ObjectId(turno["vehiculo_id"])})
-                if not vehiculo:
-                    invalid_vehiculo_refs += 1
-                    self.issues.append({
-                        "type": "invalid_ref",
-                        "collection": "turnos",
-                        "id": str(turno["_id"]),
-                        "details": f"vehiculo_id '{turno['vehiculo_id']}' no existe"
-                    })
-            except:
-                pass  # vehiculo_id puede ser string vacío o inválido
-                
-        if invalid_vehiculo_refs:
-            log_error(f"Turnos con vehiculo_id inválido: {invalid_vehiculo_refs}")
-        else:
-            log_ok("Turnos: Todas las referencias a vehículos son válidas")
-        
-        # 3.3 Servicios con empresa_id que no existe
-        log_info("Verificando services.empresa_id...")
-        services_with_empresa = list(self.db.services.find({"empresa_id": {"$exists": True, "$ne": None, "$ne": ""}}))
-        invalid_empresa_refs = 0
-        for service in services_with_empresa:
-            try:
-                empresa = self.db.companies.find_one({"_id": ObjectId(service["empresa_id"])})
-                if not empresa:
-                    invalid_empresa_refs += 1
-                    self.issues.append({
-                        "type": "invalid_ref",
-                        "collection": "services",
-                        "id": str(service["_id"]),
-                        "details": f"empresa_id '{service['empresa_id']}' no existe"
-                    })
-            except:
-                pass
-                
-        if invalid_empresa_refs:
-            log_error(f"Servicios con empresa_id inválido: {invalid_empresa_refs}")
-        else:
-            log_ok("Servicios: Todas las referencias a empresas son válidas")
-    
-    def audit_service_turno_references(self):
-        """Auditar servicios con turno_id inválido"""
-        log_header("4. SERVICIOS CON TURNO INVÁLIDO")
-        
-        services_with_turno = list(self.db.services.find({"turno_id": {"$exists": True, "$ne": None, "$ne": ""}}))
-        invalid_turno_refs = 0
-        
-        for service in services_with_turno:
-            try:
-                turno = self.db.turnos.find_one({"_id": ObjectId(service["turno_id"])})
-                if not turno:
-                    invalid_turno_refs += 1
-                    self.issues.append({
-                        "type": "invalid_ref",
-                        "collection": "services",
-                        "id": str(service["_id"]),
-                        "details": f"turno_id '{service['turno_id']}' no existe"
-                    })
-            except:
-                pass
-                
-        if invalid_turno_refs:
-            log_error(f"Servicios con turno_id inválido: {invalid_turno_refs}")
-        else:
-            log_ok("Servicios: Todas las referencias a turnos son válidas")
-    
+        return not failed
+
+    def print_results(self):
+        for title, kinds in (("1. USUARIOS SIN ORGANIZACIÓN", ("user_without_org",)),
+                             ("2. DATOS HUÉRFANOS (sin organization_id)", ("orphan_data",)),
+                             ("3. REFERENCIAS CRUZADAS INVÁLIDAS", ("invalid_ref",))):
+            log_header(title)
+            for check in (c for c in CHECKS if c.kind in kinds):
+                result = self.results[check.key]
+                if result["error"]:
+                    log_error(f"{check.title}: error en la agregación: {result['error']}")
+                    continue
+                if not result["count"]:
+                    log_ok(f"{check.title}: OK ({result['seconds']}s)")
+                    continue
+                log_error(f"{check.title}: {result['count']} documentos con problemas ({result['seconds']}s)")
+                for sample in result["samples"]:
+                    print(f"    {sample}")
+                if result["count"] > len(result["samples"]):
+                    log_info(f"  ... y {result['count'] - len(result['samples'])} más")
+                for label, n in result["fixed"].items():
+                    log_warn(f"  → {n} {label}")
+
     def print_summary(self):
         """Imprimir resumen de la auditoría"""
         log_header("RESUMEN DE AUDITORÍA")
-        
-        if not self.issues:
+
+        total = sum(result["count"] for result in self.results.values())
+        if not total:
             log_ok("¡No se encontraron problemas de integridad!")
             return
-            
-        print(f"\n{RED}Total de problemas encontrados: {len(self.issues)}{RESET}")
-        
+
+        print(f"\n{RED}Total de problemas encontrados: {total}{RESET}")
+
         # Agrupar por tipo
         by_type = {}
-        for issue in self.issues:
-            t = issue["type"]
-            by_type[t] = by_type.get(t, 0) + 1
-            
+        for check in CHECKS:
+            by_type[check.kind] = by_type.get(check.kind, 0) + self.results[check.key]["count"]
+
         print("\nDesglose por tipo:")
         for t, count in by_type.items():
-            print(f"  - {t}: {count}")
-            
-        if self.fixes:
-            print(f"\n{GREEN}Correcciones aplicadas: {len(self.fixes)}{RESET}")
-            for fix in self.fixes:
-                print(f"  - {fix}")
-        elif self.issues:
+            if count:
+                print(f"  - {t}: {count}")
+
+        fixes = {}
+        for result in self.results.values():
+            for label, n in result["fixed"].items():
+                fixes[label] = fixes.get(label, 0) + n
+        if fixes:
+            print(f"\n{GREEN}Correcciones aplicadas: {sum(fixes.values())}{RESET}")
+            for label, n in fixes.items():
+                print(f"  - {label}: {n}")
+        else:
             print(f"\n{YELLOW}Ejecuta con --fix para aplicar correcciones automáticas{RESET}")
 
 def main():
-    fix_mode = "--fix" in sys.argv
-    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fix", action="store_true", help="aplicar correcciones (bulk writes por lotes)")
+    parser.add_argument("--incremental", action="store_true", help="solo cambios desde la última auditoría registrada")
+    parser.add_argument("--parallel", type=int, default=4, help="agregaciones simultáneas")
+    parser.add_argument("--batch", type=int, default=1000, help="tamaño de lote del cursor y de cada bulk_write")
+    parser.add_argument("--sample", type=int, default=5, help="ejemplos a mostrar por comprobación")
+    args = parser.parse_args()
+
     try:
-        auditor = DataAuditor(fix_mode=fix_mode)
-        auditor.run_full_audit()
+        auditor = DataAuditor(fix_mode=args.fix, incremental=args.incremental, parallel=args.parallel,
+                              batch_size=args.batch, sample=args.sample)
+        ok = asyncio.run(auditor.run_full_audit())
     except Exception as e:
         log_error(f"Error durante la auditoría: {e}")
         sys.exit(1)
+    sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
     main()
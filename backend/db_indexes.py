@@ -0,0 +1,309 @@
+"""
+Manifiesto declarativo de índices de MongoDB y cálculo de diferencias.
+
+Cada colección declara sus índices con el mismo nombre y opciones que existen en
+producción (los índices sin nombre explícito usan el nombre por defecto de MongoDB,
+p. ej. "turno_id_1"). reconcile_plan() compara el manifiesto con
+index_information() y devuelve solo las acciones necesarias; server.py las ejecuta
+en segundo plano.
+
+index_usage_report() cruza los índices existentes con $indexStats y el tamaño de
+cada uno para proponer qué podar (redundantes por prefijo o sin uso).
+
+Sin dependencias de la app: lo usan también los scripts de mantenimiento.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Opciones que definen un índice (el resto, p. ej. "v" o "ns", se ignora al comparar)
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def index_name(keys: list) -> str:
+    """Nombre por defecto que MongoDB da a un índice sin name"""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _index(keys: list, name: Optional[str] = None, **options) -> dict:
+    return {"name": name or index_name(keys), "keys": keys, "options": options}
+
+
+def build_index_manifest(feed_tombstone_ttl_seconds: int = 90 * 86400) -> Dict[str, List[dict]]:
+    """{colección: [{"name", "keys", "options"}]}"""
+    return {
+        "services": [
+            _index([("taxista_id", 1)]),
+            _index([("tipo", 1)]),
+            _index([("fecha", 1), ("taxista_id", 1)]),
+            # Lecturas de totales cubiertas por índice (SERVICE_TOTALS_PROJECTION)
+            _index([("turno_id", 1), ("organization_id", 1), ("tipo", 1), ("importe", 1), ("importe_total", 1), ("kilometros", 1)],
+                   name="idx_turno_totals"),
+            _index([("organization_id", 1), ("fecha", 1), ("taxista_id", 1), ("tipo", 1), ("importe", 1), ("importe_total", 1), ("kilometros", 1)],
+                   name="idx_org_fecha_totals"),
+            _index([("organization_id", 1), ("updated_at", 1), ("_id", 1)], name="idx_org_feed"),
+            _index([("organization_id", 1), ("service_dt_utc", -1)], name="idx_org_service_dt"),
+            # Idempotencia (Paso 5A). Los filtros parciales no admiten $ne: "$gt": "" = string no vacío
+            _index([("organization_id", 1), ("client_uuid", 1)], name="ux_org_client_uuid", unique=True,
+                   partialFilterExpression={"client_uuid": {"$type": "string", "$gt": ""}}),
+        ],
+        "turnos": [
+            _index([("cerrado", 1)]),
+            _index([("liquidado", 1)]),
+            _index([("fecha_inicio", 1)]),
+            _index([("taxista_id", 1), ("cerrado", 1)]),
+            _index([("organization_id", 1), ("cerrado", 1)]),
+            _index([("organization_id", 1), ("updated_at", 1), ("_id", 1)], name="idx_org_feed"),
+            _index([("organization_id", 1), ("inicio_dt_utc", -1)], name="idx_org_inicio_dt"),
+            # Solo turnos con repostaje: filtros combustible.repostado=true (listado, vehiculo_id, estadísticas)
+            _index([("organization_id", 1), ("inicio_dt_utc", -1), ("combustible.vehiculo_id", 1)], name="idx_org_repostaje",
+                   partialFilterExpression={"combustible.repostado": True}),
+        ],
+        "users": [
+            _index([("username", 1)], unique=True),
+            _index([("role", 1)]),
+            _index([("organization_id", 1), ("role", 1)]),
+        ],
+        "vehiculos": [
+            # Matrícula única por organización
+            _index([("organization_id", 1), ("matricula", 1)], name="ux_org_matricula", unique=True),
+        ],
+        "companies": [
+            _index([("organization_id", 1)]),
+            # numero_cliente único por organización
+            _index([("organization_id", 1), ("numero_cliente", 1)], name="ux_org_numero_cliente", unique=True, sparse=True),
+        ],
+        "organizations": [
+            _index([("slug", 1)], unique=True),
+            _index([("activa", 1)]),
+        ],
+        "facturacion_batches": [
+            _index([("organization_id", 1), ("created_at", -1)]),
+        ],
+        "facturas": [
+            _index([("batch_id", 1), ("empresa_id", 1)]),
+        ],
+        # Bucket GridFS de los extractos (los mismos índices que crea el driver al subir)
+        "facturas_files.files": [
+            _index([("filename", 1), ("uploadDate", 1)]),
+        ],
+        "facturas_files.chunks": [
+            _index([("files_id", 1), ("n", 1)], unique=True),
+        ],
+        "feed_tombstones": [
+            _index([("organization_id", 1), ("coll", 1), ("updated_at", 1), ("_id", 1)], name="idx_org_coll_feed"),
+            _index([("updated_at", 1)], name="ttl_updated_at", expireAfterSeconds=feed_tombstone_ttl_seconds),
+        ],
+        "metrics_workers": [
+            _index([("updated_at", 1)], name="ttl_updated_at", expireAfterSeconds=86400),
+        ],
+    }
+
+
+# Índices retirados (se eliminan si existen, con cualquier nombre):
+# - los únicos globales previos al multi-tenant
+# - prefijos exactos de otro índice del manifiesto (prefix_covers): solo costaban escrituras.
+#   Los no usados según $indexStats se deciden con index_usage_report() sobre producción
+RETIRED_INDEXES: Dict[str, List[dict]] = {
+    "vehiculos": [
+        {"keys": [("matricula", 1)], "unique": True},
+        {"keys": [("organization_id", 1)], "unique": False},  # ux_org_matricula
+    ],
+    "companies": [{"keys": [("numero_cliente", 1)], "unique": True}],
+    "services": [
+        {"keys": [("turno_id", 1)], "unique": False},  # idx_turno_totals
+        {"keys": [("fecha", 1)], "unique": False},  # fecha_1_taxista_id_1
+        {"keys": [("organization_id", 1)], "unique": False},  # idx_org_fecha_totals, idx_org_service_dt...
+        {"keys": [("organization_id", 1), ("fecha", 1)], "unique": False},  # idx_org_fecha_totals
+    ],
+    "turnos": [
+        {"keys": [("taxista_id", 1)], "unique": False},  # taxista_id_1_cerrado_1
+        {"keys": [("organization_id", 1)], "unique": False},  # organization_id_1_cerrado_1, idx_org_inicio_dt...
+    ],
+    "users": [
+        {"keys": [("organization_id", 1)], "unique": False},  # organization_id_1_role_1
+    ],
+}
+
+
+def _normalize_keys(keys) -> list:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+def _definition(keys, options: dict) -> tuple:
+    return (
+        tuple(_normalize_keys(keys)),
+        tuple((opt, options[opt]) for opt in _COMPARED_OPTIONS if options.get(opt) not in (None, False)),
+    )
+
+
+def reconcile_plan(specs: List[dict], existing: Dict[str, dict], retired: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Acciones para llevar `existing` (index_information()) al manifiesto `specs`:
+      - drop_retired: índice retirado presente
+      - create: falta el índice
+      - set_ttl: solo cambia expireAfterSeconds (collMod, sin rebuild)
+      - rebuild: mismo nombre con otra definición (drop + create)
+      - manual: como rebuild, pero el índice actual o el nuevo es unique; no se
+        reconstruye solo (entre el drop y el create no habría garantía de unicidad
+        y, si el create falla por duplicados, la restricción se perdería)
+      - skip: la misma definición ya existe con otro nombre (crearlo fallaría)
+    Los índices existentes que no están en el manifiesto no se tocan.
+    """
+    actions = []
+    existing_defs = {
+        name: _definition(info["key"], info)
+        for name, info in existing.items() if name != "_id_"
+    }
+
+    for rule in retired or []:
+        for name, info in existing.items():
+            if _normalize_keys(info["key"]) == _normalize_keys(rule["keys"]) and bool(info.get("unique")) == rule.get("unique", False):
+                actions.append({"action": "drop_retired", "name": name})
+                existing_defs.pop(name, None)
+
+    for spec in specs:
+        wanted = _definition(spec["keys"], spec["options"])
+        current = existing_defs.get(spec["name"])
+        if current == wanted:
+            continue
+        if current is None:
+            same_elsewhere = [name for name, definition in existing_defs.items() if definition == wanted]
+            if same_elsewhere:
+                actions.append({"action": "skip", "name": spec["name"], "reason": f"ya existe como {same_elsewhere[0]}"})
+            else:
+                actions.append({"action": "create", "name": spec["name"], "spec": spec})
+        elif (
+            current[0] == wanted[0]
+            and "expireAfterSeconds" in dict(current[1])
+            and "expireAfterSeconds" in spec["options"]
+            and {k: v for k, v in current[1] if k != "expireAfterSeconds"} == {k: v for k, v in wanted[1] if k != "expireAfterSeconds"}
+        ):
+            actions.append({"action": "set_ttl", "name": spec["name"], "spec": spec})
+        elif dict(current[1]).get("unique") or spec["options"].get("unique"):
+            actions.append({"action": "manual", "name": spec["name"], "spec": spec,
+                            "reason": "índice unique con otra definición: reconstruir a mano"})
+        else:
+            actions.append({"action": "rebuild", "name": spec["name"], "spec": spec})
+    return actions
+
+
+# ------------------------------------------------------------------
+# Uso de índices y plan de poda
+# ------------------------------------------------------------------
+def _constraint(info: dict) -> Optional[str]:
+    """Motivo por el que un índice no es prescindible aunque otro lo cubra o no se use"""
+    if info.get("unique"):
+        return "unique"
+    if "expireAfterSeconds" in info:
+        return "ttl"
+    return None
+
+
+def _serves_all_queries(info: dict) -> bool:
+    """Un índice parcial o sparse no puede sustituir a uno completo"""
+    return not info.get("partialFilterExpression") and not info.get("sparse")
+
+
+def prefix_covers(existing: Dict[str, dict], managed: frozenset = frozenset()) -> Dict[str, List[str]]:
+    """
+    {índice: [índices que lo cubren]}: B cubre a A si la clave de A es prefijo de la
+    de B (mismos campos, mismo orden y dirección) y B indexa todos los documentos.
+    Con dos claves idénticas solo una es redundante: se conserva la del manifiesto
+    (managed) o, si no lo decide, la de nombre menor.
+    """
+    keys = {name: _normalize_keys(info["key"]) for name, info in existing.items() if name != "_id_"}
+    covers = {}
+    for name, key in keys.items():
+        covered_by = []
+        for other, other_key in keys.items():
+            if other == name or not _serves_all_queries(existing[other]) or other_key[:len(key)] != key:
+                continue
+            if other_key == key and (other in managed, name) < (name in managed, other):
+                continue  # duplicado exacto: el que se conserva es `name`
+            covered_by.append(other)
+        if covered_by:
+            covers[name] = covered_by
+    # Primero los cubridores que se conservan y, entre ellos, el más corto (el que menos cambia los planes)
+    for name, covered_by in covers.items():
+        covered_by.sort(key=lambda other: (other in covers, len(keys[other]), other))
+    return covers
+
+
+def index_usage_report(
+    existing: Dict[str, dict],
+    usage: Dict[str, dict],
+    sizes: Dict[str, int],
+    managed: set,
+    now: datetime,
+    min_observed_seconds: float,
+) -> dict:
+    """
+    Informe de una colección a partir de index_information() (existing), $indexStats
+    (usage: {nombre: {"ops", "since"}}, "since" = último reinicio de contadores o
+    creación del índice) y storageStats.indexSizes (sizes).
+
+    Recomendación por índice:
+      - keep: se usa, es único/TTL o cubre a otro que se elimina
+      - drop_redundant: su clave es prefijo de otro índice (consolidar en ese)
+      - drop_unused: 0 accesos tras al menos min_observed_seconds de estadísticas
+      - review: 0 accesos pero las estadísticas son demasiado recientes para decidir
+    Los índices del manifiesto se retiran en db_indexes.py (si no, el reconciliador
+    los vuelve a crear); el resto con dropIndex.
+    """
+    covers = prefix_covers(existing, frozenset(managed))
+    entries = {}
+    for name, info in existing.items():
+        ops = usage.get(name, {}).get("ops")
+        since = usage.get(name, {}).get("since")
+        observed_seconds = (now - since).total_seconds() if since else None
+        enough_data = observed_seconds is not None and observed_seconds >= min_observed_seconds
+        entry = {
+            "name": name,
+            "keys": _normalize_keys(info["key"]),
+            "size_bytes": sizes.get(name),
+            "ops": ops,
+            "since": since,
+            "observed_seconds": observed_seconds,
+            "managed": name in managed,
+            "constraint": _constraint(info),
+            "covered_by": covers.get(name, []),
+            "recommendation": "keep",
+            "reason": None,
+        }
+        if name == "_id_":
+            entry["reason"] = "_id"
+        elif entry["constraint"]:
+            entry["reason"] = entry["constraint"]
+        elif entry["covered_by"]:
+            entry["recommendation"] = "drop_redundant"
+            entry["reason"] = f"prefijo de {entry['covered_by'][0]}"
+        elif ops == 0:
+            entry["recommendation"] = "drop_unused" if enough_data else "review"
+            entry["reason"] = "sin accesos" if enough_data else "sin accesos, estadísticas demasiado recientes"
+        entries[name] = entry
+
+    # Un índice que absorbe a otro redundante hereda sus lecturas: no se poda por desuso
+    for entry in entries.values():
+        if entry["recommendation"] == "drop_redundant":
+            target = entries[entry["covered_by"][0]]
+            if target["recommendation"] in ("drop_unused", "review"):
+                target["recommendation"] = "keep"
+                target["reason"] = f"absorbe las lecturas de {entry['name']}"
+
+    dropped = [e for e in entries.values() if e["recommendation"] in ("drop_redundant", "drop_unused")]
+    for entry in dropped:
+        entry["action"] = (
+            "quitar de build_index_manifest() y añadir a RETIRED_INDEXES" if entry["managed"]
+            else f"dropIndex('{entry['name']}')"
+        )
+    return {
+        "indexes": sorted(entries.values(), key=lambda e: (e["recommendation"] == "keep", -(e["size_bytes"] or 0))),
+        # Cada insert actualiza todos los índices (los parciales solo si el documento entra)
+        "indexes_per_insert": len(entries),
+        "indexes_per_insert_after_prune": len(entries) - len(dropped),
+        "reclaimable_bytes": sum(e["size_bytes"] or 0 for e in dropped),
+        "prune_plan": [
+            {"name": e["name"], "recommendation": e["recommendation"], "reason": e["reason"], "action": e["action"]}
+            for e in dropped
+        ],
+    }
@@ -0,0 +1,478 @@
+"""
+Renderizadores de exportación (servicios y turnos PDF/Excel, extractos de
+facturación PDF/CSV).
+
+Funciones puras: reciben datos ya consultados (p.ej. turnos enriquecidos por
+get_turnos_with_servicios, o las líneas agrupadas de una empresa) y devuelven
+los bytes del fichero. No dependen de la app ni de MongoDB, de modo que pueden
+ejecutarse en procesos worker (ProcessPoolExecutor) sin importar server.py.
+"""
+import csv
+import io
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Alignment
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+
+
+def render_turnos_excel(turnos_con_totales: list) -> bytes:
+    """Genera el Excel detallado de turnos (una fila por turno + filas de servicios)"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Turnos Detallados"
+
+    # Header styling
+    header_fill = PatternFill(start_color="0066CC", end_color="0066CC", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+    turno_fill = PatternFill(start_color="FFD966", end_color="FFD966", fill_type="solid")
+    servicio_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+
+    headers = [
+        "Tipo", "Taxista", "Vehículo", "Fecha Inicio", "Hora Inicio", "KM Inicio",
+        "Fecha Fin", "Hora Fin", "KM Fin", "Total KM",
+        "N° Servicios", "Total Clientes (€)", "Total Particulares (€)", "Total (€)",
+        "Cerrado", "Liquidado",
+        "⛽ Repostó", "⛽ Litros", "⛽ Vehículo", "⛽ KM",
+        "Servicio #", "Fecha Serv.", "Hora Serv.", "Origen", "Destino", "Tipo Serv.",
+        "Empresa", "Importe", "Imp. Espera", "Total Serv.", "KM Serv."
+    ]
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal="center")
+
+    # Data
+    current_row = 2
+    for turno in turnos_con_totales:
+        total_km_turno = turno.get("km_fin", 0) - turno["km_inicio"] if turno.get("km_fin") else 0
+        total_importe = turno["total_clientes"] + turno["total_particulares"]
+
+        # Campos de combustible
+        combustible = turno.get("combustible", {}) or {}
+        comb_repostado = "Sí" if combustible.get("repostado") else "No"
+        comb_litros = combustible.get("litros", "") if combustible.get("repostado") else ""
+        comb_vehiculo = combustible.get("vehiculo_matricula", "") if combustible.get("repostado") else ""
+        comb_km = combustible.get("km_vehiculo", "") if combustible.get("repostado") else ""
+
+        # Fila resumen del turno (con fondo amarillo)
+        ws.cell(row=current_row, column=1, value="TURNO")
+        ws.cell(row=current_row, column=2, value=turno["taxista_nombre"])
+        ws.cell(row=current_row, column=3, value=turno["vehiculo_matricula"])
+        ws.cell(row=current_row, column=4, value=turno["fecha_inicio"])
+        ws.cell(row=current_row, column=5, value=turno["hora_inicio"])
+        ws.cell(row=current_row, column=6, value=turno["km_inicio"])
+        ws.cell(row=current_row, column=7, value=turno.get("fecha_fin", ""))
+        ws.cell(row=current_row, column=8, value=turno.get("hora_fin", ""))
+        ws.cell(row=current_row, column=9, value=turno.get("km_fin", ""))
+        ws.cell(row=current_row, column=10, value=total_km_turno)
+        ws.cell(row=current_row, column=11, value=turno["cantidad_servicios"])
+        ws.cell(row=current_row, column=12, value=round(turno["total_clientes"], 2))
+        ws.cell(row=current_row, column=13, value=round(turno["total_particulares"], 2))
+        ws.cell(row=current_row, column=14, value=round(total_importe, 2))
+        ws.cell(row=current_row, column=15, value="Sí" if turno.get("cerrado") else "No")
+        ws.cell(row=current_row, column=16, value="Sí" if turno.get("liquidado") else "No")
+        # Columnas de combustible
+        ws.cell(row=current_row, column=17, value=comb_repostado)
+        ws.cell(row=current_row, column=18, value=comb_litros)
+        ws.cell(row=current_row, column=19, value=comb_vehiculo)
+        ws.cell(row=current_row, column=20, value=comb_km)
+
+        # Aplicar fondo amarillo a la fila del turno
+        for col in range(1, 32):
+            ws.cell(row=current_row, column=col).fill = turno_fill
+
+        current_row += 1
+
+        # Filas de servicios del turno (con fondo gris claro)
+        servicios = turno.get("servicios", [])
+        for idx, servicio in enumerate(servicios, 1):
+            importe = servicio.get("importe", 0)
+            importe_espera = servicio.get("importe_espera", 0)
+            importe_total = servicio.get("importe_total", importe + importe_espera)
+            empresa_nombre = servicio.get("empresa_nombre", "")
+
+            ws.cell(row=current_row, column=1, value="SERVICIO")
+            ws.cell(row=current_row, column=21, value=idx)
+            ws.cell(row=current_row, column=22, value=servicio.get("fecha", ""))
+            ws.cell(row=current_row, column=23, value=servicio.get("hora", ""))
+            ws.cell(row=current_row, column=24, value=servicio.get("origen", ""))
+            ws.cell(row=current_row, column=25, value=servicio.get("destino", ""))
+            ws.cell(row=current_row, column=26, value=servicio.get("tipo", ""))
+            ws.cell(row=current_row, column=27, value=empresa_nombre if servicio.get("tipo") == "empresa" else "")
+            ws.cell(row=current_row, column=28, value=round(importe, 2))
+            ws.cell(row=current_row, column=29, value=round(importe_espera, 2))
+            ws.cell(row=current_row, column=30, value=round(importe_total, 2))
+            ws.cell(row=current_row, column=31, value=servicio.get("kilometros", 0) if servicio.get("kilometros") is not None else 0)
+
+            # Aplicar fondo gris claro a la fila del servicio
+            for col in range(1, 32):
+                ws.cell(row=current_row, column=col).fill = servicio_fill
+
+            current_row += 1
+
+        # Fila vacía para separar turnos
+        current_row += 1
+
+    # Auto-adjust column widths
+    for col in ws.columns:
+        max_length = 0
+        column = col[0].column_letter
+        for cell in col:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(cell.value)
+            except:
+                pass
+        adjusted_width = min((max_length + 2), 50)  # Máximo 50 caracteres de ancho
+        ws.column_dimensions[column].width = adjusted_width
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def render_turnos_pdf(turnos_con_totales: list, titulo: str = "Turnos Detallados - TaxiFast") -> bytes:
+    """Genera el PDF detallado de turnos (bloque de info + tabla de servicios por turno)"""
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    elements = []
+
+    styles = getSampleStyleSheet()
+    title = Paragraph(f"<b>{titulo}</b>", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 0.2*inch))
+
+    # Procesar cada turno con sus servicios
+    for turno_idx, turno in enumerate(turnos_con_totales):
+        # Título del turno
+        turno_title = Paragraph(
+            f"<b>Turno {turno_idx + 1}: {turno['taxista_nombre']} - {turno['vehiculo_matricula']}</b>",
+            styles['Heading2']
+        )
+        elements.append(turno_title)
+        elements.append(Spacer(1, 0.1*inch))
+
+        # Información del turno
+        estado = []
+        if turno.get("cerrado"):
+            estado.append("Cerrado")
+        else:
+            estado.append("Activo")
+        if turno.get("liquidado"):
+            estado.append("Liquidado")
+
+        total_km_turno = turno.get("km_fin", 0) - turno["km_inicio"] if turno.get("km_fin") else 0
+        total_importe = turno["total_clientes"] + turno["total_particulares"]
+
+        info_turno = [
+            ["Fecha Inicio:", f"{turno['fecha_inicio']} {turno['hora_inicio']}",
+             "Fecha Fin:", f"{turno.get('fecha_fin', 'N/A')} {turno.get('hora_fin', '')}" if turno.get('fecha_fin') else "En curso"],
+            ["KM Inicio:", str(turno["km_inicio"]),
+             "KM Fin:", str(turno.get("km_fin", "N/A"))],
+            ["Total KM:", str(total_km_turno),
+             "N° Servicios:", str(turno["cantidad_servicios"])],
+            ["Total Clientes:", f"{turno['total_clientes']:.2f}€",
+             "Total Particulares:", f"{turno['total_particulares']:.2f}€"],
+            ["Total General:", f"{total_importe:.2f}€",
+             "Estado:", " / ".join(estado)]
+        ]
+
+        # Añadir fila de combustible si repostó
+        combustible = turno.get("combustible", {}) or {}
+        if combustible.get("repostado"):
+            comb_litros = combustible.get("litros", "N/A")
+            comb_vehiculo = combustible.get("vehiculo_matricula", "N/A")
+            comb_km = combustible.get("km_vehiculo", "N/A")
+            info_turno.append([
+                "⛽ Repostaje:", f"{comb_litros} L",
+                "Vehículo/KM:", f"{comb_vehiculo} / {comb_km} km"
+            ])
+
+        info_table = Table(info_turno, colWidths=[2*inch, 2*inch, 2*inch, 2*inch])
+        info_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#E7E6E6')),
+            ('BACKGROUND', (2, 0), (2, -1), colors.HexColor('#E7E6E6')),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+
+        elements.append(info_table)
+        elements.append(Spacer(1, 0.15*inch))
+
+        # Tabla de servicios del turno
+        servicios = turno.get("servicios", [])
+        if servicios:
+            servicios_title = Paragraph("<b>Servicios:</b>", styles['Heading3'])
+            elements.append(servicios_title)
+            elements.append(Spacer(1, 0.05*inch))
+
+            servicios_data = [["#", "Fecha", "Hora", "Origen", "Destino", "Tipo", "Importe", "KM"]]
+
+            for idx, servicio in enumerate(servicios, 1):
+                importe_total = servicio.get("importe_total", servicio.get("importe", 0) + servicio.get("importe_espera", 0))
+                origen = servicio.get("origen", "")[:15]
+                destino = servicio.get("destino", "")[:15]
+
+                servicios_data.append([
+                    str(idx),
+                    servicio.get("fecha", ""),
+                    servicio.get("hora", ""),
+                    origen,
+                    destino,
+                    servicio.get("tipo", "")[:4].upper(),
+                    f"{importe_total:.2f}€",
+                    str(servicio.get("kilometros", 0))
+                ])
+
+            servicios_table = Table(servicios_data, colWidths=[0.3*inch, 0.9*inch, 0.7*inch, 1.5*inch, 1.5*inch, 0.6*inch, 0.8*inch, 0.5*inch])
+            servicios_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 7),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                ('FONTSIZE', (0, 1), (-1, -1), 6),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ]))
+
+            elements.append(servicios_table)
+        else:
+            no_servicios = Paragraph("<i>Este turno no tiene servicios registrados</i>", styles['Normal'])
+            elements.append(no_servicios)
+
+        # Separador entre turnos
+        elements.append(Spacer(1, 0.3*inch))
+        if turno_idx < len(turnos_con_totales) - 1:
+            elements.append(Paragraph("<hr/>", styles['Normal']))
+            elements.append(Spacer(1, 0.2*inch))
+
+    doc.build(elements)
+    return output.getvalue()
+
+
+
+def render_services_excel(services: list) -> bytes:
+    """Genera el Excel de servicios (una fila por servicio)"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Servicios"
+
+    # Header styling
+    header_fill = PatternFill(start_color="0066CC", end_color="0066CC", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+
+    headers = ["Fecha", "Hora", "Taxista", "Origen", "Destino", "Importe (€)", "Importe Espera (€)", "Importe Total (€)", "Kilómetros", "Tipo", "Empresa", "Cobrado", "Facturar", "Método Pago", "Origen Taxitur", "Vehículo ID", "Vehículo Matrícula", "Vehículo Cambiado", "Km Inicio Vehículo", "Km Fin Vehículo"]
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal="center")
+
+    # Data
+    for row_idx, service in enumerate(services, 2):
+        importe = service.get("importe", 0)
+        importe_espera = service.get("importe_espera", 0)
+        importe_total = service.get("importe_total", importe + importe_espera)
+
+        ws.cell(row=row_idx, column=1, value=service["fecha"])
+        ws.cell(row=row_idx, column=2, value=service["hora"])
+        ws.cell(row=row_idx, column=3, value=service["taxista_nombre"])
+        ws.cell(row=row_idx, column=4, value=service["origen"])
+        ws.cell(row=row_idx, column=5, value=service["destino"])
+        ws.cell(row=row_idx, column=6, value=round(importe, 2))
+        ws.cell(row=row_idx, column=7, value=round(importe_espera, 2))
+        ws.cell(row=row_idx, column=8, value=round(importe_total, 2))
+        ws.cell(row=row_idx, column=9, value=service.get("kilometros", ""))
+        ws.cell(row=row_idx, column=10, value=service["tipo"])
+        ws.cell(row=row_idx, column=11, value=service.get("empresa_nombre", ""))
+        ws.cell(row=row_idx, column=12, value="Sí" if service.get("cobrado", False) else "No")
+        ws.cell(row=row_idx, column=13, value="Sí" if service.get("facturar", False) else "No")
+        # Nuevos campos PR1
+        ws.cell(row=row_idx, column=14, value=service.get("metodo_pago", "") or "")
+        ws.cell(row=row_idx, column=15, value=service.get("origen_taxitur", "") or "")
+        ws.cell(row=row_idx, column=16, value=service.get("vehiculo_id", "") or "")
+        ws.cell(row=row_idx, column=17, value=service.get("vehiculo_matricula", "") or "")
+        ws.cell(row=row_idx, column=18, value="Sí" if service.get("vehiculo_cambiado", False) else "No")
+        ws.cell(row=row_idx, column=19, value=service.get("km_inicio_vehiculo", "") if service.get("km_inicio_vehiculo") is not None else "")
+        ws.cell(row=row_idx, column=20, value=service.get("km_fin_vehiculo", "") if service.get("km_fin_vehiculo") is not None else "")
+
+    # Auto-adjust column widths
+    for col in ws.columns:
+        max_length = 0
+        column = col[0].column_letter
+        for cell in col:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(cell.value)
+            except:
+                pass
+        adjusted_width = (max_length + 2)
+        ws.column_dimensions[column].width = adjusted_width
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def render_services_pdf(services: list) -> bytes:
+    """Genera el PDF de servicios (tabla apaisada con columnas abreviadas)"""
+    output = io.BytesIO()
+    # Usar landscape (horizontal) para tener más espacio
+    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
+    elements = []
+
+    styles = getSampleStyleSheet()
+    title = Paragraph("<b>Servicios de Taxi - TaxiFast</b>", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Table data con más columnas (incluyendo nuevos campos PR1)
+    data = [["Fecha", "Hora", "Taxista", "Origen", "Destino", "Importe", "Total", "KM", "Tipo", "Cobrado", "Pago", "Orig.Tax", "Veh.Cambio"]]
+
+    for service in services:
+        importe = service.get("importe", 0)
+        importe_espera = service.get("importe_espera", 0)
+        importe_total = service.get("importe_total", importe + importe_espera)
+
+        data.append([
+            service["fecha"],
+            service["hora"],
+            service["taxista_nombre"][:10],
+            service["origen"][:10],
+            service["destino"][:10],
+            f"{importe:.2f}€",
+            f"{importe_total:.2f}€",
+            service.get("kilometros", "") or "",
+            service["tipo"][:3].upper(),
+            "Sí" if service.get("cobrado", False) else "No",
+            (service.get("metodo_pago", "") or "")[:3].upper(),
+            (service.get("origen_taxitur", "") or "")[:4],
+            "Sí" if service.get("vehiculo_cambiado", False) else "No"
+        ])
+
+    table = Table(data)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 6),
+    ]))
+
+    elements.append(table)
+    doc.build(elements)
+    return output.getvalue()
+
+
+FACTURA_CSV_HEADERS = [
+    "Fecha", "Hora", "Taxista", "Origen", "Destino", "Importe (€)", "Importe Espera (€)",
+    "Importe Total (€)", "Kilómetros", "Vehículo Matrícula", "Cobrado"
+]
+
+
+def render_factura_csv(lineas: list) -> bytes:
+    """Detalle de líneas (servicios) de un extracto de facturación en CSV"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(FACTURA_CSV_HEADERS)
+    for linea in lineas:
+        importe = linea.get("importe", 0) or 0
+        importe_espera = linea.get("importe_espera", 0) or 0
+        importe_total = linea.get("importe_total", importe + importe_espera)
+        writer.writerow([
+            linea.get("fecha", ""),
+            linea.get("hora", ""),
+            linea.get("taxista_nombre", ""),
+            linea.get("origen", ""),
+            linea.get("destino", ""),
+            f"{importe:.2f}",
+            f"{importe_espera:.2f}",
+            f"{importe_total:.2f}",
+            linea.get("kilometros", "") if linea.get("kilometros") is not None else "",
+            linea.get("vehiculo_matricula", "") or "",
+            "Sí" if linea.get("cobrado", False) else "No"
+        ])
+    # BOM para que Excel abra bien los acentos
+    return output.getvalue().encode("utf-8-sig")
+
+
+def render_factura_pdf(empresa: dict, organizacion: dict, periodo: str, lineas: list) -> bytes:
+    """Extracto de servicios a facturar de una empresa cliente en un período"""
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    elements = []
+
+    styles = getSampleStyleSheet()
+    elements.append(Paragraph(f"<b>Extracto de servicios - {empresa.get('nombre', '')}</b>", styles['Title']))
+    elements.append(Spacer(1, 0.1*inch))
+
+    # Cabecera emisor / cliente
+    cabecera = [
+        ["Emisor:", organizacion.get("nombre", ""), "Cliente:", empresa.get("nombre", "")],
+        ["CIF:", organizacion.get("cif", "") or "", "CIF:", empresa.get("cif", "") or ""],
+        ["Dirección:", organizacion.get("direccion", "") or "", "Dirección:", empresa.get("direccion", "") or ""],
+        ["Período:", periodo, "Nº Cliente:", empresa.get("numero_cliente", "") or ""],
+    ]
+    cabecera_table = Table(cabecera, colWidths=[0.9*inch, 2.6*inch, 0.9*inch, 2.6*inch])
+    cabecera_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    elements.append(cabecera_table)
+    elements.append(Spacer(1, 0.2*inch))
+
+    data = [["#", "Fecha", "Hora", "Taxista", "Origen", "Destino", "KM", "Total"]]
+    total = 0.0
+    total_km = 0.0
+    for idx, linea in enumerate(lineas, 1):
+        importe = linea.get("importe", 0) or 0
+        importe_total = linea.get("importe_total", importe + (linea.get("importe_espera", 0) or 0))
+        total += importe_total
+        total_km += linea.get("kilometros") or 0
+        data.append([
+            str(idx),
+            linea.get("fecha", ""),
+            linea.get("hora", ""),
+            (linea.get("taxista_nombre", "") or "")[:15],
+            (linea.get("origen", "") or "")[:18],
+            (linea.get("destino", "") or "")[:18],
+            str(linea.get("kilometros", "") or ""),
+            f"{importe_total:.2f}€"
+        ])
+    data.append(["", "", "", "", "", "TOTAL", f"{total_km:.1f}", f"{total:.2f}€"])
+
+    table = Table(data, colWidths=[0.3*inch, 0.8*inch, 0.5*inch, 1.2*inch, 1.5*inch, 1.5*inch, 0.5*inch, 0.8*inch], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 7),
+        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+        ('FONTSIZE', (0, 1), (-1, -1), 6),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#E7E6E6')),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    elements.append(table)
+
+    doc.build(elements)
+    return output.getvalue()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tiempo de arranque en frío (import de server.py en un intérprete nuevo).
+
+Cada repetición lanza un proceso Python limpio que importa server y mide el import
+completo (sin conectar a MongoDB: el cliente Motor es perezoso). Además comprueba
+que las librerías de export (openpyxl, reportlab) NO se cargan al importar, y
+muestra los módulos más caros según `python -X importtime`.
+
+Uso:
+    python scripts/bench_import_time.py --repeat 10
+    python scripts/bench_import_time.py --max-ms 1500   # CI: exit 1 si p50 lo supera
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Librerías que solo deben cargarse en el primer export
+LAZY_MODULES = ("openpyxl", "reportlab", "export_renderers")
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import server
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{
+    "import_ms": elapsed_ms,
+    "eager": [m for m in {LAZY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "taxifast_bench")
+    return env
+
+
+def measure_once() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=child_env(),
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int) -> list:
+    """Módulos con mayor tiempo acumulado según -X importtime"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"], cwd=BACKEND_DIR, env=child_env(),
+        capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        # Solo paquetes de primer nivel (los submódulos ya cuentan en su padre)
+        if not name.startswith(" "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="módulos más caros a mostrar")
+    parser.add_argument("--max-ms", type=float, default=None, help="falla (exit 1) si el p50 lo supera")
+    args = parser.parse_args()
+
+    measure_once()  # warm-up: .pyc y caché de disco
+    runs = [measure_once() for _ in range(args.repeat)]
+    times = sorted(run["import_ms"] for run in runs)
+    p50 = statistics.median(times)
+    print(f"import server: p50 {p50:.0f}ms | min {times[0]:.0f}ms | max {times[-1]:.0f}ms ({args.repeat} procesos)")
+
+    print(f"\n{'cumulative ms':>14}  módulo")
+    for ms, name in top_imports(args.top):
+        print(f"{ms:>14.1f}  {name}")
+
+    failed = False
+    eager = runs[-1]["eager"]
+    if eager:
+        print(f"\nERROR: cargados al importar server (deberían ser diferidos): {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and p50 > args.max_ms:
+        print(f"\nERROR: p50 {p50:.0f}ms supera el presupuesto de {args.max_ms:.0f}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
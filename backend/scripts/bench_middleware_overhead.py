@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: overhead por request del middleware de observabilidad.
+
+Compara, sobre una app Starlette mínima (JSON corto y respuesta streaming):
+  - sin middleware (línea base)
+  - BaseHTTPMiddleware (equivalente al antiguo @app.middleware("http") log_requests)
+  - RequestObservabilityMiddleware (ASGI puro, server.py)
+
+Los requests se inyectan directamente por ASGI (sin red ni servidor) para aislar
+el coste del middleware. No necesita MongoDB.
+
+Uso:
+    python scripts/bench_middleware_overhead.py --requests 20000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "taxifast_bench")
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+import server  # noqa: E402
+
+
+async def small_json(request):
+    return JSONResponse({"id": request.path_params["item_id"], "ok": True})
+
+
+async def streaming(request):
+    async def body():
+        for _ in range(20):
+            yield b"x" * 1024
+    return StreamingResponse(body(), media_type="application/octet-stream")
+
+
+ROUTES = [
+    Route("/api/items/{item_id}", small_json),
+    Route("/api/stream", streaming),
+]
+
+
+async def legacy_log_requests(request, call_next):
+    """Réplica del antiguo log_requests basado en BaseHTTPMiddleware"""
+    start_time = time.time()
+    request_id = str(uuid.uuid4())[:8]
+    db_stats = server.RequestDBStats()
+    token = server._request_db_stats.set(db_stats)
+    server.metrics.request_started()
+    try:
+        response = await call_next(request)
+    finally:
+        server.metrics.request_finished()
+        server._request_db_stats.reset(token)
+    process_time = (time.time() - start_time) * 1000
+    response.headers["X-Request-Id"] = request_id
+    response.headers["X-Process-Time"] = f"{process_time:.0f}ms"
+    response.headers["X-DB-Calls"] = str(db_stats.calls)
+    response.headers["X-DB-Time"] = f"{db_stats.time_ms:.1f}ms"
+    path = request.url.path
+    route = server.get_route_template(request.scope)
+    server.metrics.record_request(request.method, route, response.status_code, process_time, path)
+    server.logger.info(f"[{request_id}] [{request.method}] {path} -> {response.status_code} ({process_time:.0f}ms)")
+    return response
+
+
+def build_apps():
+    return {
+        "sin middleware": Starlette(routes=ROUTES),
+        "BaseHTTPMiddleware": Starlette(routes=ROUTES, middleware=[
+            Middleware(BaseHTTPMiddleware, dispatch=legacy_log_requests)
+        ]),
+        "ASGI puro": Starlette(routes=ROUTES, middleware=[
+            Middleware(server.RequestObservabilityMiddleware)
+        ]),
+    }
+
+
+async def asgi_request(app, path: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # nunca se desconecta
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def run(app, path: str, n: int) -> float:
+    for _ in range(min(500, n)):  # warm-up
+        await asgi_request(app, path)
+    started = time.perf_counter()
+    for _ in range(n):
+        await asgi_request(app, path)
+    return (time.perf_counter() - started) / n * 1e6  # µs/request
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    # El coste del handler de logging (I/O a stderr) no es objeto de la medición
+    logging.getLogger("server").setLevel(logging.WARNING)
+
+    apps = build_apps()
+    for label, path in (("JSON pequeño", "/api/items/6650f0c2a1b2c3d4e5f60718"), ("streaming 20 chunks", "/api/stream")):
+        print(f"\n== {label} ({args.requests} requests)")
+        baseline = None
+        for name, app in apps.items():
+            us = await run(app, path, args.requests)
+            baseline = us if baseline is None else baseline
+            overhead = "" if us is baseline else f"  (+{us - baseline:.1f} µs)"
+            print(f"{name:22}{us:>10.1f} µs/request{overhead}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
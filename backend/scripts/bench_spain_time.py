@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: conversión fecha/hora de España -> UTC (spain_time.py).
+
+Compara el coste por elemento de:
+  - pytz localize por llamada (implementación anterior de parse_spanish_date_to_utc)
+  - parse_spanish_date_to_utc (offsets cacheados por día)
+  - parse_spanish_dates_to_utc (lote vectorizado con NumPy)
+
+Los datos imitan un histórico real: --days días consecutivos con --per-day
+servicios cada uno, en formato dd/mm/yyyy y horas aleatorias. Antes de medir
+comprueba que las tres variantes dan el mismo resultado, incluidos todos los
+minutos de los días de cambio de hora de --dst-years años.
+
+Uso:
+    python scripts/bench_spain_time.py --days 365 --per-day 200
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytz  # noqa: E402
+
+import spain_time  # noqa: E402
+from spain_time import SPAIN_TZ, parse_spanish_date_to_utc, parse_spanish_dates_to_utc  # noqa: E402
+
+
+def legacy_parse(fecha_str, hora_str="00:00"):
+    """parse_spanish_date_to_utc antes de spain_time (localize por llamada)"""
+    try:
+        if not fecha_str:
+            return None
+        day, month, year = None, None, None
+        if "/" in fecha_str:
+            parts = fecha_str.split("/")
+            if len(parts) == 3:
+                day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
+        elif "-" in fecha_str:
+            parts = fecha_str.split("-")
+            if len(parts) == 3:
+                year, month, day = int(parts[0]), int(parts[1]), int(parts[2])
+        if day is None or month is None or year is None:
+            return None
+        hora_parts = (hora_str or "00:00").split(":")
+        hour = int(hora_parts[0]) if len(hora_parts) >= 1 else 0
+        minute = int(hora_parts[1]) if len(hora_parts) >= 2 else 0
+        spain_dt = SPAIN_TZ.localize(datetime(year, month, day, hour, minute, 0))
+        return spain_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+    except (ValueError, TypeError, IndexError, AttributeError):
+        return None
+
+
+def build_dataset(days: int, per_day: int, seed: int) -> tuple:
+    rnd = random.Random(seed)
+    start = date.today() - timedelta(days=days)
+    fechas, horas = [], []
+    for offset in range(days):
+        fecha = (start + timedelta(days=offset)).strftime("%d/%m/%Y")
+        for _ in range(per_day):
+            fechas.append(fecha)
+            horas.append(f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}")
+    return fechas, horas
+
+
+def dst_dataset(years: int) -> tuple:
+    """Todos los minutos de los días de cambio de hora, más casos inválidos"""
+    fechas, horas = [], []
+    this_year = date.today().year
+    for transition in SPAIN_TZ._utc_transition_times:
+        if not this_year - years <= transition.year <= this_year + 1:
+            continue
+        local_day = pytz.UTC.localize(transition).astimezone(SPAIN_TZ).date()
+        for fecha in (local_day.strftime("%d/%m/%Y"), local_day.isoformat()):
+            for minute_of_day in range(24 * 60):
+                fechas.append(fecha)
+                horas.append(f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}")
+    for fecha, hora in (("31/02/2024", "10:00"), ("01/01/2024", "24:00"), ("", "10:00"), ("2024-01", "10:00"),
+                        ("01/01/2024", ""), ("01/01/2024", "9"), ("xx/yy/zzzz", "10:00"), ("01/01/2024", "10:75")):
+        fechas.append(fecha)
+        horas.append(hora)
+    return fechas, horas
+
+
+def check_equivalence(fechas, horas) -> int:
+    batch = parse_spanish_dates_to_utc(fechas, horas)
+    mismatches = 0
+    for fecha, hora, vectorized in zip(fechas, horas, batch):
+        expected = legacy_parse(fecha, hora)
+        if not (expected == parse_spanish_date_to_utc(fecha, hora) == vectorized):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  DIFERENCIA {fecha} {hora}: legacy={expected} scalar={parse_spanish_date_to_utc(fecha, hora)} batch={vectorized}")
+    return mismatches
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=200, help="servicios por día")
+    parser.add_argument("--dst-years", type=int, default=10, help="años de días de cambio de hora a verificar")
+    parser.add_argument("--repeat", type=int, default=5, help="se reporta la mejor de N pasadas")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    # Los casos inválidos son intencionados: sin warning por cada uno
+    logging.getLogger("spain_time").setLevel(logging.ERROR)
+
+    dst_fechas, dst_horas = dst_dataset(args.dst_years)
+    mismatches = check_equivalence(dst_fechas, dst_horas)
+    print(f"Equivalencia en cambios de hora: {len(dst_fechas)} casos, {mismatches} diferencias")
+    if mismatches:
+        sys.exit(1)
+
+    fechas, horas = build_dataset(args.days, args.per_day, args.seed)
+    n = len(fechas)
+    mismatches = check_equivalence(fechas[:20000], horas[:20000])
+    if mismatches:
+        print(f"ERROR: {mismatches} diferencias en el dataset")
+        sys.exit(1)
+
+    pairs = list(zip(fechas, horas))
+
+    def cold_scalar():
+        spain_time._day_offsets_minutes.cache_clear()
+        spain_time._parse_fecha.cache_clear()
+        spain_time._parse_hora.cache_clear()
+        for fecha, hora in pairs:
+            parse_spanish_date_to_utc(fecha, hora)
+
+    results = [
+        ("pytz localize por llamada", timed(lambda: [legacy_parse(f, h) for f, h in pairs], args.repeat)),
+        ("scalar, caché fría", timed(cold_scalar, args.repeat)),
+        ("scalar, caché caliente", timed(lambda: [parse_spanish_date_to_utc(f, h) for f, h in pairs], args.repeat)),
+        ("lote vectorizado", timed(lambda: parse_spanish_dates_to_utc(fechas, horas), args.repeat)),
+    ]
+    baseline = results[0][1]
+    print(f"\n{n} conversiones ({args.days} días x {args.per_day}), mejor de {args.repeat}")
+    print(f"{'variante':<28}{'total ms':>10}{'µs/elem':>10}{'speedup':>9}")
+    for name, seconds in results:
+        print(f"{name:<28}{seconds * 1000:>10.1f}{seconds / n * 1e6:>10.3f}{baseline / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
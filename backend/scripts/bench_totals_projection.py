@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Benchmark: lecturas de totales de turnos con documento completo vs proyección cubierta.
+
+Siembra un dataset sintético (por defecto 1M servicios) en una base de datos aparte
+y compara, para las consultas de totales de get_turnos / get_reporte_diario:
+  - latencia (p50/p95 sobre N repeticiones)
+  - bytes enviados por el servidor (delta de serverStatus.network.bytesOut)
+  - documentos examinados según explain (0 => consulta cubierta por índice)
+
+Uso:
+    MONGO_URL=mongodb://localhost:27017 python scripts/bench_totals_projection.py \\
+        --services 1000000 --db taxifast_bench
+
+    --skip-seed reutiliza un dataset ya sembrado. La base de datos se elimina
+    al final salvo que se pase --keep.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import InsertOne, MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "taxifast_bench")
+
+from server import SERVICE_TOTALS_PROJECTION, SERVICE_TOTALS_BY_TAXISTA_PROJECTION  # noqa: E402
+
+ORGS = 5
+TAXISTAS_POR_ORG = 40
+SERVICIOS_POR_TURNO = 25
+INSERT_BATCH = 10000
+
+
+def seed(db, total_services):
+    print(f"[SEED] Sembrando {total_services} servicios...")
+    db.services.drop()
+    rnd = random.Random(42)
+    base = datetime(2025, 1, 1)
+    total_turnos = max(1, total_services // SERVICIOS_POR_TURNO)
+    ops = []
+    started = time.perf_counter()
+    for i in range(total_services):
+        turno_n = i % total_turnos
+        org_n = turno_n % ORGS
+        taxista_n = turno_n % TAXISTAS_POR_ORG
+        dt = base + timedelta(days=turno_n % 365, minutes=rnd.randint(0, 1439))
+        importe = round(rnd.uniform(5, 80), 2)
+        tipo = "empresa" if rnd.random() < 0.4 else "particular"
+        ops.append(InsertOne({
+            "organization_id": f"org{org_n}",
+            "taxista_id": f"tx{org_n}_{taxista_n}",
+            "turno_id": f"turno{turno_n}",
+            "fecha": dt.strftime("%d/%m/%Y"),
+            "hora": dt.strftime("%H:%M"),
+            "service_dt_utc": dt,
+            "tipo": tipo,
+            "empresa_id": f"emp{rnd.randint(0, 30)}" if tipo == "empresa" else None,
+            "origen": "Calle de ejemplo " * rnd.randint(1, 4),
+            "destino": "Avenida de prueba " * rnd.randint(1, 4),
+            "observaciones": "x" * rnd.randint(0, 200),
+            "importe": importe,
+            "importe_espera": 0,
+            "importe_total": importe,
+            "kilometros": round(rnd.uniform(1, 40), 1),
+            "cobrado": False,
+            "facturar": tipo == "empresa",
+            "vehiculo_matricula": f"{rnd.randint(1000, 9999)}ABC",
+            "vehiculo_cambiado": False,
+            "created_at": dt,
+            "updated_at": dt,
+        }))
+        if len(ops) >= INSERT_BATCH:
+            db.services.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.services.bulk_write(ops, ordered=False)
+    print(f"[SEED] {total_services} servicios en {time.perf_counter() - started:.1f}s")
+
+
+def create_indexes(db):
+    # Mismos índices que declara db_indexes.py para estas consultas
+    db.services.create_index("turno_id")
+    db.services.create_index([("organization_id", 1), ("fecha", 1)])
+    db.services.create_index(
+        [("turno_id", 1), ("organization_id", 1), ("tipo", 1), ("importe", 1), ("importe_total", 1), ("kilometros", 1)],
+        name="idx_turno_totals"
+    )
+    db.services.create_index(
+        [("organization_id", 1), ("fecha", 1), ("taxista_id", 1), ("tipo", 1), ("importe", 1), ("importe_total", 1), ("kilometros", 1)],
+        name="idx_org_fecha_totals"
+    )
+
+
+def bytes_out(db):
+    return db.command("serverStatus")["network"]["bytesOut"]
+
+
+def measure(db, query, projection, repeat):
+    latencies = []
+    sent = 0
+    docs = 0
+    for _ in range(repeat):
+        before = bytes_out(db)
+        started = time.perf_counter()
+        docs = len(list(db.services.find(query, projection)))
+        latencies.append((time.perf_counter() - started) * 1000)
+        # serverStatus también cuenta su propia respuesta; el ruido es constante
+        sent += bytes_out(db) - before
+    explain = db.services.find(query, projection).explain()["executionStats"]
+    return {
+        "docs": docs,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)],
+        "bytes_out": sent // repeat,
+        "docs_examined": explain["totalDocsExamined"],
+        "keys_examined": explain["totalKeysExamined"],
+    }
+
+
+def report(name, full, lean):
+    print(f"\n== {name} ({full['docs']} servicios)")
+    print(f"{'':14}{'p50 ms':>10}{'p95 ms':>10}{'bytes out':>14}{'docs exam.':>12}{'keys exam.':>12}")
+    for label, r in (("completo", full), ("proyección", lean)):
+        print(f"{label:14}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['bytes_out']:>14}"
+              f"{r['docs_examined']:>12}{r['keys_examined']:>12}")
+    if lean["bytes_out"]:
+        print(f"bytes: x{full['bytes_out'] / lean['bytes_out']:.1f} menos | "
+              f"p50: x{full['p50_ms'] / max(lean['p50_ms'], 0.001):.1f} más rápido")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=1_000_000)
+    parser.add_argument("--db", default=os.environ["DB_NAME"])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--turnos", type=int, default=200, help="turnos por consulta $in (listado de turnos)")
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URL"])
+    db = client[args.db]
+    try:
+        if not args.skip_seed:
+            seed(db, args.services)
+        create_indexes(db)
+
+        total_turnos = max(1, args.services // SERVICIOS_POR_TURNO)
+        org = "org0"
+        turno_ids = [f"turno{n}" for n in range(0, total_turnos, ORGS)][:args.turnos]
+        fecha = db.services.find_one({"organization_id": org}, {"fecha": 1})["fecha"]
+
+        queries = [
+            ("get_turnos / get_turnos_with_servicios ($in turno_id)",
+             {"turno_id": {"$in": turno_ids}, "organization_id": org}, SERVICE_TOTALS_PROJECTION),
+            ("get_turno_activo / update de turno (1 turno)",
+             {"turno_id": turno_ids[0], "organization_id": org}, SERVICE_TOTALS_PROJECTION),
+            ("get_reporte_diario (fecha)",
+             {"fecha": fecha, "organization_id": org}, SERVICE_TOTALS_BY_TAXISTA_PROJECTION),
+        ]
+        for name, query, projection in queries:
+            full = measure(db, query, None, args.repeat)
+            lean = measure(db, query, projection, args.repeat)
+            report(name, full, lean)
+    finally:
+        if not args.keep:
+            client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
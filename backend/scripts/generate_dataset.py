@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Generador de datasets sintéticos multi-tenant para pruebas de rendimiento.
+
+Crea organizaciones con admin, taxistas, vehículos y empresas cliente, y N años de
+turnos diarios con servicios (fechas/horas en formato español, en hora de Madrid),
+repostajes, una fracción de documentos legacy sin los campos *_dt_utc / updated_at
+y unas pocas fechas malformadas (para probar las migraciones).
+
+Reproducible: el contenido depende solo de --seed y de los parámetros (cada
+organización usa su propio generador, así que el resultado no depende de --workers).
+Las inserciones son insert_many no ordenados por lotes; con --workers > 1 cada
+proceso carga organizaciones distintas.
+
+Uso:
+    MONGO_URL=mongodb://localhost:27017 python scripts/generate_dataset.py \\
+        --db taxifast_perf --orgs 40 --years 3 --workers 8 --drop --indexes
+
+    # ~10M servicios: 40 orgs x ~100 taxistas x ~780 turnos x ~16 servicios/3 años
+
+Usuarios: admin_<org> y taxista_<org>_<n>, contraseña --password.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pytz
+from bson import ObjectId
+from passlib.context import CryptContext
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db_indexes import build_index_manifest  # noqa: E402
+
+SPAIN_TZ = pytz.timezone("Europe/Madrid")
+
+CALLES = ["Calle Mayor", "Avenida de Galicia", "Plaza de España", "Calle Real", "Paseo del Parque",
+          "Calle San Roque", "Avenida de la Constitución", "Calle del Carmen", "Ronda Norte"]
+LUGARES = ["Hospital", "Estación de tren", "Estación de autobuses", "Aeropuerto", "Centro de salud",
+           "Polígono industrial", "Residencia", "Colegio", "Ayuntamiento", "Centro comercial"]
+MARCAS = [("Toyota", "Prius"), ("Toyota", "Corolla"), ("Skoda", "Octavia"), ("Dacia", "Jogger"),
+          ("Hyundai", "Ioniq"), ("Kia", "Niro"), ("Mercedes", "Clase E")]
+NOMBRES = ["Antonio", "José", "Manuel", "Francisco", "David", "Juan", "Javier", "Carmen", "María",
+           "Laura", "Ana", "Isabel", "Pablo", "Lucía", "Marta", "Sergio", "Raquel", "Alberto"]
+APELLIDOS = ["García", "Fernández", "González", "Rodríguez", "López", "Martínez", "Sánchez",
+             "Pérez", "Álvarez", "Suárez", "Menéndez", "Rubio", "Iglesias", "Castro"]
+# Fechas/horas que parse_spanish_date_to_utc rechaza (migraciones: se registran y se saltan)
+MALFORMED = [("31/02/2024", "10:00"), ("15.03.2024", "09:30"), ("", "12:00"),
+             ("2024/13/01", "08:00"), ("12/05/2024", "25:70"), ("sin fecha", "")]
+
+
+def oid(dt: datetime, rnd: random.Random) -> ObjectId:
+    """ObjectId determinista con el timestamp del documento (orden de _id realista)"""
+    return ObjectId(int(dt.replace(tzinfo=pytz.utc).timestamp()).to_bytes(4, "big") + rnd.getrandbits(64).to_bytes(8, "big"))
+
+
+class SpainClock:
+    """Hora local de Madrid -> UTC, con el offset cacheado por (día, hora)"""
+
+    def __init__(self):
+        self._offsets = {}
+
+    def to_utc(self, day: date, hour: int, minute: int) -> datetime:
+        key = (day, hour)
+        offset = self._offsets.get(key)
+        if offset is None:
+            local = SPAIN_TZ.localize(datetime(day.year, day.month, day.day, hour), is_dst=False)
+            offset = self._offsets[key] = local.utcoffset()
+        return datetime(day.year, day.month, day.day, hour, minute) - offset
+
+
+class OrgGenerator:
+    def __init__(self, org_n: int, args):
+        self.org_n = org_n
+        self.args = args
+        self.rnd = random.Random(args.seed * 1_000_003 + org_n)
+        self.clock = SpainClock()
+        self.start_day = date.today() - timedelta(days=int(365 * args.years))
+        self.created = datetime.combine(self.start_day, datetime.min.time())
+
+    def persona(self) -> str:
+        return f"{self.rnd.choice(NOMBRES)} {self.rnd.choice(APELLIDOS)} {self.rnd.choice(APELLIDOS)}"
+
+    def lugar(self) -> str:
+        if self.rnd.random() < 0.4:
+            return self.rnd.choice(LUGARES)
+        return f"{self.rnd.choice(CALLES)}, {self.rnd.randint(1, 120)}"
+
+    def tenant(self, password_hash: str) -> dict:
+        rnd = self.rnd
+        org = {"_id": oid(self.created, rnd), "nombre": f"Radio Taxi Sintético {self.org_n}",
+               "slug": f"sintetico-{self.org_n}", "cif": f"B{rnd.randint(10**7, 10**8 - 1)}",
+               "activa": True, "created_at": self.created}
+        org_id = str(org["_id"])
+        n_taxistas = rnd.randint(self.args.min_taxistas, self.args.max_taxistas)
+        letras = "BCDFGHJKLMNPRSTVWXYZ"
+        vehiculos = []
+        for i in range(n_taxistas):
+            marca, modelo = rnd.choice(MARCAS)
+            vehiculos.append({
+                "_id": oid(self.created, rnd), "matricula": f"{rnd.randint(0, 9999):04d}{''.join(rnd.choices(letras, k=3))}{i}",
+                "plazas": rnd.choice([4, 4, 4, 5, 7]), "marca": marca, "modelo": modelo,
+                "km_iniciales": rnd.randint(0, 250000), "fecha_compra": self.start_day.strftime("%d/%m/%Y"),
+                "activo": True, "organization_id": org_id, "created_at": self.created,
+            })
+        taxistas = [{
+            "_id": oid(self.created, rnd), "username": f"taxista_{self.org_n}_{i}", "nombre": self.persona(),
+            "role": "taxista", "password": password_hash, "organization_id": org_id, "created_at": self.created,
+            "vehiculo_id": str(v["_id"]), "vehiculo_matricula": v["matricula"],
+        } for i, v in enumerate(vehiculos)]
+        admin = {"_id": oid(self.created, rnd), "username": f"admin_{self.org_n}", "nombre": self.persona(),
+                 "role": "admin", "password": password_hash, "organization_id": org_id, "created_at": self.created}
+        empresas = [{
+            "_id": oid(self.created, rnd), "nombre": f"{rnd.choice(['Hospital', 'Mutua', 'Residencia', 'Hotel', 'Ayuntamiento'])} {rnd.choice(APELLIDOS)} {i}",
+            "numero_cliente": f"{i + 1:04d}", "cif": f"B{rnd.randint(10**7, 10**8 - 1)}", "direccion": self.lugar(),
+            "organization_id": org_id, "created_at": self.created,
+        } for i in range(max(3, n_taxistas // 2))]
+        return {"organization": org, "users": [admin] + taxistas, "vehiculos": vehiculos, "companies": empresas,
+                "taxistas": taxistas}
+
+    def days(self):
+        for offset in range(int(365 * self.args.years)):
+            yield self.start_day + timedelta(days=offset)
+
+    def turno_with_services(self, taxista: dict, vehiculo: dict, empresas: list, day: date, km: int):
+        """(turno, servicios, km al final del turno)"""
+        rnd, args = self.rnd, self.args
+        org_id = taxista["organization_id"]
+        hora_inicio = rnd.randint(5, 9)
+        inicio_utc = self.clock.to_utc(day, hora_inicio, 0)
+        legacy = rnd.random() < args.legacy_fraction
+        turno_id = oid(inicio_utc, rnd)
+        fecha = day.strftime("%d/%m/%Y")
+
+        services = []
+        n_services = max(1, int(rnd.gauss(args.services_per_turno, args.services_per_turno / 3)))
+        step = max(1, (14 * 60) // n_services)
+        minute_of_day = hora_inicio * 60
+        km_turno = 0
+        for _ in range(n_services):
+            minute_of_day = min(23 * 60 + 59, minute_of_day + rnd.randint(step // 2, step))
+            hour, minute = divmod(minute_of_day, 60)
+            service_utc = self.clock.to_utc(day, hour, minute)
+            kilometros = round(rnd.expovariate(1 / 8) + 1, 1)
+            km_turno += kilometros
+            importe = round(3.6 + kilometros * rnd.uniform(1.0, 1.3), 2)
+            espera = round(rnd.choice([0, 0, 0, 0, 2.5, 5.0]), 2)
+            empresa = rnd.choice(empresas) if rnd.random() < 0.3 else None
+            service = {
+                "_id": oid(service_utc, rnd), "taxista_id": str(taxista["_id"]), "taxista_nombre": taxista["nombre"],
+                "turno_id": str(turno_id), "organization_id": org_id,
+                "fecha": fecha, "hora": f"{hour:02d}:{minute:02d}",
+                "origen": self.lugar(), "destino": self.lugar(),
+                "importe": importe, "importe_espera": espera, "importe_total": round(importe + espera, 2),
+                "kilometros": kilometros, "tipo": "empresa" if empresa else "particular",
+                "empresa_id": str(empresa["_id"]) if empresa else None,
+                "empresa_nombre": empresa["nombre"] if empresa else None,
+                "cobrado": empresa is None, "facturar": empresa is not None,
+                "metodo_pago": rnd.choice(["efectivo", "efectivo", "tpv"]),
+                "vehiculo_id": str(vehiculo["_id"]), "vehiculo_matricula": vehiculo["matricula"],
+                "vehiculo_cambiado": False, "created_at": service_utc,
+            }
+            if rnd.random() < args.malformed_fraction:
+                service["fecha"], service["hora"] = rnd.choice(MALFORMED)
+            elif not legacy:
+                service["service_dt_utc"] = service_utc
+                service["updated_at"] = service_utc
+            services.append(service)
+
+        fin_hour, fin_minute = divmod(min(23 * 60 + 59, minute_of_day + rnd.randint(10, 60)), 60)
+        fin_utc = self.clock.to_utc(day, fin_hour, fin_minute)
+        km_fin = km + int(km_turno) + rnd.randint(0, 15)
+        turno = {
+            "_id": turno_id, "taxista_id": str(taxista["_id"]), "taxista_nombre": taxista["nombre"],
+            "vehiculo_id": str(vehiculo["_id"]), "vehiculo_matricula": vehiculo["matricula"],
+            "fecha_inicio": fecha, "hora_inicio": f"{hora_inicio:02d}:00", "km_inicio": km,
+            "fecha_fin": fecha, "hora_fin": f"{fin_hour:02d}:{fin_minute:02d}", "km_fin": km_fin,
+            "cerrado": True, "liquidado": day < date.today() - timedelta(days=7),
+            "combustible": None, "organization_id": org_id, "created_at": inicio_utc,
+        }
+        if rnd.random() < args.refuel_fraction:
+            turno["combustible"] = {
+                "repostado": True, "litros": round(rnd.uniform(20, 55), 1), "vehiculo_id": str(vehiculo["_id"]),
+                "vehiculo_matricula": vehiculo["matricula"], "km_vehiculo": km_fin, "timestamp": fin_utc,
+                "registrado_por_user_id": str(taxista["_id"]),
+            }
+        if not legacy:
+            turno.update(inicio_dt_utc=inicio_utc, fin_dt_utc=fin_utc, updated_at=fin_utc)
+        return turno, services, km_fin
+
+
+class BulkLoader:
+    """Acumula documentos por colección y los inserta en lotes no ordenados"""
+
+    def __init__(self, db, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, collection: str, docs: list):
+        buffer = self.pending.setdefault(collection, [])
+        buffer.extend(docs)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection: str = None):
+        for name in [collection] if collection else list(self.pending):
+            docs = self.pending.get(name)
+            if docs:
+                self.db[name].insert_many(docs, ordered=False, bypass_document_validation=True)
+                self.counts[name] = self.counts.get(name, 0) + len(docs)
+                self.pending[name] = []
+
+
+def load_org(org_n: int, args) -> dict:
+    client = MongoClient(args.mongo_url)
+    loader = BulkLoader(client[args.db], args.batch)
+    gen = OrgGenerator(org_n, args)
+    tenant = gen.tenant(args.password_hash)
+    loader.add("organizations", [tenant["organization"]])
+    for collection in ("users", "vehiculos", "companies"):
+        loader.add(collection, tenant[collection])
+
+    km = {str(v["_id"]): v["km_iniciales"] for v in tenant["vehiculos"]}
+    pairs = list(zip(tenant["taxistas"], tenant["vehiculos"]))
+    for day in gen.days():
+        for taxista, vehiculo in pairs:
+            if gen.rnd.random() > args.work_probability:
+                continue
+            turno, services, km[str(vehiculo["_id"])] = gen.turno_with_services(
+                taxista, vehiculo, tenant["companies"], day, km[str(vehiculo["_id"])]
+            )
+            loader.add("turnos", [turno])
+            loader.add("services", services)
+    loader.flush()
+    client.close()
+    return loader.counts
+
+
+def create_indexes(db):
+    """Índices del manifiesto de la app (db_indexes.py)"""
+    for collection, specs in build_index_manifest().items():
+        for spec in specs:
+            db[collection].create_index(spec["keys"], name=spec["name"], **spec["options"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="taxifast_perf")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--orgs", type=int, default=10)
+    parser.add_argument("--min-taxistas", type=int, default=5)
+    parser.add_argument("--max-taxistas", type=int, default=200)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--work-probability", type=float, default=5 / 7, help="probabilidad de turno por taxista y día")
+    parser.add_argument("--services-per-turno", type=float, default=16, help="media de servicios por turno")
+    parser.add_argument("--refuel-fraction", type=float, default=0.15, help="turnos con repostaje")
+    parser.add_argument("--legacy-fraction", type=float, default=0.05, help="documentos sin *_dt_utc ni updated_at")
+    parser.add_argument("--malformed-fraction", type=float, default=0.0005, help="servicios con fecha/hora malformada")
+    parser.add_argument("--password", default="perf123")
+    parser.add_argument("--batch", type=int, default=10000, help="documentos por insert_many")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos de carga (por organización)")
+    parser.add_argument("--drop", action="store_true", help="vaciar la base de datos antes de cargar")
+    parser.add_argument("--indexes", action="store_true", help="crear los índices del manifiesto tras la carga")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db]
+    if args.drop:
+        client.drop_database(args.db)
+    elif db.organizations.estimated_document_count():
+        sys.exit(f"La base de datos {args.db} ya tiene datos: usa --drop o elige otra con --db")
+
+    # Un solo hash (bcrypt es lento a propósito): todos los usuarios comparten contraseña
+    args.password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(args.password)
+    expected = args.orgs * (args.min_taxistas + args.max_taxistas) / 2 * 365 * args.years * args.work_probability
+    print(f"[DATASET] {args.orgs} orgs, {args.years:g} años: ~{expected:,.0f} turnos, "
+          f"~{expected * args.services_per_turno:,.0f} servicios (seed {args.seed}, {args.workers} procesos)")
+
+    started = time.perf_counter()
+    totals = {}
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        results = (pool.map if pool else map)(load_org, range(args.orgs), [args] * args.orgs)
+        for org_n, counts in enumerate(results):
+            for name, n in counts.items():
+                totals[name] = totals.get(name, 0) + n
+            print(f"[DATASET] org {org_n}: {counts.get('services', 0):,} servicios")
+    finally:
+        if pool:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    total_docs = sum(totals.values())
+    print(f"[DATASET] {total_docs:,} documentos en {elapsed:.0f}s ({total_docs / max(elapsed, 0.001):,.0f} docs/s): "
+          + ", ".join(f"{name} {n:,}" for name, n in sorted(totals.items())))
+
+    if args.indexes:
+        started = time.perf_counter()
+        create_indexes(db)
+        print(f"[DATASET] Índices creados en {time.perf_counter() - started:.0f}s")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+Load test reproducible del backend, en proceso (sin red ni servidor HTTP).
+
+Arranca la app (startup incluido) contra un mongod local, siembra tenants realistas
+y ejecuta escenarios concurrentes:
+
+  shift_start        login + turno activo + create_turno de cada taxista
+  service_storm      ráfaga de POST /services con el turno abierto
+  offline_sync       lotes de POST /services/sync (con client_uuid)
+  admin_dashboard    listados, reporte diario y estadísticas de cada admin
+  month_end_exports  exports Excel/PDF/ZIP del mes anterior
+
+Resultado: throughput y p50/p95/p99 por endpoint en un JSON (--out) comparable
+entre commits con --compare.
+
+Necesita un mongod real (local o de pruebas, nunca producción: vacía --db): el
+startup y los endpoints usan $lookup con pipeline + localField, $indexStats,
+$collStats y pymongo.timeout, que un Mongo simulado en memoria no soporta.
+
+Uso:
+    MONGO_URL=mongodb://localhost:27017 python scripts/loadtest.py --out loadtest.json
+    MONGO_URL=mongodb://localhost:27017 python scripts/loadtest.py --orgs 2 --taxistas 10
+    python scripts/loadtest.py --compare base.json --out head.json --max-regression 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCENARIOS = ("shift_start", "service_storm", "offline_sync", "admin_dashboard", "month_end_exports")
+PASSWORD = "loadtest123"
+
+ORIGENES = ["Estación de tren", "Hospital", "Aeropuerto", "Plaza Mayor", "Centro de salud", "Polígono industrial"]
+DESTINOS = ["Calle Real", "Avenida de Galicia", "Barrio del Carmen", "Estación de autobuses", "Colegio", "Residencia"]
+
+
+# ------------------------------------------------------------------
+# Cliente ASGI
+# ------------------------------------------------------------------
+class ASGIClient:
+    """Envía requests directamente a la app ASGI y devuelve (status, body)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, token: str = None, json_body=None, params: dict = None):
+        body = json.dumps(json_body).encode() if json_body is not None else b""
+        headers = [(b"host", b"loadtest"), (b"content-length", str(len(body)).encode())]
+        if json_body is not None:
+            headers.append((b"content-type", b"application/json"))
+        if token:
+            headers.append((b"authorization", f"Bearer {token}".encode()))
+        query = urlencode({k: v for k, v in (params or {}).items() if v is not None})
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": query.encode(), "headers": headers,
+            "client": ("127.0.0.1", 1), "server": ("loadtest", 80),
+        }
+        sent = False
+        disconnected = asyncio.Event()
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    disconnected.set()
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class Recorder:
+    """Latencias y errores por endpoint (etiqueta "MÉTODO /ruta/plantilla")"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+
+    async def call(self, client: ASGIClient, label: str, method: str, path: str, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        status, body = await client.request(method, path, **kwargs)
+        self.samples[label].append((time.perf_counter() - started) * 1000)
+        if status not in expected:
+            self.errors[(label, status)] += 1
+        return status, body
+
+    def report(self, wall_seconds: float) -> dict:
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            endpoints[label] = {
+                "count": len(ordered),
+                "errors": {str(status): n for (lbl, status), n in self.errors.items() if lbl == label},
+                "throughput_rps": round(len(ordered) / wall_seconds, 2) if wall_seconds else None,
+                "p50_ms": round(percentile(ordered, 50), 2),
+                "p95_ms": round(percentile(ordered, 95), 2),
+                "p99_ms": round(percentile(ordered, 99), 2),
+                "max_ms": round(ordered[-1], 2),
+            }
+        total = sum(len(s) for s in self.samples.values())
+        return {
+            "wall_seconds": round(wall_seconds, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / wall_seconds, 2) if wall_seconds else None,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    # nearest-rank
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+# ------------------------------------------------------------------
+# Datos
+# ------------------------------------------------------------------
+async def seed_tenants(server, db, args, rnd: random.Random) -> list:
+    """Organizaciones con admin, taxistas, vehículos, empresas e histórico de turnos cerrados"""
+    password_hash = server.get_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    tenants = []
+    for org_n in range(args.orgs):
+        org = {"nombre": f"Radio Taxi Carga {org_n}", "slug": f"carga-{org_n}", "activa": True, "created_at": now}
+        org_id = str((await db.organizations.insert_one(org)).inserted_id)
+        admin = {"username": f"lt_admin_{org_n}", "nombre": f"Admin {org_n}", "role": "admin",
+                 "password": password_hash, "organization_id": org_id, "created_at": now}
+        admin["_id"] = (await db.users.insert_one(admin)).inserted_id
+
+        vehiculos = [{
+            "matricula": f"{1000 + i:04d}{'BCDFGHJKLM'[org_n % 10]}LT", "plazas": 4, "marca": "Toyota",
+            "modelo": "Prius", "km_iniciales": rnd.randint(10000, 300000), "fecha_compra": "01/01/2020",
+            "activo": True, "organization_id": org_id, "created_at": now,
+        } for i in range(args.taxistas)]
+        await db.vehiculos.insert_many(vehiculos)
+        empresas = [{
+            "nombre": f"Empresa {org_n}-{i}", "numero_cliente": f"C{i:03d}", "cif": f"B{rnd.randint(10**7, 10**8 - 1)}",
+            "organization_id": org_id, "created_at": now,
+        } for i in range(args.empresas)]
+        await db.companies.insert_many(empresas)
+
+        taxistas = []
+        for i, vehiculo in enumerate(vehiculos):
+            taxistas.append({
+                "username": f"lt_taxista_{org_n}_{i}", "nombre": f"Taxista {org_n}-{i}", "role": "taxista",
+                "password": password_hash, "organization_id": org_id, "created_at": now,
+                "vehiculo_id": str(vehiculo["_id"]), "vehiculo_matricula": vehiculo["matricula"],
+            })
+        await db.users.insert_many(taxistas)
+
+        await seed_history(db, org_id, taxistas, empresas, args, rnd)
+        tenants.append({"org_id": org_id, "admin": admin, "taxistas": taxistas, "empresas": empresas})
+    return tenants
+
+
+async def seed_history(db, org_id: str, taxistas: list, empresas: list, args, rnd: random.Random):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    turnos, services = [], []
+    for day in range(args.history_days, 0, -1):
+        fecha_dt = today - timedelta(days=day)
+        fecha = fecha_dt.strftime("%d/%m/%Y")
+        for taxista in taxistas:
+            turno_id = ObjectId()
+            km_inicio = rnd.randint(10000, 300000)
+            km_total = 0
+            for n in range(args.services_per_turno):
+                importe = round(rnd.uniform(4, 60), 2)
+                kilometros = round(rnd.uniform(1, 30), 1)
+                km_total += kilometros
+                empresa = rnd.choice(empresas) if empresas and rnd.random() < 0.35 else None
+                services.append({
+                    "taxista_id": str(taxista["_id"]), "taxista_nombre": taxista["nombre"],
+                    "turno_id": str(turno_id), "organization_id": org_id,
+                    "fecha": fecha, "hora": f"{7 + n % 14:02d}:{rnd.randint(0, 59):02d}",
+                    "origen": rnd.choice(ORIGENES), "destino": rnd.choice(DESTINOS),
+                    "importe": importe, "importe_espera": 0, "importe_total": importe, "kilometros": kilometros,
+                    "tipo": "empresa" if empresa else "particular",
+                    "empresa_id": str(empresa["_id"]) if empresa else None,
+                    "empresa_nombre": empresa["nombre"] if empresa else None,
+                    "cobrado": empresa is None, "facturar": empresa is not None, "metodo_pago": "efectivo",
+                    "vehiculo_id": taxista["vehiculo_id"], "vehiculo_matricula": taxista["vehiculo_matricula"],
+                    "created_at": fecha_dt, "updated_at": fecha_dt,
+                })
+            turnos.append({
+                "_id": turno_id, "taxista_id": str(taxista["_id"]), "taxista_nombre": taxista["nombre"],
+                "vehiculo_id": taxista["vehiculo_id"], "vehiculo_matricula": taxista["vehiculo_matricula"],
+                "fecha_inicio": fecha, "hora_inicio": "07:00", "km_inicio": km_inicio,
+                "fecha_fin": fecha, "hora_fin": "21:00", "km_fin": km_inicio + int(km_total),
+                "cerrado": True, "liquidado": day > 7, "organization_id": org_id,
+                "created_at": fecha_dt, "updated_at": fecha_dt,
+            })
+    if turnos:
+        await db.turnos.insert_many(turnos, ordered=False)
+    for start in range(0, len(services), 5000):
+        await db.services.insert_many(services[start:start + 5000], ordered=False)
+
+
+def service_payload(taxista: dict, rnd: random.Random, client_uuid: str = None) -> dict:
+    now = datetime.utcnow()
+    importe = round(rnd.uniform(4, 60), 2)
+    return {
+        "fecha": now.strftime("%d/%m/%Y"), "hora": now.strftime("%H:%M"),
+        "origen": rnd.choice(ORIGENES), "destino": rnd.choice(DESTINOS),
+        "importe": importe, "importe_espera": 0, "kilometros": round(rnd.uniform(1, 30), 1),
+        "tipo": "particular", "metodo_pago": rnd.choice(["efectivo", "tpv"]), "client_uuid": client_uuid,
+    }
+
+
+# ------------------------------------------------------------------
+# Escenarios
+# ------------------------------------------------------------------
+class Context:
+    def __init__(self, server, client: ASGIClient, tenants: list, args, rnd: random.Random):
+        self.server = server
+        self.client = client
+        self.tenants = tenants
+        self.args = args
+        self.rnd = rnd
+        self.tokens = {}
+
+    def token(self, user: dict) -> str:
+        if user["username"] not in self.tokens:
+            self.tokens[user["username"]] = self.server.create_access_token({"sub": user["username"]})
+        return self.tokens[user["username"]]
+
+    @property
+    def taxistas(self) -> list:
+        return [t for tenant in self.tenants for t in tenant["taxistas"]]
+
+    async def ensure_open_turno(self, taxista: dict):
+        """Abre turno sin medirlo (para escenarios que lo necesitan sin shift_start)"""
+        status, body = await self.client.request("GET", "/api/turnos/activo", token=self.token(taxista))
+        if status == 200 and json.loads(body or b"null"):
+            return
+        await self.client.request("POST", "/api/turnos", token=self.token(taxista), json_body=turno_payload(taxista))
+
+
+def turno_payload(taxista: dict) -> dict:
+    now = datetime.utcnow()
+    return {
+        "taxista_id": str(taxista["_id"]), "taxista_nombre": taxista["nombre"],
+        "vehiculo_id": taxista["vehiculo_id"], "vehiculo_matricula": taxista["vehiculo_matricula"],
+        "fecha_inicio": now.strftime("%d/%m/%Y"), "hora_inicio": now.strftime("%H:%M"), "km_inicio": 100000,
+    }
+
+
+async def scenario_shift_start(ctx: Context, rec: Recorder) -> list:
+    async def start(taxista):
+        status, body = await rec.call(ctx.client, "POST /api/auth/login", "POST", "/api/auth/login",
+                                      json_body={"username": taxista["username"], "password": PASSWORD})
+        if status != 200:
+            return
+        token = json.loads(body)["access_token"]
+        ctx.tokens[taxista["username"]] = token
+        status, body = await rec.call(ctx.client, "GET /api/turnos/activo", "GET", "/api/turnos/activo", token=token)
+        if status == 200 and not json.loads(body or b"null"):
+            await rec.call(ctx.client, "POST /api/turnos", "POST", "/api/turnos", token=token, json_body=turno_payload(taxista))
+    return [lambda t=t: start(t) for t in ctx.taxistas]
+
+
+async def scenario_service_storm(ctx: Context, rec: Recorder) -> list:
+    for taxista in ctx.taxistas:
+        await ctx.ensure_open_turno(taxista)
+
+    async def create(taxista):
+        await rec.call(ctx.client, "POST /api/services", "POST", "/api/services", token=ctx.token(taxista),
+                       json_body=service_payload(taxista, ctx.rnd, str(uuid.UUID(int=ctx.rnd.getrandbits(128)))))
+    return [lambda t=t: create(t) for t in ctx.taxistas for _ in range(ctx.args.storm_services)]
+
+
+async def scenario_offline_sync(ctx: Context, rec: Recorder) -> list:
+    for taxista in ctx.taxistas:
+        await ctx.ensure_open_turno(taxista)
+
+    async def sync(taxista):
+        batch = [
+            service_payload(taxista, ctx.rnd, str(uuid.UUID(int=ctx.rnd.getrandbits(128))))
+            for _ in range(ctx.args.sync_batch)
+        ]
+        await rec.call(ctx.client, "POST /api/services/sync", "POST", "/api/services/sync",
+                       token=ctx.token(taxista), json_body={"services": batch})
+    return [lambda t=t: sync(t) for t in ctx.taxistas for _ in range(ctx.args.sync_rounds)]
+
+
+def previous_month_range() -> tuple:
+    first_this_month = datetime.utcnow().replace(day=1)
+    last_prev = first_this_month - timedelta(days=1)
+    return last_prev.replace(day=1).strftime("%d/%m/%Y"), last_prev.strftime("%d/%m/%Y")
+
+
+async def scenario_admin_dashboard(ctx: Context, rec: Recorder) -> list:
+    ayer = (datetime.utcnow() - timedelta(days=1)).strftime("%d/%m/%Y")
+    desde = (datetime.utcnow() - timedelta(days=7)).strftime("%d/%m/%Y")
+    calls = [
+        ("GET /api/turnos", "/api/turnos", {"limit": 200}),
+        ("GET /api/services", "/api/services", {"limit": 1000}),
+        ("GET /api/reportes/diario", "/api/reportes/diario", {"fecha": ayer}),
+        ("GET /api/turnos/estadisticas", "/api/turnos/estadisticas", {"fecha_inicio": desde}),
+        ("GET /api/companies", "/api/companies", None),
+        ("GET /api/vehiculos", "/api/vehiculos", None),
+        ("GET /api/users", "/api/users", None),
+    ]
+
+    async def load(admin):
+        token = ctx.token(admin)
+        # Un dashboard pide sus paneles en paralelo
+        await asyncio.gather(*[
+            rec.call(ctx.client, label, "GET", path, token=token, params=params) for label, path, params in calls
+        ])
+    return [lambda a=tenant["admin"]: load(a) for tenant in ctx.tenants for _ in range(ctx.args.dashboard_loads)]
+
+
+async def scenario_month_end_exports(ctx: Context, rec: Recorder) -> list:
+    fecha_inicio, fecha_fin = previous_month_range()
+    params = {"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin}
+    exports = [
+        ("GET /api/turnos/export/excel", "/api/turnos/export/excel", params),
+        ("GET /api/turnos/export/pdf", "/api/turnos/export/pdf", params),
+        ("GET /api/services/export/excel", "/api/services/export/excel", params),
+        ("GET /api/services/export/pdf", "/api/services/export/pdf", params),
+        ("GET /api/turnos/export/bundle", "/api/turnos/export/bundle", {**params, "formato": "pdf"}),
+    ]
+
+    async def export(admin, label, path, query):
+        await rec.call(ctx.client, label, "GET", path, token=ctx.token(admin), params=query)
+    return [
+        lambda a=tenant["admin"], e=e: export(a, *e)
+        for tenant in ctx.tenants for e in exports
+    ]
+
+
+SCENARIO_FUNCS = {
+    "shift_start": scenario_shift_start,
+    "service_storm": scenario_service_storm,
+    "offline_sync": scenario_offline_sync,
+    "admin_dashboard": scenario_admin_dashboard,
+    "month_end_exports": scenario_month_end_exports,
+}
+
+
+async def run_scenario(name: str, ctx: Context) -> dict:
+    rec = Recorder()
+    jobs = await SCENARIO_FUNCS[name](ctx, rec)
+    semaphore = asyncio.Semaphore(ctx.args.concurrency)
+
+    async def limited(job):
+        async with semaphore:
+            await job()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[limited(job) for job in jobs])
+    result = rec.report(time.perf_counter() - started)
+    print(f"\n== {name}: {result['requests']} requests en {result['wall_seconds']:.2f}s "
+          f"({result['throughput_rps']} req/s, {result['errors']} errores)")
+    print(f"{'endpoint':42}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in result["endpoints"].items():
+        errors = f"  errores {stats['errors']}" if stats["errors"] else ""
+        print(f"{label:42}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{errors}")
+    return result
+
+
+# ------------------------------------------------------------------
+# Comparación entre artefactos
+# ------------------------------------------------------------------
+def compare(baseline: dict, current: dict, max_regression: float) -> bool:
+    """Imprime p95 y throughput base -> actual; True si algún p95 empeora más de max_regression %"""
+    regressed = False
+    print(f"\n== Comparación con {baseline['meta'].get('git_sha')} (p95 ms)")
+    for name, scenario in current["scenarios"].items():
+        base_scenario = baseline["scenarios"].get(name)
+        if not base_scenario:
+            continue
+        for label, stats in scenario["endpoints"].items():
+            base = base_scenario["endpoints"].get(label)
+            if not base or not base["p95_ms"]:
+                continue
+            delta = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+            flag = ""
+            if max_regression is not None and delta > max_regression:
+                flag = "  REGRESIÓN"
+                regressed = True
+            print(f"{name:18}{label:42}{base['p95_ms']:>9.1f} -> {stats['p95_ms']:>9.1f}  ({delta:+.0f}%){flag}")
+    return regressed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="taxifast_loadtest", help="base de datos (se vacía al empezar)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--orgs", type=int, default=3)
+    parser.add_argument("--taxistas", type=int, default=20, help="taxistas por organización")
+    parser.add_argument("--empresas", type=int, default=15, help="empresas cliente por organización")
+    parser.add_argument("--history-days", type=int, default=45, help="días de histórico sembrado")
+    parser.add_argument("--services-per-turno", type=int, default=12)
+    parser.add_argument("--storm-services", type=int, default=20, help="servicios por taxista en service_storm")
+    parser.add_argument("--sync-batch", type=int, default=25, help="servicios por POST /services/sync")
+    parser.add_argument("--sync-rounds", type=int, default=2)
+    parser.add_argument("--dashboard-loads", type=int, default=10, help="cargas del dashboard por admin")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--out", default=None, help="fichero JSON de resultados")
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--max-regression", type=float, default=None, help="exit 1 si algún p95 empeora más de este %%")
+    parser.add_argument("--keep", action="store_true", help="no vaciar la base de datos al terminar")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    # Antes de importar server: la app usa DB_NAME al crear el cliente
+    os.environ["DB_NAME"] = args.db
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    import server
+    db = server.db
+    # El log por request (I/O a stderr) no es objeto de la medición
+    logging.getLogger("server").setLevel(logging.WARNING)
+    try:
+        await server.client.admin.command("ping")
+    except Exception as e:
+        sys.exit(f"mongod no disponible en MONGO_URL ({str(e)[:200]}): el load test necesita un mongod real")
+
+    rnd = random.Random(args.seed)
+    await server.client.drop_database(args.db)
+    started = time.perf_counter()
+    tenants = await seed_tenants(server, db, args, rnd)
+    print(f"[SEED] {args.orgs} organizaciones x {args.taxistas} taxistas, {args.history_days} días de histórico "
+          f"en {time.perf_counter() - started:.1f}s")
+
+    await server.app.router.startup()
+    try:
+        # Índices y migraciones del startup corren en segundo plano: medir con ellos terminados
+        await server.index_reconciler.wait()
+        await server.migration_runner.wait()
+        ctx = Context(server, ASGIClient(server.app), tenants, args, rnd)
+        results = {name: await run_scenario(name, ctx) for name in scenarios}
+    finally:
+        # Primero el shutdown: MetricsAggregator.stop() escribe su estado y recrearía la DB borrada
+        await server.app.router.shutdown()
+        if not args.keep:
+            # El shutdown cierra el cliente de la app
+            cleanup_client = server.AsyncIOMotorClient(os.environ["MONGO_URL"])
+            try:
+                await cleanup_client.drop_database(args.db)
+            finally:
+                cleanup_client.close()
+
+    artifact = {
+        "meta": {
+            "git_sha": server.get_build_info()["git_sha"],
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "max_regression", "keep")},
+        },
+        "scenarios": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(artifact, f, indent=2)
+        print(f"\nResultados en {args.out}")
+
+    regressed = False
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(json.load(f), artifact, args.max_regression)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
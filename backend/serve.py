@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Launcher de producción del backend.
+
+    python serve.py                 # workers = nº de CPUs, puerto $PORT (8001)
+    WEB_CONCURRENCY=4 python serve.py
+
+- Workers: WEB_CONCURRENCY o, si no está definido, el nº de CPUs disponibles.
+  Cada worker es un proceso nuevo (spawn) que importa server.py y crea su propio
+  cliente Motor; el pool de cada uno sale de MONGO_CONNECTION_BUDGET / workers.
+  Si hay más workers que conexiones en el presupuesto no arranca; con menos de
+  MIN_POOL_PER_WORKER conexiones por worker avisa.
+- uvloop y httptools si están instalados (si no, asyncio y h11).
+- SIGTERM: deja de aceptar conexiones y espera hasta GRACEFUL_SHUTDOWN_SECONDS a
+  los requests en curso (exports incluidos) antes del shutdown de la app. El
+  terminationGracePeriod del orquestador debe ser mayor.
+
+`uvicorn server:app` sigue funcionando para desarrollo (un worker).
+"""
+import importlib.util
+import os
+import sys
+
+import uvicorn
+
+GRACEFUL_SHUTDOWN_SECONDS = int(os.environ.get("GRACEFUL_SHUTDOWN_SECONDS", "120"))
+# Mismo default que server.py
+MONGO_CONNECTION_BUDGET = int(os.environ.get("MONGO_CONNECTION_BUDGET", "50"))
+# Por debajo, cada worker encola sus operaciones Mongo esperando conexión
+MIN_POOL_PER_WORKER = 5
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # respeta cpusets del contenedor
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count() -> int:
+    configured = int(os.environ.get("WEB_CONCURRENCY", "0"))
+    return configured if configured > 0 else available_cpus()
+
+
+def main():
+    workers = worker_count()
+    if not os.environ.get("MONGO_MAX_POOL_SIZE"):
+        pool = MONGO_CONNECTION_BUDGET // workers
+        if pool < 1:
+            sys.exit(
+                f"[SERVE] {workers} workers con MONGO_CONNECTION_BUDGET={MONGO_CONNECTION_BUDGET}: "
+                f"no hay ni una conexión por worker. Reduce WEB_CONCURRENCY o sube el presupuesto."
+            )
+        if pool < MIN_POOL_PER_WORKER:
+            print(
+                f"[SERVE] AVISO: pool Mongo de {pool} conexiones por worker "
+                f"(MONGO_CONNECTION_BUDGET={MONGO_CONNECTION_BUDGET} / {workers} workers); "
+                f"considera menos workers (WEB_CONCURRENCY) o un presupuesto mayor"
+            )
+    # Lo heredan los workers: server.py reparte el presupuesto de conexiones entre ellos
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    print(f"[SERVE] {workers} workers | loop={loop} | http={http} | graceful shutdown {GRACEFUL_SHUTDOWN_SECONDS}s")
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8001")),
+        workers=workers,
+        loop=loop,
+        http=http,
+        lifespan="on",
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "*"),
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+        # RequestObservabilityMiddleware ya registra cada request
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,124 +1,32 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import MutableHeaders
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 
-import subprocess
-
-def get_git_sha() -> str:
-    """Return short git SHA if available, else env GIT_SHA, else 'unknown'."""
-    # Prefer real repo SHA when .git exists (Emergent preview), then fall back to env
-    try:
-        sha = subprocess.check_output(
-            ["git", "rev-parse", "--short", "HEAD"],
-            cwd=str(pathlib.Path(__file__).resolve().parent.parent),
-            stderr=subprocess.DEVNULL,
-            text=True,
-        ).strip()
-        if sha:
-            return sha
-    except Exception:
-        pass
-    val = os.environ.get("GIT_SHA")
-    if not val or not str(val).strip():
-        return "unknown"
-    return val
-import pathlib
 import os
 import logging
 import secrets
 from pathlib import Path
 from urllib.parse import urlparse
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Callable, List, Optional, Type
 from bson import ObjectId
 import csv
 import io
-import pytz
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-
-# Zona horaria de España
-SPAIN_TZ = pytz.timezone('Europe/Madrid')
+from db_indexes import RETIRED_INDEXES, build_index_manifest, index_usage_report, reconcile_plan
+# Conversión hora de España -> UTC con offsets cacheados por día (ver spain_time.py)
+from spain_time import SPAIN_TZ, get_date_range_utc, parse_spanish_date_to_utc, parse_spanish_dates_to_utc
 
 def get_spain_now():
     """Obtener la hora actual en España"""
     return datetime.now(SPAIN_TZ)
 
-def parse_spanish_date_to_utc(fecha_str: str, hora_str: str = "00:00") -> Optional[datetime]:
-    """
-    Convierte fecha dd/mm/yyyy O yyyy-mm-dd + hora HH:mm (hora de España) a datetime UTC.
-    Retorna None si el formato es inválido.
-    """
-    try:
-        if not fecha_str:
-            return None
-        
-        # Si ya es un datetime, devolverlo (para datos que ya fueron migrados)
-        if isinstance(fecha_str, datetime):
-            return fecha_str
-        
-        # Intentar parsear en diferentes formatos
-        day, month, year = None, None, None
-        
-        # Formato español: dd/mm/yyyy
-        if "/" in fecha_str:
-            parts = fecha_str.split("/")
-            if len(parts) == 3:
-                day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
-        # Formato ISO: yyyy-mm-dd
-        elif "-" in fecha_str:
-            parts = fecha_str.split("-")
-            if len(parts) == 3:
-                year, month, day = int(parts[0]), int(parts[1]), int(parts[2])
-        
-        if day is None or month is None or year is None:
-            return None
-        
-        # Parsear hora (default 00:00 si no se proporciona)
-        hora_str = hora_str or "00:00"
-        if isinstance(hora_str, datetime):
-            hour, minute = hora_str.hour, hora_str.minute
-        else:
-            hora_parts = hora_str.split(":")
-            hour = int(hora_parts[0]) if len(hora_parts) >= 1 else 0
-            minute = int(hora_parts[1]) if len(hora_parts) >= 2 else 0
-        
-        # Crear datetime naive en hora de España
-        local_dt = datetime(year, month, day, hour, minute, 0)
-        # Localizar a España
-        spain_dt = SPAIN_TZ.localize(local_dt)
-        # Convertir a UTC
-        utc_dt = spain_dt.astimezone(pytz.UTC).replace(tzinfo=None)
-        return utc_dt
-    except (ValueError, TypeError, IndexError, AttributeError) as e:
-        logger.warning(f"Error parsing date '{fecha_str}' + '{hora_str}': {e}")
-        return None
-
-def get_date_range_utc(start_date: str, end_date: str) -> tuple:
-    """
-    Convierte rango de fechas dd/mm/yyyy (España) a rango UTC para queries.
-    start_date 00:00:00 España -> UTC
-    end_date 23:59:59 España -> UTC
-    Retorna (start_utc, end_utc) o (None, None) si inválido.
-    """
-    start_utc = parse_spanish_date_to_utc(start_date, "00:00")
-    end_utc = parse_spanish_date_to_utc(end_date, "23:59")
-    if end_utc:
-        # Añadir 59 segundos para incluir todo el último minuto
-        end_utc = end_utc.replace(second=59, microsecond=999999)
-    return (start_utc, end_utc)
-
 # Simple in-memory cache
 class SimpleCache:
     """Cache simple en memoria para datos consultados frecuentemente"""
@@ -180,27 +88,412 @@ if not db_name:
     if not db_name:
         raise ValueError("DB_NAME or MONGODB_DB_NAME must be set in environment variables")
 
+# ==========================================
+# MONGO COMMAND ACCOUNTING (por request)
+# ==========================================
+# Motor ejecuta cada operación en su executor copiando el contexto (contextvars),
+# así que el listener ve el RequestDBStats del request que lanzó el comando.
+import asyncio
+import contextvars
+import json
+import random
+import threading
+import pymongo
+from pymongo import monitoring
+from pymongo.errors import PyMongoError, ServerSelectionTimeoutError
+
+# Presupuesto de comandos Mongo por request: por encima se marca como posible N+1
+DB_QUERY_BUDGET = int(os.environ.get("DB_QUERY_BUDGET", "25"))
+
+class RequestDBStats:
+    """Contador de comandos y tiempo en Mongo de un request"""
+    __slots__ = ("calls", "time_ms", "_lock")
+
+    def __init__(self):
+        self.calls = 0
+        self.time_ms = 0.0
+        self._lock = threading.Lock()  # comandos concurrentes del mismo request (gather)
+
+    def add(self, duration_ms: float):
+        with self._lock:
+            self.calls += 1
+            self.time_ms += duration_ms
+
+_request_db_stats: contextvars.ContextVar = contextvars.ContextVar("request_db_stats", default=None)
+
+# Captura de explain para comandos lentos (muestreada y con rate limit)
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get("SLOW_QUERY_THRESHOLD_MS", "500"))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_MAX_PER_MINUTE = int(os.environ.get("SLOW_QUERY_MAX_PER_MINUTE", "6"))
+SLOW_QUERY_CAPPED_BYTES = int(os.environ.get("SLOW_QUERY_CAPPED_BYTES", str(16 * 1024 * 1024)))
+# Solo lecturas: explain de escrituras no aporta y no queremos re-ejecutarlas
+EXPLAINABLE_COMMANDS = frozenset({"find", "aggregate", "count", "distinct"})
+# Campos de sesión/transporte que no forman parte del comando a explicar
+_COMMAND_TRANSPORT_FIELDS = frozenset({"lsid", "txnNumber", "autocommit", "startTransaction"})
+
+def _explainable_command(command: dict) -> dict:
+    return {k: v for k, v in command.items() if not k.startswith("$") and k not in _COMMAND_TRANSPORT_FIELDS}
+
+def _find_explain_section(doc, key: str):
+    """Busca la primera sección `key` en un explain (find y aggregate la anidan distinto)"""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        values = doc.values()
+    elif isinstance(doc, list):
+        values = doc
+    else:
+        return None
+    for value in values:
+        found = _find_explain_section(value, key)
+        if found is not None:
+            return found
+    return None
+
+def _collect_plan_stages(plan, stages: list, indexes: list):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        for value in plan.values():
+            _collect_plan_stages(value, stages, indexes)
+    elif isinstance(plan, list):
+        for value in plan:
+            _collect_plan_stages(value, stages, indexes)
+
+def summarize_explain(explain: dict) -> dict:
+    """Plan ganador, índices usados y claves/documentos examinados de un explain executionStats"""
+    planner = _find_explain_section(explain, "queryPlanner") or {}
+    stats = _find_explain_section(explain, "executionStats") or {}
+    winning_plan = planner.get("winningPlan", {})
+    stages, indexes = [], []
+    _collect_plan_stages(winning_plan, stages, indexes)
+    return {
+        "winning_plan": winning_plan,
+        "stages": stages,
+        "index_used": indexes[0] if indexes else None,
+        "indexes_used": indexes,
+        "collscan": "COLLSCAN" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "n_returned": stats.get("nReturned"),
+        "explain_time_ms": stats.get("executionTimeMillis"),
+    }
+
+class SlowQueryExplainer:
+    """
+    Detecta lecturas más lentas que SLOW_QUERY_THRESHOLD_MS y las re-ejecuta con
+    explain("executionStats") en segundo plano, guardando el resumen en la colección
+    capped `slow_queries`. Los eventos llegan desde hilos del executor de Motor; el
+    explain se agenda en el event loop registrado con attach() en el startup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # {(connection_id, request_id): (database_name, command)}
+        self._window_start = 0.0
+        self._window_count = 0
+        self._loop = None
+        self._tasks = set()
+
+    def attach(self, loop):
+        self._loop = loop
+
+    def started(self, event):
+        if self._loop is None or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def finished(self, event, succeeded: bool):
+        if self._loop is None or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or not succeeded or duration_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+        if random.random() >= SLOW_QUERY_SAMPLE_RATE or not self._take_slot():
+            return
+        database_name, command = pending
+        # Contexto vacío: el explain no hereda el deadline ni la contabilidad del request
+        self._loop.call_soon_threadsafe(
+            self._schedule, database_name, event.command_name, _explainable_command(command), duration_ms,
+            context=contextvars.Context()
+        )
+
+    def _take_slot(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_count = 0
+            if self._window_count >= SLOW_QUERY_MAX_PER_MINUTE:
+                return False
+            self._window_count += 1
+            return True
+
+    def _schedule(self, database_name: str, command_name: str, command: dict, duration_ms: float):
+        task = asyncio.ensure_future(self._capture(database_name, command_name, command, duration_ms))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _capture(self, database_name: str, command_name: str, command: dict, duration_ms: float):
+        try:
+            explain = await client[database_name].command({"explain": command, "verbosity": "executionStats"})
+            summary = summarize_explain(explain)
+            await client[database_name].slow_queries.insert_one({
+                "created_at": datetime.utcnow(),
+                "collection": command.get(command_name),
+                "command_name": command_name,
+                "duration_ms": round(duration_ms, 1),
+                # Serializados: filtros/planes contienen claves con $ y valores BSON arbitrarios
+                "command": json.dumps(command, default=str)[:8000],
+                "winning_plan": json.dumps(summary.pop("winning_plan"), default=str)[:16000],
+                **summary,
+            })
+            if summary["collscan"]:
+                logger.warning(
+                    f"[SLOW_QUERY] COLLSCAN {command_name} {command.get(command_name)} "
+                    f"({duration_ms:.0f}ms, docs_examined={summary['docs_examined']})"
+                )
+        except Exception as e:
+            logger.warning(f"[SLOW_QUERY] No se pudo capturar explain de {command_name}: {e}")
+
+slow_query_explainer = SlowQueryExplainer()
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Uso del pool de conexiones de Motor/pymongo (suma de todos los servidores)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def snapshot(self, max_pool_size: int) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+                "max_pool_size": max_pool_size,
+                "utilization": round(self.checked_out / max(max_pool_size, 1), 3),
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+pool_stats = PoolStatsListener()
+
+# Deadline del request en curso (ver route_deadline): (deadline monotonic, presupuesto s, clase)
+_request_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+def _deadline_nearly_expired(margin_seconds: float = 0.5) -> bool:
+    deadline = _request_deadline.get()
+    return deadline is not None and time.monotonic() >= deadline[0] - margin_seconds
+
+# Circuit breaker de Mongo: tras N fallos de red/timeout consecutivos los requests /api
+# fallan al instante con 503 + Retry-After en lugar de esperar los 10s de timeout.
+DB_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("DB_BREAKER_FAILURE_THRESHOLD", "5"))
+DB_BREAKER_OPEN_SECONDS = int(os.environ.get("DB_BREAKER_OPEN_SECONDS", "15"))
+DB_BREAKER_HALF_OPEN_REQUESTS = int(os.environ.get("DB_BREAKER_HALF_OPEN_REQUESTS", "1"))
+# errtype de CommandFailedEvent para errores de red (los errores del servidor traen su respuesta)
+_NETWORK_FAILURE_TYPES = frozenset({"AutoReconnect", "ConnectionFailure", "NetworkTimeout", "NotPrimaryError"})
+
+class MongoCircuitBreaker:
+    """
+    closed -> (N fallos consecutivos) -> open -> (DB_BREAKER_OPEN_SECONDS) -> half_open
+    half_open deja pasar DB_BREAKER_HALF_OPEN_REQUESTS requests de prueba:
+    un comando correcto cierra el circuito, un fallo lo vuelve a abrir.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.trips = 0
+        self.rejected = 0
+        self.last_failure = None
+
+    def before_request(self):
+        """(permitido, es_probe, retry_after_segundos)"""
+        if self.state == self.CLOSED:
+            return True, False, 0
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + DB_BREAKER_OPEN_SECONDS - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    return False, False, max(1, int(remaining + 0.999))
+                self.state = self.HALF_OPEN
+                self._probes_in_flight = 0
+                logger.warning("[DB_BREAKER] half_open: probando Mongo con requests reales")
+            if self.state == self.HALF_OPEN:
+                if self._probes_in_flight >= DB_BREAKER_HALF_OPEN_REQUESTS:
+                    self.rejected += 1
+                    return False, False, 1
+                self._probes_in_flight += 1
+                return True, True, 0
+            return True, False, 0
+
+    def release_probe(self):
+        with self._lock:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record_success(self):
+        if self.state == self.CLOSED and self._consecutive_failures == 0:
+            return  # camino rápido: sin lock
+        with self._lock:
+            self._consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                logger.warning("[DB_BREAKER] closed: Mongo responde de nuevo")
+
+    def record_failure(self, reason: str):
+        with self._lock:
+            self._consecutive_failures += 1
+            self.last_failure = {"time": datetime.utcnow().isoformat(), "reason": reason[:300]}
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._consecutive_failures >= DB_BREAKER_FAILURE_THRESHOLD
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                logger.error(f"[DB_BREAKER] open durante {DB_BREAKER_OPEN_SECONDS}s tras fallo: {reason[:200]}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "trips": self.trips,
+                "rejected_requests": self.rejected,
+                "last_failure": self.last_failure,
+                "failure_threshold": DB_BREAKER_FAILURE_THRESHOLD,
+                "open_seconds": DB_BREAKER_OPEN_SECONDS,
+            }
+
+db_breaker = MongoCircuitBreaker()
+
+class RequestCommandListener(monitoring.CommandListener):
+    """Suma cada comando completado (ok o fallido) al RequestDBStats del request actual"""
+
+    def started(self, event):
+        slow_query_explainer.started(event)
+
+    def succeeded(self, event):
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.add(event.duration_micros / 1000)
+        slow_query_explainer.finished(event, succeeded=True)
+        db_breaker.record_success()
+
+    def failed(self, event):
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.add(event.duration_micros / 1000)
+        slow_query_explainer.finished(event, succeeded=False)
+        failure = event.failure or {}
+        if failure.get("errtype") in _NETWORK_FAILURE_TYPES and not _deadline_nearly_expired():
+            # (un timeout por agotar el deadline del request no indica un cluster degradado)
+            db_breaker.record_failure(f"{failure['errtype']}: {failure.get('errmsg', '')}")
+        else:
+            db_breaker.record_success()  # el servidor respondió (error de comando, no de red)
+
 # Log configuration for debugging
 print(f"[STARTUP] Connecting to MongoDB...")
 print(f"[STARTUP] Database: {db_name}")
 print(f"[STARTUP] MongoDB URL type: {'Atlas' if 'mongodb+srv://' in mongo_url else 'Local'}")
 
-try:
-    # Configuración optimizada para MongoDB Atlas y local
-    client = AsyncIOMotorClient(
+# Pool por worker: MONGO_CONNECTION_BUDGET es el total de conexiones que pueden abrir
+# entre todos los workers de la instancia (WEB_CONCURRENCY, lo fija serve.py, que
+# también avisa o se niega a arrancar si el reparto queda demasiado pequeño)
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+MONGO_CONNECTION_BUDGET = int(os.environ.get("MONGO_CONNECTION_BUDGET", "50"))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "0")) or max(1, MONGO_CONNECTION_BUDGET // WEB_CONCURRENCY)
+MONGO_MIN_POOL_SIZE = min(int(os.environ.get("MONGO_MIN_POOL_SIZE", "2")), MONGO_MAX_POOL_SIZE)
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    # Configuración optimizada para MongoDB Atlas y local.
+    # Motor no abre conexiones hasta la primera operación (connect=False).
+    return AsyncIOMotorClient(
         mongo_url,
         serverSelectionTimeoutMS=10000,
         connectTimeoutMS=10000,
         socketTimeoutMS=10000,
-        maxPoolSize=50,
-        minPoolSize=10
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        event_listeners=[RequestCommandListener(), pool_stats]
     )
+
+try:
+    client = create_mongo_client()
     db = client[db_name]
-    print("[STARTUP] MongoDB connection initialized successfully")
+    _client_pid = os.getpid()
+    print(f"[STARTUP] MongoDB connection initialized successfully (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE}, {WEB_CONCURRENCY} workers)")
 except Exception as e:
     print(f"[STARTUP ERROR] Failed to connect to MongoDB: {e}")
     raise
 
+def ensure_worker_mongo_client():
+    """Si el proceso es un fork del que importó el módulo (p. ej. gunicorn --preload),
+    crea su propio cliente (un MongoClient no debe compartirse entre procesos) y su
+    propio WORKER_ID (si no, todos los forks volcarían métricas en el mismo documento)."""
+    global client, db, _client_pid, WORKER_ID
+    if _client_pid != os.getpid():
+        client = create_mongo_client()
+        db = client[db_name]
+        _client_pid = os.getpid()
+        WORKER_ID = new_worker_id()
+        print(f"[STARTUP] Cliente MongoDB recreado en el worker {_client_pid}")
+
 # Configure logging FIRST (before any log calls)
 logging.basicConfig(
     level=logging.INFO,
@@ -255,6 +548,7 @@ api_router = APIRouter(prefix="/api")
 # ==========================================
 import time
 import uuid
+import bisect
 from collections import defaultdict
 from threading import Lock
 
@@ -262,24 +556,101 @@ from threading import Lock
 SLOW_THRESHOLD_DEFAULT = 1000  # 1 segundo para endpoints normales
 SLOW_THRESHOLD_EXPORT = 5000   # 5 segundos para exports
 
+# Buckets fijos del histograma de latencia (segundos, convención Prometheus)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Ruta usada cuando el request no casa con ningún endpoint (404): mantiene acotada la cardinalidad
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Token del endpoint Prometheus /metrics (Authorization: Bearer <token>). Sin token,
+# /metrics responde 403 salvo METRICS_PUBLIC=true (solo si la red ya lo restringe).
+# El mismo token abre el health detallado (/health, /api/health)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "false").lower() == "true"
+
+class LatencyHistogram:
+    """Histograma de buckets fijos: memoria constante por ruta"""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # último = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimación por interpolación lineal dentro del bucket (como histogram_quantile)"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                if i == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]  # por encima del último bucket finito
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return LATENCY_BUCKETS[-1]
+
+def _prom_escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render_prometheus_families(per_worker: list) -> str:
+    """Une las familias de varios collectors (prometheus_families): HELP/TYPE una sola vez"""
+    lines = []
+    for families in zip(*per_worker):
+        name, kind, help_text, _ = families[0]
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for family in families:
+            lines += family[3]
+    return "\n".join(lines) + "\n"
+
 # Métricas en memoria para monitoreo
 class MetricsCollector:
     def __init__(self):
         self._lock = Lock()
-        self._error_counts = defaultdict(int)  # {endpoint: count}
+        self._error_counts = defaultdict(int)  # {"METHOD /ruta/{param}": count}
+        self._status_counts = defaultdict(int)  # {(method, route, status): count}
+        self._latency = {}  # {(method, route): LatencyHistogram}
+        self._in_flight = 0
+        self._query_budget_exceeded = defaultdict(int)  # {"METHOD /ruta/{param}": count}
         self._slow_requests = []  # Lista de requests lentos recientes
         self._total_requests = 0
         self._total_errors_5xx = 0
         self._total_errors_4xx = 0
         self._start_time = datetime.utcnow()
     
-    def record_request(self, method: str, path: str, status: int, duration_ms: float):
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+    
+    def request_finished(self):
+        with self._lock:
+            self._in_flight -= 1
+    
+    def record_request(self, method: str, route: str, status: int, duration_ms: float, path: Optional[str] = None):
+        """
+        Registra un request. `route` es la plantilla de la ruta (/api/services/{service_id}),
+        nunca el path crudo, para que las claves no crezcan con los ids.
+        `path` (opcional) solo se guarda en la lista acotada de requests lentos.
+        """
         with self._lock:
             self._total_requests += 1
+            self._status_counts[(method, route, status)] += 1
+            histogram = self._latency.get((method, route))
+            if histogram is None:
+                histogram = self._latency[(method, route)] = LatencyHistogram()
+            histogram.observe(duration_ms / 1000)
             
             if status >= 500:
                 self._total_errors_5xx += 1
-                self._error_counts[f"{method} {path}"] += 1
+                self._error_counts[f"{method} {route}"] += 1
             elif status >= 400:
                 self._total_errors_4xx += 1
             
@@ -288,27 +659,141 @@ class MetricsCollector:
                 self._slow_requests.append({
                     "time": datetime.utcnow().isoformat(),
                     "method": method,
-                    "path": path,
+                    "path": path or route,
+                    "route": route,
                     "duration_ms": round(duration_ms),
                     "status": status
                 })
                 if len(self._slow_requests) > 50:
                     self._slow_requests.pop(0)
     
+    def export_state(self) -> dict:
+        """Estado acumulado serializable (BSON) para agregación entre workers"""
+        with self._lock:
+            return {
+                "start_time": self._start_time,
+                "total_requests": self._total_requests,
+                "total_errors_5xx": self._total_errors_5xx,
+                "total_errors_4xx": self._total_errors_4xx,
+                "in_flight": self._in_flight,
+                "error_counts": [[key, count] for key, count in self._error_counts.items()],
+                "status_counts": [[method, route, status, count] for (method, route, status), count in self._status_counts.items()],
+                "latency": [[method, route, h.counts, h.sum, h.count] for (method, route), h in self._latency.items()],
+                "query_budget_exceeded": [[key, count] for key, count in self._query_budget_exceeded.items()],
+                "slow_requests": list(self._slow_requests[-10:]),
+            }
+    
+    @classmethod
+    def from_states(cls, states: list) -> "MetricsCollector":
+        """Collector con la suma de los estados de varios workers (ver export_state)"""
+        merged = cls()
+        for state in states:
+            merged._merge_state(state)
+        return merged
+    
+    def _merge_state(self, state: dict):
+        self._start_time = min(self._start_time, state["start_time"])
+        self._total_requests += state["total_requests"]
+        self._total_errors_5xx += state["total_errors_5xx"]
+        self._total_errors_4xx += state["total_errors_4xx"]
+        self._in_flight += state["in_flight"]
+        for key, count in state["error_counts"]:
+            self._error_counts[key] += count
+        for method, route, code, count in state["status_counts"]:
+            self._status_counts[(method, route, code)] += count
+        for key, count in state["query_budget_exceeded"]:
+            self._query_budget_exceeded[key] += count
+        for method, route, counts, total, count in state["latency"]:
+            histogram = self._latency.get((method, route))
+            if histogram is None:
+                histogram = self._latency[(method, route)] = LatencyHistogram()
+            if len(counts) != len(histogram.counts):
+                continue  # worker con otros buckets (despliegue a medias)
+            histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+            histogram.sum += total
+            histogram.count += count
+        self._slow_requests = sorted(self._slow_requests + state["slow_requests"], key=lambda r: r["time"])[-50:]
+    
+    def record_query_budget_exceeded(self, method: str, route: str):
+        with self._lock:
+            self._query_budget_exceeded[f"{method} {route}"] += 1
+    
+    def _latency_summary(self, limit: int = 10) -> list:
+        """Percentiles p50/p95/p99 (ms) de las rutas con más tráfico"""
+        busiest = sorted(self._latency.items(), key=lambda x: -x[1].count)[:limit]
+        return [
+            {
+                "route": f"{method} {route}",
+                "count": h.count,
+                "p50_ms": round(h.quantile(0.50) * 1000, 1),
+                "p95_ms": round(h.quantile(0.95) * 1000, 1),
+                "p99_ms": round(h.quantile(0.99) * 1000, 1),
+            }
+            for (method, route), h in busiest
+        ]
+    
     def get_metrics(self):
         with self._lock:
             uptime = (datetime.utcnow() - self._start_time).total_seconds()
             return {
                 "uptime_seconds": round(uptime),
                 "total_requests": self._total_requests,
+                "in_flight_requests": self._in_flight,
                 "total_5xx_errors": self._total_errors_5xx,
                 "total_4xx_errors": self._total_errors_4xx,
                 "error_rate_5xx": round(self._total_errors_5xx / max(self._total_requests, 1) * 100, 2),
                 "top_error_endpoints": dict(sorted(self._error_counts.items(), key=lambda x: -x[1])[:10]),
+                "latency_by_route": self._latency_summary(),
+                "query_budget": DB_QUERY_BUDGET,
+                "query_budget_exceeded": dict(sorted(self._query_budget_exceeded.items(), key=lambda x: -x[1])[:10]),
                 "recent_slow_requests": self._slow_requests[-10:],
                 "alerts": self._check_alerts()
             }
     
+    def prometheus_families(self, worker: Optional[str] = None) -> list:
+        """
+        [(nombre, tipo, ayuda, [muestras])] en formato Prometheus. Con `worker`, cada
+        serie lleva la label worker (ver render_prometheus_families).
+        """
+        base = {"worker": worker} if worker else {}
+        def labels(**values):
+            values = {**base, **values}
+            if not values:
+                return ""
+            return "{" + ",".join(f'{name}="{_prom_escape(value)}"' for name, value in values.items()) + "}"
+        with self._lock:
+            requests_total = [
+                f"taxifast_http_requests_total{labels(method=method, route=route, status=code)} {count}"
+                for (method, route, code), count in sorted(self._status_counts.items())
+            ]
+            duration = []
+            for (method, route), h in sorted(self._latency.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, h.counts):
+                    cumulative += bucket_count
+                    duration.append(f"taxifast_http_request_duration_seconds_bucket{labels(method=method, route=route, le=bound)} {cumulative}")
+                duration.append(f"taxifast_http_request_duration_seconds_bucket{labels(method=method, route=route, le='+Inf')} {h.count}")
+                duration.append(f"taxifast_http_request_duration_seconds_sum{labels(method=method, route=route)} {h.sum:.6f}")
+                duration.append(f"taxifast_http_request_duration_seconds_count{labels(method=method, route=route)} {h.count}")
+            budget = []
+            for key, count in sorted(self._query_budget_exceeded.items()):
+                method, route = key.split(" ", 1)
+                budget.append(f"taxifast_db_query_budget_exceeded_total{labels(method=method, route=route)} {count}")
+            return [
+                ("taxifast_uptime_seconds", "gauge", "Segundos desde el arranque del proceso.",
+                 [f"taxifast_uptime_seconds{labels()} {(datetime.utcnow() - self._start_time).total_seconds():.0f}"]),
+                ("taxifast_http_requests_in_flight", "gauge", "Requests en curso.",
+                 [f"taxifast_http_requests_in_flight{labels()} {self._in_flight}"]),
+                ("taxifast_http_requests_total", "counter", "Requests por ruta y status.", requests_total),
+                ("taxifast_http_request_duration_seconds", "histogram", "Latencia de requests por ruta.", duration),
+                ("taxifast_db_query_budget_exceeded_total", "counter",
+                 "Requests que superaron DB_QUERY_BUDGET comandos Mongo.", budget),
+            ]
+    
+    def render_prometheus(self) -> str:
+        """Métricas de este collector en formato de exposición de texto de Prometheus"""
+        return render_prometheus_families([self.prometheus_families()])
+    
     def _check_alerts(self):
         alerts = []
         # Alerta si error rate > 5%
@@ -326,39 +811,186 @@ class MetricsCollector:
 # Instancia global de métricas
 metrics = MetricsCollector()
 
-@app.middleware("http")
-async def log_requests(request, call_next):
-    """Log estructurado de cada request con tiempo de respuesta y Request ID"""
-    start_time = time.time()
-    
-    # Generar Request ID único para trazabilidad
-    request_id = str(uuid.uuid4())[:8]  # 8 chars suficiente para debugging
-    
-    # Procesar request
-    response = await call_next(request)
-    
-    # Calcular tiempo
-    process_time = (time.time() - start_time) * 1000  # ms
-    
-    # Añadir headers
-    response.headers["X-Request-Id"] = request_id
-    response.headers["X-Process-Time"] = f"{process_time:.0f}ms"
+# Cache endpoint -> plantilla de ruta ("/api/services/{service_id}")
+_route_templates = {}
+
+def get_route_template(scope: dict) -> str:
+    """Plantilla de la ruta que atendió el request (la fija el router en scope["endpoint"])"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    template = _route_templates.get(endpoint)
+    if template is None:
+        template = UNMATCHED_ROUTE
+        for route in app.router.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+        _route_templates[endpoint] = template
+    return template
+
+# Request ID del request en curso, disponible para todas las líneas de log
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdLogFilter(logging.Filter):
+    """Añade %(request_id)s a cada registro de log"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(RequestIdLogFilter())
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+
+# ==========================================
+# DEADLINES POR CLASE DE RUTA
+# ==========================================
+# Cada request /api recibe un presupuesto de tiempo según su clase. Se aplica con
+# pymongo.timeout() (CSOT): todas las operaciones Mongo del request usan el tiempo
+# restante como maxTimeMS, así que una consulta de un request abandonado se corta en
+# el cluster. Si se agota, el request responde 504.
+import contextlib
+import re
+
+DEADLINE_INTERACTIVE_SECONDS = float(os.environ.get("DEADLINE_INTERACTIVE_SECONDS", "10"))
+DEADLINE_LIST_SECONDS = float(os.environ.get("DEADLINE_LIST_SECONDS", "20"))
+DEADLINE_REPORT_SECONDS = float(os.environ.get("DEADLINE_REPORT_SECONDS", "45"))
+DEADLINE_EXPORT_SECONDS = float(os.environ.get("DEADLINE_EXPORT_SECONDS", "120"))
+
+ROUTE_DEADLINE_CLASSES = [
+    ("export", re.compile(r"^/api/(.+/export/|facturacion/run$|facturacion/batches/[^/]+/empresas/|feeds/)"), DEADLINE_EXPORT_SECONDS),
+    ("report", re.compile(r"^/api/(reportes/|.+/estadisticas$)"), DEADLINE_REPORT_SECONDS),
+    ("list", re.compile(
+        r"^/api/(services|services/sync|turnos|users|users/unassigned|companies|vehiculos|organizations"
+        r"|facturacion/batches|superadmin/(admins|taxistas|vehiculos|slow-queries|profiles))$"
+    ), DEADLINE_LIST_SECONDS),
+]
+
+def route_deadline(path: str):
+    """(clase, presupuesto en segundos) para un path /api"""
+    for name, pattern, seconds in ROUTE_DEADLINE_CLASSES:
+        if pattern.match(path):
+            return name, seconds
+    return "interactive", DEADLINE_INTERACTIVE_SECONDS
+
+def deadline_exceeded_response() -> JSONResponse:
+    _, budget, route_class = _request_deadline.get()
+    return JSONResponse(
+        status_code=504,
+        content={"detail": f"La petición superó su tiempo límite ({budget:g}s, {route_class}). Usa filtros más específicos o reintenta."}
+    )
+
+class RequestObservabilityMiddleware:
+    """
+    Middleware ASGI puro: Request ID, tiempos, contabilidad Mongo, métricas y log
+    estructurado de cada request. A diferencia de BaseHTTPMiddleware no interpone
+    una tarea ni una cola por request y no bufferiza respuestas streaming.
     
-    # Log estructurado (solo para /api, excluir health checks)
-    path = request.url.path
-    if path.startswith("/api") and path not in ["/api/health", "/", "/api/metrics"]:
-        status = response.status_code
-        method = request.method
+    - X-Process-Time / X-DB-*: medidos al enviar los headers (time-to-first-byte)
+    - Métricas y log: medidos hasta el último chunk del body
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        # Generar Request ID único para trazabilidad
+        request_id = uuid.uuid4().hex[:8]  # 8 chars suficiente para debugging
+        # Contabilidad de comandos Mongo del request (ver RequestCommandListener)
+        db_stats = RequestDBStats()
+        request_id_token = request_id_var.set(request_id)
+        db_stats_token = _request_db_stats.set(db_stats)
+        status_code = 500  # si la app falla antes de responder
+        # Circuit breaker de Mongo: con el circuito abierto /api responde 503 al instante
+        app = self.app
+        breaker_probe = False
+        deadline_scope = contextlib.nullcontext()
+        deadline_token = None
+        if scope["path"].startswith("/api") and scope["path"] != "/api/health":
+            route_class, budget = route_deadline(scope["path"])
+            deadline_token = _request_deadline.set((time.monotonic() + budget, budget, route_class))
+            deadline_scope = pymongo.timeout(budget)
+            allowed, breaker_probe, retry_after = db_breaker.before_request()
+            if not allowed:
+                app = JSONResponse(
+                    status_code=503,
+                    content={"detail": "Base de datos no disponible temporalmente. Reintenta en unos segundos."},
+                    headers={"Retry-After": str(retry_after)}
+                )
+        profile = None
+
+        async def send_with_headers(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-Id"] = request_id
+                if profile is not None:
+                    headers["X-Profile-Id"] = str(profile["id"])
+                headers["X-Process-Time"] = f"{(time.perf_counter() - start_time) * 1000:.0f}ms"
+                headers["X-DB-Calls"] = str(db_stats.calls)
+                headers["X-DB-Time"] = f"{db_stats.time_ms:.1f}ms"
+            await send(message)
+
+        metrics.request_started()
+        try:
+            with deadline_scope:
+                # Perfilado bajo demanda (None salvo X-Profile de superadmin o muestreo 1/N).
+                # Dentro del deadline y solo con el circuito cerrado: consulta db.users
+                if app is self.app:
+                    profile = await request_profiler.maybe_start(scope)
+                await app(scope, receive, send_with_headers)
+        finally:
+            metrics.request_finished()
+            if breaker_probe:
+                db_breaker.release_probe()
+            if deadline_token is not None:
+                _request_deadline.reset(deadline_token)
+            process_time = (time.perf_counter() - start_time) * 1000  # ms, hasta el último chunk
+            try:
+                try:
+                    self._record(scope, status_code, process_time, db_stats)
+                finally:
+                    # Siempre: si no, el sampler no se para y el perfilador queda ocupado
+                    if profile is not None:
+                        await request_profiler.finish(profile, scope, status_code, process_time, db_stats, request_id)
+            finally:
+                _request_db_stats.reset(db_stats_token)
+                request_id_var.reset(request_id_token)
+
+    @staticmethod
+    def _record(scope, status: int, process_time: float, db_stats: RequestDBStats):
+        # Log estructurado (solo para /api, excluir health checks)
+        path = scope["path"]
+        if not path.startswith("/api") or path in ("/api/health", "/api/metrics"):
+            return
+        method = scope["method"]
+        
+        # Registrar métricas (por plantilla de ruta, no por path con ids)
+        route = get_route_template(scope)
+        metrics.record_request(method, route, status, process_time, path)
         
-        # Registrar métricas
-        metrics.record_request(method, path, status, process_time)
+        over_budget = db_stats.calls > DB_QUERY_BUDGET
+        if over_budget:
+            metrics.record_query_budget_exceeded(method, route)
         
         # Determinar umbral de latencia según endpoint
         is_export = "/export/" in path
         slow_threshold = SLOW_THRESHOLD_EXPORT if is_export else SLOW_THRESHOLD_DEFAULT
         
         # Nivel de log según status code (reducir ruido en 4xx esperables)
-        log_msg = f"[{request_id}] [{method}] {path} -> {status} ({process_time:.0f}ms)"
+        log_msg = (
+            f"[{method}] {path} -> {status} ({process_time:.0f}ms) "
+            f"db_calls={db_stats.calls} db_time={db_stats.time_ms:.0f}ms"
+        )
+        if over_budget:
+            log_msg += f" QUERY_BUDGET_EXCEEDED(>{DB_QUERY_BUDGET})"
         
         if status >= 500:
             # Errores de servidor: siempre ERROR
@@ -372,35 +1004,439 @@ async def log_requests(request, call_next):
         elif process_time > slow_threshold:
             # Request lento: WARNING con indicador
             logger.warning(f"{log_msg} SLOW")
+        elif over_budget:
+            # Demasiados comandos Mongo (posible N+1): WARNING
+            logger.warning(log_msg)
         else:
             # Normal: INFO
             logger.info(log_msg)
+
+app.add_middleware(RequestObservabilityMiddleware)
+
+@app.exception_handler(PyMongoError)
+async def mongo_timeout_handler(request: Request, exc: PyMongoError):
+    """Timeouts de Mongo provocados por el deadline del request -> 504; el resto sigue como 500"""
+    if exc.timeout and _request_deadline.get() is not None:
+        return deadline_exceeded_response()
+    raise exc
+
+@app.exception_handler(ServerSelectionTimeoutError)
+async def server_selection_timeout_handler(request: Request, exc: ServerSelectionTimeoutError):
+    """Sin servidor disponible no hay evento de comando: se cuenta aquí para el breaker"""
+    if _deadline_nearly_expired():
+        return deadline_exceeded_response()
+    db_breaker.record_failure(f"ServerSelectionTimeoutError: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Base de datos no disponible temporalmente. Reintenta en unos segundos."},
+        headers={"Retry-After": str(DB_BREAKER_OPEN_SECONDS)}
+    )
+
+# ==========================================
+# EVENT LOOP LAG MONITOR
+# ==========================================
+import sys
+import traceback
+from collections import deque
+
+# Cada LOOP_LAG_INTERVAL_MS una tarea mide cuánto tarda en despertar de más (lag del loop)
+LOOP_LAG_INTERVAL_MS = int(os.environ.get("LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_LAG_WINDOW = 600  # muestras recientes para percentiles (~1 min con 100ms)
+# Modo debug: un hilo vigilante captura el stack del loop cuando lleva bloqueado > umbral
+LOOP_BLOCK_DEBUG = os.environ.get("LOOP_BLOCK_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD_MS = int(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "200"))
+
+class LoopLagMonitor:
+    def __init__(self):
+        self._lock = Lock()
+        self._samples = deque(maxlen=LOOP_LAG_WINDOW)
+        self._max_lag_ms = 0.0
+        self._stalls = 0  # muestras con lag > LOOP_BLOCK_THRESHOLD_MS
+        self._task = None
+        self._heartbeat = 0.0
+        self._loop_thread_id = None
+        self._stop_event = threading.Event()
+        self._current_stall = None  # (heartbeat, location) de la parada en curso
+        self._blocking = {}  # {location: {count, max_ms, last_seen, stack}}
+    
+    def start(self):
+        """Arranca el muestreo (y el vigilante si LOOP_BLOCK_DEBUG) en el loop actual"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop_event.clear()
+        self._task = asyncio.create_task(self._sample())
+        if LOOP_BLOCK_DEBUG:
+            threading.Thread(target=self._watch, name="loop-block-watchdog", daemon=True).start()
+            logger.warning(f"[LOOP] Modo debug de bloqueos activo (umbral {LOOP_BLOCK_THRESHOLD_MS}ms)")
+    
+    async def stop(self):
+        self._stop_event.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _sample(self):
+        interval = LOOP_LAG_INTERVAL_MS / 1000
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            lag_ms = max(0.0, (now - started - interval) * 1000)
+            self._heartbeat = now
+            with self._lock:
+                self._samples.append(lag_ms)
+                self._max_lag_ms = max(self._max_lag_ms, lag_ms)
+                if lag_ms > LOOP_BLOCK_THRESHOLD_MS:
+                    self._stalls += 1
+    
+    @staticmethod
+    def _app_location(stack) -> str:
+        """Frame más interno del código de la app (server.py, export_renderers.py...)"""
+        for frame in reversed(stack):
+            if frame.filename.startswith(str(ROOT_DIR)):
+                return f"{Path(frame.filename).name}:{frame.lineno} ({frame.name})"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} ({frame.name})"
+    
+    def _watch(self):
+        """Hilo vigilante: si el heartbeat del loop se retrasa > umbral, captura su stack"""
+        interval = LOOP_LAG_INTERVAL_MS / 1000
+        threshold = LOOP_BLOCK_THRESHOLD_MS / 1000
+        while not self._stop_event.wait(max(threshold / 4, 0.01)):
+            heartbeat = self._heartbeat
+            blocked_ms = (time.perf_counter() - heartbeat - interval) * 1000
+            if blocked_ms < LOOP_BLOCK_THRESHOLD_MS:
+                self._current_stall = None
+                continue
+            if self._current_stall is not None and self._current_stall[0] == heartbeat:
+                # Misma parada: solo actualizar la duración máxima
+                with self._lock:
+                    entry = self._blocking[self._current_stall[1]]
+                    entry["max_ms"] = max(entry["max_ms"], round(blocked_ms))
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            location = self._app_location(stack)
+            with self._lock:
+                entry = self._blocking.setdefault(location, {"count": 0, "max_ms": 0, "last_seen": None, "stack": None})
+                entry["count"] += 1
+                entry["max_ms"] = max(entry["max_ms"], round(blocked_ms))
+                entry["last_seen"] = datetime.utcnow().isoformat()
+                entry["stack"] = "".join(traceback.format_list(stack[-20:]))
+            self._current_stall = (heartbeat, location)
+            logger.warning(f"[LOOP] Event loop bloqueado >{LOOP_BLOCK_THRESHOLD_MS}ms en {location}")
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            last = self._samples[-1] if self._samples else None
+            hotspots = sorted(self._blocking.items(), key=lambda x: (-x[1]["count"], -x[1]["max_ms"]))[:10]
+            return {
+                "interval_ms": LOOP_LAG_INTERVAL_MS,
+                "lag_ms": {
+                    "last": round(last, 1) if last is not None else None,
+                    "p50": round(samples[len(samples) // 2], 1) if samples else None,
+                    "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1) if samples else None,
+                    "max": round(self._max_lag_ms, 1),
+                },
+                "block_threshold_ms": LOOP_BLOCK_THRESHOLD_MS,
+                "stalls_over_threshold": self._stalls,
+                "block_debug": LOOP_BLOCK_DEBUG,
+                "blocking_hotspots": [
+                    {"location": location, "count": e["count"], "max_ms": e["max_ms"], "last_seen": e["last_seen"]}
+                    for location, e in hotspots
+                ],
+            }
+    
+    def blocking_stacks(self) -> list:
+        with self._lock:
+            return [
+                {"location": location, **entry}
+                for location, entry in sorted(self._blocking.items(), key=lambda x: -x[1]["count"])
+            ]
+    
+    def render_prometheus(self, worker: str) -> str:
+        """Solo de este proceso: label worker para no mezclar series de workers distintos"""
+        labels = f'{{worker="{_prom_escape(worker)}"}}'
+        with self._lock:
+            last = self._samples[-1] if self._samples else 0.0
+            return "\n".join([
+                "# HELP taxifast_event_loop_lag_seconds Último lag medido del event loop.",
+                "# TYPE taxifast_event_loop_lag_seconds gauge",
+                f"taxifast_event_loop_lag_seconds{labels} {last / 1000:.6f}",
+                "# HELP taxifast_event_loop_lag_max_seconds Lag máximo del event loop desde el arranque.",
+                "# TYPE taxifast_event_loop_lag_max_seconds gauge",
+                f"taxifast_event_loop_lag_max_seconds{labels} {self._max_lag_ms / 1000:.6f}",
+                "# HELP taxifast_event_loop_stalls_total Muestras con lag por encima de LOOP_BLOCK_THRESHOLD_MS.",
+                "# TYPE taxifast_event_loop_stalls_total counter",
+                f"taxifast_event_loop_stalls_total{labels} {self._stalls}",
+            ]) + "\n"
+
+loop_monitor = LoopLagMonitor()
+
+# ==========================================
+# AGREGACIÓN DE MÉTRICAS ENTRE WORKERS
+# ==========================================
+# Cada worker (proceso uvicorn/gunicorn) vuelca su estado acumulado en metrics_workers
+# cada METRICS_FLUSH_SECONDS; /api/metrics suma los workers vivos y /metrics exporta
+# una serie por worker (label worker) para que Prometheus agregue sin falsos resets.
+# METRICS_FLUSH_SECONDS=0 desactiva la agregación (métricas solo del proceso).
+import socket
+
+METRICS_FLUSH_SECONDS = int(os.environ.get("METRICS_FLUSH_SECONDS", "15"))
+METRICS_WORKER_STALE_SECONDS = int(os.environ.get("METRICS_WORKER_STALE_SECONDS", "120"))
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+
+# Se regenera tras un fork en ensure_worker_mongo_client()
+WORKER_ID = new_worker_id()
+
+class MetricsAggregator:
+    def __init__(self):
+        self._task = None
+    
+    def start(self):
+        if METRICS_FLUSH_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
     
-    return response
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Último volcado para no perder lo acumulado desde el anterior
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"[METRICS] Error en volcado final: {e}")
+    
+    async def flush(self):
+        await db.metrics_workers.replace_one(
+            {"_id": WORKER_ID},
+            {**metrics.export_state(), "updated_at": datetime.utcnow()},
+            upsert=True
+        )
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"[METRICS] Error volcando métricas del worker: {e}")
+    
+    async def worker_states(self) -> Optional[list]:
+        """
+        [(worker_id, estado)]: el estado local en vivo + el último volcado de los demás
+        workers activos. None si la agregación está desactivada o Mongo falla.
+        """
+        if METRICS_FLUSH_SECONDS <= 0:
+            return None
+        try:
+            since = datetime.utcnow() - timedelta(seconds=METRICS_WORKER_STALE_SECONDS)
+            others = await db.metrics_workers.find(
+                {"_id": {"$ne": WORKER_ID}, "updated_at": {"$gte": since}}
+            ).to_list(1000)
+        except Exception as e:
+            logger.warning(f"[METRICS] No se pudieron leer métricas de otros workers: {e}")
+            return None
+        return [(WORKER_ID, metrics.export_state()), *[(doc["_id"], doc) for doc in others]]
+    
+    async def fleet(self):
+        """
+        (collector, workers): suma de worker_states(). Si no hay agregación, devuelve
+        solo el collector local y workers=None.
+        """
+        states = await self.worker_states()
+        if states is None:
+            return metrics, None
+        workers = [
+            {"worker_id": worker_id, "total_requests": state["total_requests"],
+             "updated_at": state.get("updated_at", datetime.utcnow()).isoformat()}
+            for worker_id, state in states
+        ]
+        return MetricsCollector.from_states([state for _, state in states]), workers
+    
+    async def prometheus_families(self) -> list:
+        """
+        Familias Prometheus con una serie por worker (label worker). Los contadores no
+        se suman aquí: si un worker se reinicia o deja de volcar, su serie desaparece
+        en vez de hacer bajar un total (rate() lo vería como un reset). Se agregan en
+        PromQL: sum without (worker) (rate(...)).
+        """
+        states = await self.worker_states()
+        if states is None:
+            return [metrics.prometheus_families(WORKER_ID)]
+        return [MetricsCollector.from_states([state]).prometheus_families(worker_id) for worker_id, state in states]
+
+metrics_aggregator = MetricsAggregator()
+
+# ==========================================
+# PROFILING BAJO DEMANDA (superadmin)
+# ==========================================
+# Un superadmin puede perfilar un request concreto con el header "X-Profile: 1" o
+# el query param "__profile=1"; PROFILE_SAMPLE_EVERY=N perfila además 1 de cada N
+# requests /api. Un hilo muestrea el stack del event loop cada PROFILE_INTERVAL_MS
+# y el resultado se guarda en formato "folded" (flamegraph.pl, speedscope) en la
+# colección capped request_profiles. Los requests normales no pagan nada.
+from collections import Counter
+
+PROFILE_SAMPLE_EVERY = int(os.environ.get("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_CAPPED_BYTES = int(os.environ.get("PROFILE_CAPPED_BYTES", str(64 * 1024 * 1024)))
+PROFILE_MAX_BYTES = 4 * 1024 * 1024  # límite por perfil (muy por debajo de los 16MB de BSON)
+
+class StackSampler:
+    """Muestreo estadístico del stack de un hilo (el del event loop)"""
+
+    def __init__(self, thread_id: int, interval_ms: float):
+        self._thread_id = thread_id
+        self._interval = interval_ms / 1000
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self.stacks = Counter()
+        self.samples = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+class RequestProfiler:
+    def __init__(self):
+        self._seen = 0
+        self._busy = False  # un perfil a la vez: el sampler ve todo el loop, no solo el request
+
+    async def maybe_start(self, scope) -> Optional[dict]:
+        """Devuelve el contexto de perfilado si este request debe perfilarse, si no None"""
+        trigger = None
+        if PROFILE_SAMPLE_EVERY > 0:
+            self._seen += 1
+            if self._seen % PROFILE_SAMPLE_EVERY == 0:
+                trigger = "sample"
+        if trigger is None:
+            # Solo el valor documentado: X-Profile: 1 o ?__profile=1 (no cualquier valor)
+            if b"__profile=1" not in scope["query_string"].split(b"&") and not any(
+                name == b"x-profile" and value.strip() == b"1" for name, value in scope["headers"]
+            ):
+                return None
+            trigger = "superadmin"
+        if self._busy or not scope["path"].startswith("/api"):
+            return None
+        username = None
+        if trigger == "superadmin":
+            username = await self._superadmin_username(scope)
+            if username is None or self._busy:
+                return None
+        self._busy = True
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS)
+        sampler.start()
+        return {"id": ObjectId(), "trigger": trigger, "username": username, "sampler": sampler}
+
+    @staticmethod
+    async def _superadmin_username(scope) -> Optional[str]:
+        authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+        if not authorization.lower().startswith("bearer "):
+            return None
+        try:
+            username = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+        except JWTError:
+            return None
+        try:
+            user = await db.users.find_one({"username": username}, {"role": 1})
+        except Exception as e:
+            logger.warning(f"[PROFILE] No se pudo verificar el usuario: {e}")
+            return None
+        return username if user and user.get("role") == "superadmin" else None
 
-# --- Git SHA auto-detection (una sola vez al importar) ---
-def _detect_git_sha() -> str:
-    """Detecta el SHA del commit actual. Prioridad:
-    1. git rev-parse --short HEAD (funciona si hay .git en el pod)
+    async def finish(self, profile: dict, scope, status: int, duration_ms: float, db_stats: "RequestDBStats", request_id: str):
+        sampler = profile["sampler"]
+        sampler.stop()
+        self._busy = False
+        folded = sampler.folded()
+        try:
+            await db.request_profiles.insert_one({
+                "_id": profile["id"],
+                "created_at": datetime.utcnow(),
+                "request_id": request_id,
+                "trigger": profile["trigger"],
+                "username": profile["username"],
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": get_route_template(scope),
+                "status": status,
+                "duration_ms": round(duration_ms, 1),
+                "db_calls": db_stats.calls,
+                "db_time_ms": round(db_stats.time_ms, 1),
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "samples": sampler.samples,
+                "truncated": len(folded) > PROFILE_MAX_BYTES,
+                "folded": folded[:PROFILE_MAX_BYTES],
+            })
+            logger.info(f"[PROFILE] {scope['method']} {scope['path']} perfilado ({sampler.samples} muestras) id={profile['id']}")
+        except Exception as e:
+            logger.warning(f"[PROFILE] No se pudo guardar el perfil: {e}")
+
+request_profiler = RequestProfiler()
+
+# --- Build info (git SHA): se calcula una sola vez, en la primera llamada ---
+import functools
+
+APP_VERSION = "1.0.0"
+
+def _read_git_sha() -> Optional[str]:
+    """SHA corto de HEAD leyendo .git del disco (sin lanzar el binario git)"""
+    git_dir = ROOT_DIR.resolve().parent / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if head.startswith("ref: "):
+            ref = head[len("ref: "):]
+            ref_file = git_dir / ref
+            if ref_file.exists():
+                head = ref_file.read_text().strip()
+            else:
+                packed = (git_dir / "packed-refs").read_text().splitlines()
+                head = next(line.split()[0] for line in packed if line.endswith(f" {ref}"))
+        return head[:7] or None
+    except (OSError, StopIteration):
+        return None
+
+@functools.lru_cache(maxsize=1)
+def get_build_info() -> dict:
+    """Versión y SHA del commit. Prioridad del SHA:
+    1. HEAD del repo (funciona si hay .git en el pod)
     2. Variable de entorno GIT_SHA (inyectada por CI/CD)
     3. "unknown"
     """
-    import subprocess
-    try:
-        result = subprocess.run(
-            ["git", "rev-parse", "--short", "HEAD"],
-            capture_output=True, text=True, timeout=5
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
-    except Exception:
-        pass
-    val = os.environ.get("GIT_SHA")
-    if not val or not str(val).strip():
-        return "unknown"
-    return val
-
-_GIT_SHA = _detect_git_sha()
+    git_sha = _read_git_sha() or os.environ.get("GIT_SHA", "").strip() or "unknown"
+    return {"version": APP_VERSION, "git_sha": git_sha}
 
 # Root health check endpoint for deployment systems
 @app.get("/")
@@ -409,29 +1445,180 @@ async def root_health_check():
     return {
         "status": "healthy",
         "service": "taxifast-api",
-        "version": "1.0.0",
-        "git_sha": _GIT_SHA,
+        "version": APP_VERSION,
+        "git_sha": get_build_info()["git_sha"],
 "timestamp": datetime.utcnow().isoformat()
     }
 
+# ==========================================
+# HEALTH CHECKER (liveness / readiness)
+# ==========================================
+# Los probes no tocan Mongo: leen el resultado que un chequeo en segundo plano
+# refresca cada HEALTH_CHECK_INTERVAL_SECONDS (ping) y HEALTH_STATS_INTERVAL_SECONDS
+# (conteos aproximados y estado de migraciones).
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get("HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+HEALTH_STATS_INTERVAL_SECONDS = int(os.environ.get("HEALTH_STATS_INTERVAL_SECONDS", "60"))
+HEALTH_COUNT_COLLECTIONS = ("users", "organizations", "services", "turnos")
+
+class HealthChecker:
+    def __init__(self):
+        self._task = None
+        self._startup_complete = False
+        self._ping_ok = False
+        self._ping_ms = None
+        self._ping_error = None
+        self._checked_at = None  # datetime.utcnow() del último ping
+        self._checked_mono = 0.0
+        self._stats_mono = None
+        self._counts = {}
+        self._migrations = []
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def mark_startup_complete(self):
+        self._startup_complete = True
+    
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+    
+    async def check(self):
+        started = time.perf_counter()
+        try:
+            await db.command("ping")
+            self._ping_ok = True
+            self._ping_error = None
+            self._ping_ms = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            logger.error(f"Database health check failed: {e}")
+            if isinstance(e, ServerSelectionTimeoutError):
+                db_breaker.record_failure(f"ServerSelectionTimeoutError: {e}")
+            self._ping_ok = False
+            self._ping_error = str(e)
+            self._ping_ms = None
+        self._checked_at = datetime.utcnow()
+        self._checked_mono = time.perf_counter()
+        
+        stats_due = self._stats_mono is None or self._checked_mono - self._stats_mono >= HEALTH_STATS_INTERVAL_SECONDS
+        if self._ping_ok and stats_due:
+            try:
+                # estimated_document_count usa los metadatos de la colección (sin scan)
+                for name in HEALTH_COUNT_COLLECTIONS:
+                    self._counts[name] = await db[name].estimated_document_count()
+                self._migrations = [
+                    {
+                        "key": doc["_id"],
+                        "done": bool(doc.get("done")),
+                        "migrated_count": doc.get("migrated_count"),
+                    }
+                    for doc in await db.migrations.find({}, {"done": 1, "migrated_count": 1}).to_list(100)
+                ]
+                self._stats_mono = self._checked_mono
+            except Exception as e:
+                logger.warning(f"Health stats refresh failed: {e}")
+    
+    @property
+    def is_fresh(self) -> bool:
+        return self._checked_at is not None and time.perf_counter() - self._checked_mono < HEALTH_CHECK_INTERVAL_SECONDS * 3
+    
+    @property
+    def is_ready(self) -> bool:
+        return self._startup_complete and self._ping_ok and self.is_fresh
+    
+    def snapshot(self) -> dict:
+        return {
+            "status": "healthy" if self._ping_ok else "degraded",
+            "ready": self.is_ready,
+            "startup_complete": self._startup_complete,
+            "database": "connected" if self._ping_ok else "disconnected",
+            "git_sha": get_build_info()["git_sha"],
+            "timestamp": datetime.utcnow().isoformat(),
+            "checked_at": self._checked_at.isoformat() if self._checked_at else None,
+            "check_age_seconds": round(time.perf_counter() - self._checked_mono, 1) if self._checked_at else None,
+            "ping_ms": self._ping_ms,
+            "error": self._ping_error,
+            "pool": pool_stats.snapshot(client.options.pool_options.max_pool_size),
+            "circuit_breaker": db_breaker.snapshot(),
+            "event_loop_lag_ms": loop_monitor.snapshot()["lag_ms"],
+            "stats": dict(self._counts),  # aproximados (estimated_document_count)
+            "migrations": list(self._migrations),
+        }
+
+health_checker = HealthChecker()
+
+async def get_health_snapshot() -> dict:
+    """Resultado cacheado; solo hace un chequeo en línea si aún no hay ninguno o caducó"""
+    if not health_checker.is_fresh:
+        await health_checker.check()
+    return health_checker.snapshot()
+
+# El snapshot detallado (pool, conteos, migraciones, errores de Mongo) no es público:
+# Authorization: Bearer <METRICS_TOKEN> o JWT de superadmin. Las sondas públicas son /livez y /readyz
+health_security = HTTPBearer(auto_error=False)
+
+async def require_health_access(credentials: Optional[HTTPAuthorizationCredentials] = Depends(health_security)):
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if METRICS_TOKEN and secrets.compare_digest(credentials.credentials, METRICS_TOKEN):
+        return
+    await get_current_superadmin(await get_current_user(credentials))
+
+# Liveness: el proceso responde (sin I/O)
+@app.get("/livez", include_in_schema=False)
+async def liveness_probe():
+    return {"status": "alive"}
+
+# Readiness: arranque terminado y último ping a Mongo correcto (cacheado). Solo el estado
+@app.get("/readyz", include_in_schema=False)
+async def readiness_probe():
+    snapshot = await get_health_snapshot()
+    if not snapshot["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not_ready"})
+    return {"status": "ready"}
+
 # API health check endpoint
-@app.get("/health")
+@app.get("/health", dependencies=[Depends(require_health_access)])
 async def health_check():
-    """Detailed health check with database connectivity"""
-    try:
-        # Test database connection
-        await db.command("ping")
-        db_status = "connected"
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
-        db_status = "disconnected"
-    
-    return {
-        "status": "healthy" if db_status == "connected" else "degraded",
-        "database": db_status,
-        "git_sha": _GIT_SHA,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    """Detailed health check with database connectivity (cacheado por HealthChecker)"""
+    return await get_health_snapshot()
+
+# Prometheus scrape endpoint (fuera de /api: sin JWT, protegido por METRICS_TOKEN)
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Métricas por plantilla de ruta en formato de texto Prometheus"""
+    if METRICS_TOKEN:
+        if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    elif not METRICS_PUBLIC:
+        raise HTTPException(status_code=403, detail="Métricas deshabilitadas: configure METRICS_TOKEN (o METRICS_PUBLIC=true)")
+    per_worker = await metrics_aggregator.prometheus_families()
+    # Event loop y circuit breaker: del worker que responde, con su label worker
+    labels = f'{{worker="{_prom_escape(WORKER_ID)}"}}'
+    breaker = db_breaker.snapshot()
+    breaker_lines = "\n".join([
+        "# HELP taxifast_db_circuit_breaker_state Estado del circuit breaker de Mongo (0 closed, 1 half_open, 2 open).",
+        "# TYPE taxifast_db_circuit_breaker_state gauge",
+        f"taxifast_db_circuit_breaker_state{labels} {('closed', 'half_open', 'open').index(breaker['state'])}",
+        "# HELP taxifast_db_circuit_breaker_trips_total Aperturas del circuit breaker de Mongo.",
+        "# TYPE taxifast_db_circuit_breaker_trips_total counter",
+        f"taxifast_db_circuit_breaker_trips_total{labels} {breaker['trips']}",
+        "# HELP taxifast_db_circuit_breaker_rejected_total Requests rechazados con el circuito abierto.",
+        "# TYPE taxifast_db_circuit_breaker_rejected_total counter",
+        f"taxifast_db_circuit_breaker_rejected_total{labels} {breaker['rejected_requests']}",
+    ]) + "\n"
+    return PlainTextResponse(render_prometheus_families(per_worker) + loop_monitor.render_prometheus(WORKER_ID) + breaker_lines, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Helper function for ObjectId
 class PyObjectId(ObjectId):
@@ -920,15 +2107,102 @@ async def get_api_metrics(current_user: dict = Depends(get_current_user)):
     - Top endpoints con errores
     - Requests lentos recientes
     - Alertas activas
+    
+    Contadores y alertas son de toda la flota de workers (ver MetricsAggregator);
+    event_loop es del worker que responde.
     """
     # Solo admin o superadmin pueden ver métricas
     if current_user.get("role") not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden ver métricas")
     
+    fleet_metrics, workers = await metrics_aggregator.fleet()
     return {
         "timestamp": datetime.utcnow().isoformat(),
         "env": ENV,
-        **metrics.get_metrics()
+        "scope": "fleet" if workers is not None else "worker",
+        "worker_id": WORKER_ID,
+        "workers": workers,
+        **fleet_metrics.get_metrics(),
+        "db_circuit_breaker": db_breaker.snapshot(),
+        "event_loop": loop_monitor.snapshot()
+    }
+
+@api_router.get("/superadmin/profiles")
+async def list_request_profiles(
+    current_user: dict = Depends(get_current_superadmin),
+    route: Optional[str] = Query(None, description="Filtrar por plantilla de ruta"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Perfiles de requests capturados (sin el contenido), más recientes primero"""
+    query = {"route": route} if route else {}
+    docs = await db.request_profiles.find(query, {"folded": 0}).sort("$natural", -1).limit(limit).to_list(limit)
+    return [{"id": str(doc.pop("_id")), **doc} for doc in docs]
+
+@api_router.get("/superadmin/profiles/{profile_id}")
+async def download_request_profile(profile_id: str, current_user: dict = Depends(get_current_superadmin)):
+    """
+    Descarga un perfil en formato folded stacks:
+    flamegraph.pl profile.folded > profile.svg, o abrir en speedscope.app
+    """
+    oid = _get_object_id_or_400(profile_id, "profile_id")
+    doc = await db.request_profiles.find_one({"_id": oid}, {"folded": 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return PlainTextResponse(
+        doc["folded"],
+        headers={"Content-Disposition": f"attachment; filename=profile_{profile_id}.folded"}
+    )
+
+@api_router.get("/superadmin/loop-blocking")
+async def get_loop_blocking(current_user: dict = Depends(get_current_superadmin)):
+    """
+    Stacks capturados mientras el event loop estaba bloqueado (LOOP_BLOCK_DEBUG=true),
+    agrupados por línea de código de la app y ordenados por frecuencia.
+    """
+    return {
+        "block_debug": LOOP_BLOCK_DEBUG,
+        "threshold_ms": LOOP_BLOCK_THRESHOLD_MS,
+        "items": loop_monitor.blocking_stacks()
+    }
+
+def _json_or_raw(text: str):
+    """JSON guardado por SlowQueryExplainer (puede estar truncado: se devuelve tal cual)"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+@api_router.get("/superadmin/slow-queries")
+async def get_slow_queries(
+    current_user: dict = Depends(get_current_superadmin),
+    collection: Optional[str] = Query(None, description="Filtrar por colección"),
+    collscan: Optional[bool] = Query(None, description="Solo planes con (o sin) COLLSCAN"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Explains capturados automáticamente para consultas lentas (ver SlowQueryExplainer).
+    Más recientes primero.
+    """
+    query = {}
+    if collection:
+        query["collection"] = collection
+    if collscan is not None:
+        query["collscan"] = collscan
+    
+    docs = await db.slow_queries.find(query).sort("$natural", -1).limit(limit).to_list(limit)
+    return {
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "sample_rate": SLOW_QUERY_SAMPLE_RATE,
+        "max_per_minute": SLOW_QUERY_MAX_PER_MINUTE,
+        "items": [
+            {
+                "id": str(doc.pop("_id")),
+                **doc,
+                "command": _json_or_raw(doc["command"]),
+                "winning_plan": _json_or_raw(doc["winning_plan"]),
+            }
+            for doc in docs
+        ]
     }
 
 def get_user_organization_id(user: dict) -> Optional[str]:
@@ -961,36 +2235,20 @@ async def get_org_filter(user: dict) -> dict:
 # ==========================================
 # HEALTH CHECK ENDPOINT (P1)
 # ==========================================
-@api_router.get("/health")
+@api_router.get("/health", dependencies=[Depends(require_health_access)])
 async def api_health_check():
     """
-    Health check endpoint para monitoreo.
-    Verifica conexión a la base de datos.
+    Health check endpoint para monitoreo (METRICS_TOKEN o superadmin).
+    Devuelve el último chequeo en segundo plano (ping, pool, migraciones,
+    lag del loop y conteos aproximados) sin consultar Mongo en cada probe.
     """
-    try:
-        # Verificar conexión a MongoDB
-        await db.command("ping")
-        
-        # Contar documentos básicos para verificar acceso
-        users_count = await db.users.count_documents({})
-        orgs_count = await db.organizations.count_documents({})
-        
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "git_sha": _GIT_SHA,
-            "timestamp": datetime.utcnow().isoformat(),
-            "stats": {
-                "users": users_count,
-                "organizations": orgs_count
-            }
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
+    snapshot = await get_health_snapshot()
+    if snapshot["database"] != "connected":
         raise HTTPException(
             status_code=503,
-            detail=f"Service unhealthy: {str(e)}"
+            detail=f"Service unhealthy: {snapshot['error']}"
         )
+    return snapshot
 
 # ==========================================
 # AUTH ENDPOINTS
@@ -1428,8 +2686,9 @@ async def delete_organization(org_id: str, current_user: dict = Depends(get_curr
     deleted_users = await db.users.delete_many({"organization_id": org_id})
     deleted_companies = await db.companies.delete_many({"organization_id": org_id})
     deleted_vehiculos = await db.vehiculos.delete_many({"organization_id": org_id})
-    deleted_turnos = await db.turnos.delete_many({"organization_id": org_id})
-    deleted_services = await db.services.delete_many({"organization_id": org_id})
+    # turnos y services salen en el change feed: borrar por lotes dejando tombstone de cada uno
+    deleted_turnos = await delete_with_feed_tombstones("turnos", org_id)
+    deleted_services = await delete_with_feed_tombstones("services", org_id)
     
     # Eliminar la organización
     await db.organizations.delete_one({"_id": ObjectId(org_id)})
@@ -1440,8 +2699,8 @@ async def delete_organization(org_id: str, current_user: dict = Depends(get_curr
             "users": deleted_users.deleted_count,
             "companies": deleted_companies.deleted_count,
             "vehiculos": deleted_vehiculos.deleted_count,
-            "turnos": deleted_turnos.deleted_count,
-            "services": deleted_services.deleted_count
+            "turnos": deleted_turnos,
+            "services": deleted_services
         }
     }
 
@@ -1538,12 +2797,12 @@ async def assign_user_to_organization(
     # En el modelo de datos, turnos y servicios usan taxista_id para referenciar al usuario
     await db.turnos.update_many(
         {"taxista_id": user_id, "organization_id": {"$in": [None, ""]}},
-        {"$set": {"organization_id": org_id}}
+        {"$set": {"organization_id": org_id, "updated_at": datetime.utcnow()}}
     )
     
     await db.services.update_many(
         {"taxista_id": user_id, "organization_id": {"$in": [None, ""]}},
-        {"$set": {"organization_id": org_id}}
+        {"$set": {"organization_id": org_id, "updated_at": datetime.utcnow()}}
     )
     
     return {
@@ -2390,6 +3649,7 @@ async def create_turno(turno: TurnoCreate, current_user: dict = Depends(get_curr
     turno_dict["taxista_id"] = str(current_user["_id"])
     turno_dict["taxista_nombre"] = current_user["nombre"]
     turno_dict["created_at"] = datetime.utcnow()
+    turno_dict["updated_at"] = turno_dict["created_at"]
     turno_dict["cerrado"] = False
     
     # (C) HORA DEL SERVIDOR: Usar hora del servidor EN ESPAÑA, ignorar hora_inicio del cliente
@@ -2423,6 +3683,28 @@ async def create_turno(turno: TurnoCreate, current_user: dict = Depends(get_curr
         **{k: v for k, v in created_turno.items() if k != "_id"}
     )
 
+# Proyecciones mínimas para cálculos de totales. Junto con los índices
+# idx_turno_totals / idx_org_fecha_totals las lecturas quedan cubiertas por índice
+# (no se leen los documentos completos: origen/destino/vehículo, etc.)
+SERVICE_TOTALS_PROJECTION = {"_id": 0, "turno_id": 1, "tipo": 1, "importe": 1, "importe_total": 1, "kilometros": 1}
+SERVICE_TOTALS_BY_TAXISTA_PROJECTION = {"_id": 0, "taxista_id": 1, "tipo": 1, "importe": 1, "importe_total": 1, "kilometros": 1}
+
+def _importe_servicio(servicio: dict) -> float:
+    """importe_total del servicio, con fallback a importe (datos antiguos)"""
+    importe_total = servicio.get("importe_total")
+    if importe_total is None:
+        return servicio.get("importe") or 0
+    return importe_total
+
+def calcular_totales_servicios(servicios: list) -> dict:
+    """Totales de una lista de servicios (clientes/particulares/km/cantidad)"""
+    return {
+        "total_clientes": sum(_importe_servicio(s) for s in servicios if s.get("tipo") == "empresa"),
+        "total_particulares": sum(_importe_servicio(s) for s in servicios if s.get("tipo") == "particular"),
+        "total_km": sum(s.get("kilometros") or 0 for s in servicios),
+        "cantidad_servicios": len(servicios)
+    }
+
 # HELPER FUNCTION: Batch fetch servicios para turnos (optimiza N+1 queries)
 async def get_turnos_with_servicios(turnos: list, org_filter: dict = None, include_servicios_detail: bool = False) -> list:
     """
@@ -2445,9 +3727,11 @@ async def get_turnos_with_servicios(turnos: list, org_filter: dict = None, inclu
         org_filter = {}
     
     # Batch query - traer servicios con filtro de organización para evitar contaminación
+    # Sin detalle solo hacen falta los campos de totales (lectura cubierta por índice)
     turno_ids = [str(t["_id"]) for t in turnos]
     services_query = {"turno_id": {"$in": turno_ids}, **org_filter}
-    all_servicios = await db.services.find(services_query).to_list(MAX_BATCH_SERVICES)
+    projection = None if include_servicios_detail else SERVICE_TOTALS_PROJECTION
+    all_servicios = await db.services.find(services_query, projection).to_list(MAX_BATCH_SERVICES)
     
     # Guard defensivo: si alcanzamos el límite, devolvemos error controlado
     if len(all_servicios) >= MAX_BATCH_SERVICES:
@@ -2470,17 +3754,10 @@ async def get_turnos_with_servicios(turnos: list, org_filter: dict = None, inclu
         turno_id = str(turno["_id"])
         servicios = servicios_by_turno.get(turno_id, [])
         
-        total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-        total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
-        total_km = sum(s.get("kilometros") or 0 for s in servicios)
-        
         turno_data = {
             **turno,
             "turno_id": turno_id,
-            "total_clientes": total_clientes,
-            "total_particulares": total_particulares,
-            "total_km": total_km,
-            "cantidad_servicios": len(servicios)
+            **calcular_totales_servicios(servicios)
         }
         
         # Si se solicita, incluir el detalle completo de servicios
@@ -2491,6 +3768,29 @@ async def get_turnos_with_servicios(turnos: list, org_filter: dict = None, inclu
     
     return result
 
+def turno_fecha_filter(fecha_inicio: Optional[str], fecha_fin: Optional[str]) -> dict:
+    """Filtro de rango de fechas para turnos usando inicio_dt_utc (idx_org_inicio_dt).
+    Comparar fecha_inicio como string dd/mm/yyyy no ordena por fecha; solo se usa si la fecha no se puede parsear"""
+    query = {}
+    if fecha_inicio and fecha_fin:
+        start_utc, end_utc = get_date_range_utc(fecha_inicio, fecha_fin)
+        if start_utc and end_utc:
+            return {"inicio_dt_utc": {"$gte": start_utc, "$lte": end_utc}}
+    if fecha_inicio:
+        start_utc = parse_spanish_date_to_utc(fecha_inicio, "00:00")
+        if start_utc:
+            query["inicio_dt_utc"] = {"$gte": start_utc}
+        else:
+            # Fallback a string comparison (datos antiguos sin migration)
+            query["fecha_inicio"] = {"$gte": fecha_inicio}
+    if fecha_fin:
+        end_utc = parse_spanish_date_to_utc(fecha_fin, "23:59")
+        if end_utc:
+            query.setdefault("inicio_dt_utc", {})["$lte"] = end_utc.replace(second=59, microsecond=999999)
+        else:
+            query.setdefault("fecha_inicio", {})["$lte"] = fecha_fin
+    return query
+
 @api_router.get("/turnos", response_model=List[TurnoResponse])
 async def get_turnos(
     current_user: dict = Depends(get_current_user),
@@ -2517,13 +3817,7 @@ async def get_turnos(
         query["taxista_id"] = taxista_id
     
     # Filtro por fechas
-    if fecha_inicio:
-        query["fecha_inicio"] = {"$gte": fecha_inicio}
-    if fecha_fin:
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = fecha_fin
-        else:
-            query["fecha_inicio"] = {"$lte": fecha_fin}
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
     
     # Filtros por estado
     if cerrado is not None:
@@ -2549,7 +3843,8 @@ async def get_turnos(
     if turnos:
         turno_ids = [str(t["_id"]) for t in turnos]
         all_servicios = await db.services.find(
-            {"turno_id": {"$in": turno_ids}, **org_filter}  # Con org_filter
+            {"turno_id": {"$in": turno_ids}, **org_filter},  # Con org_filter
+            SERVICE_TOTALS_PROJECTION
         ).to_list(MAX_BATCH_SERVICES)
         
         # Guard defensivo: si alcanzamos el límite, devolvemos error controlado
@@ -2576,23 +3871,21 @@ async def get_turnos(
         
         # Obtener servicios del turno desde el diccionario
         servicios = servicios_by_turno.get(turno_id, [])
-        
-        total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-        total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
+        totales = calcular_totales_servicios(servicios)
         
         # Calcular km del turno: usar km_fin si existe, sino usar suma de km de servicios
         if turno.get("km_fin") is not None:
             total_km = turno["km_fin"] - turno["km_inicio"]
         else:
-            total_km = sum(s.get("kilometros") or 0 for s in servicios)
+            total_km = totales["total_km"]
         
         result.append(TurnoResponse(
             id=turno_id,
             **{k: v for k, v in turno.items() if k != "_id"},
-            total_importe_clientes=total_clientes,
-            total_importe_particulares=total_particulares,
+            total_importe_clientes=totales["total_clientes"],
+            total_importe_particulares=totales["total_particulares"],
             total_kilometros=total_km,
-            cantidad_servicios=len(servicios)
+            cantidad_servicios=totales["cantidad_servicios"]
         ))
     
     return result
@@ -2608,24 +3901,22 @@ async def get_turno_activo(current_user: dict = Depends(get_current_user)):
         return None
     
     turno_id = str(turno["_id"])
-    servicios = await db.services.find({"turno_id": turno_id}).to_list(1000)
-    
-    total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-    total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
+    servicios = await db.services.find({"turno_id": turno_id}, SERVICE_TOTALS_PROJECTION).to_list(1000)
+    totales = calcular_totales_servicios(servicios)
     
     # Calcular km del turno: usar km_fin si existe, sino usar suma de km de servicios
     if turno.get("km_fin") is not None:
         total_km = turno["km_fin"] - turno["km_inicio"]
     else:
-        total_km = sum(s.get("kilometros") or 0 for s in servicios)
+        total_km = totales["total_km"]
     
     return TurnoResponse(
         id=turno_id,
         **{k: v for k, v in turno.items() if k != "_id"},
-        total_importe_clientes=total_clientes,
-        total_importe_particulares=total_particulares,
+        total_importe_clientes=totales["total_clientes"],
+        total_importe_particulares=totales["total_particulares"],
         total_kilometros=total_km,
-        cantidad_servicios=len(servicios)
+        cantidad_servicios=totales["cantidad_servicios"]
     )
 
 @api_router.put("/turnos/{turno_id}/finalizar", response_model=TurnoResponse)
@@ -2656,6 +3947,7 @@ async def finalizar_turno(turno_id: str, turno_update: TurnoFinalizarUpdate, cur
     fin_dt_utc = parse_spanish_date_to_utc(update_dict.get("fecha_fin"), update_dict["hora_fin"])
     if fin_dt_utc:
         update_dict["fin_dt_utc"] = fin_dt_utc
+    update_dict["updated_at"] = datetime.utcnow()
     
     await db.turnos.update_one(
         {"_id": oid, **org_filter},
@@ -2665,18 +3957,16 @@ async def finalizar_turno(turno_id: str, turno_update: TurnoFinalizarUpdate, cur
     updated_turno = await db.turnos.find_one({"_id": oid, **org_filter})
     
     # Calcular totales (scoped)
-    servicios = await db.services.find({"turno_id": turno_id, **org_filter}).to_list(1000)
-    total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-    total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
-    total_km = sum(s.get("kilometros") or 0 for s in servicios)
+    servicios = await db.services.find({"turno_id": turno_id, **org_filter}, SERVICE_TOTALS_PROJECTION).to_list(1000)
+    totales = calcular_totales_servicios(servicios)
     
     return TurnoResponse(
         id=turno_id,
         **{k: v for k, v in updated_turno.items() if k != "_id"},
-        total_importe_clientes=total_clientes,
-        total_importe_particulares=total_particulares,
-        total_kilometros=total_km,
-        cantidad_servicios=len(servicios)
+        total_importe_clientes=totales["total_clientes"],
+        total_importe_particulares=totales["total_particulares"],
+        total_kilometros=totales["total_km"],
+        cantidad_servicios=totales["cantidad_servicios"]
     )
 
 @api_router.put("/turnos/{turno_id}", response_model=TurnoResponse)
@@ -2696,6 +3986,7 @@ async def update_turno(turno_id: str, turno_update: TurnoUpdate, current_user: d
     
     update_dict = turno_update.dict(exclude_none=True)
     if update_dict:
+        update_dict["updated_at"] = datetime.utcnow()
         await db.turnos.update_one(
             {"_id": oid, **org_filter},
             {"$set": update_dict}
@@ -2704,18 +3995,16 @@ async def update_turno(turno_id: str, turno_update: TurnoUpdate, current_user: d
     updated_turno = await db.turnos.find_one({"_id": oid, **org_filter})
     
     # Calcular totales (scoped)
-    servicios = await db.services.find({"turno_id": turno_id, **org_filter}).to_list(1000)
-    total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-    total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
-    total_km = sum(s.get("kilometros") or 0 for s in servicios)
+    servicios = await db.services.find({"turno_id": turno_id, **org_filter}, SERVICE_TOTALS_PROJECTION).to_list(1000)
+    totales = calcular_totales_servicios(servicios)
     
     return TurnoResponse(
         id=turno_id,
         **{k: v for k, v in updated_turno.items() if k != "_id"},
-        total_importe_clientes=total_clientes,
-        total_importe_particulares=total_particulares,
-        total_kilometros=total_km,
-        cantidad_servicios=len(servicios)
+        total_importe_clientes=totales["total_clientes"],
+        total_importe_particulares=totales["total_particulares"],
+        total_kilometros=totales["total_km"],
+        cantidad_servicios=totales["cantidad_servicios"]
     )
 
 @api_router.delete("/turnos/{turno_id}")
@@ -2737,12 +4026,18 @@ async def delete_turno(turno_id: str, current_user: dict = Depends(get_current_a
     if not turno:
         raise HTTPException(status_code=404, detail="Turno no encontrado")
     
+    # IDs de los servicios a eliminar (para el change feed)
+    servicios_ids = await db.services.find({"turno_id": turno_id, **org_filter}, {"_id": 1}).to_list(None)
+    
     # Eliminar todos los servicios asociados al turno (scoped)
     servicios_result = await db.services.delete_many({"turno_id": turno_id, **org_filter})
     
     # Eliminar el turno (scoped)
     await db.turnos.delete_one({"_id": oid, **org_filter})
     
+    await record_feed_deletions("services", [s["_id"] for s in servicios_ids], turno.get("organization_id"))
+    await record_feed_deletions("turnos", [oid], turno.get("organization_id"))
+    
     return {
         "message": "Turno eliminado correctamente",
         "turno_id": turno_id,
@@ -2845,24 +4140,22 @@ async def update_turno_combustible(
     
     await db.turnos.update_one(
         {"_id": oid, **org_filter},
-        {"$set": {"combustible": combustible_data}}
+        {"$set": {"combustible": combustible_data, "updated_at": datetime.utcnow()}}
     )
     
     updated_turno = await db.turnos.find_one({"_id": oid, **org_filter})
     
     # Calcular totales
-    servicios = await db.services.find({"turno_id": turno_id, **org_filter}).to_list(1000)
-    total_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-    total_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
-    total_km = sum(s.get("kilometros") or 0 for s in servicios)
+    servicios = await db.services.find({"turno_id": turno_id, **org_filter}, SERVICE_TOTALS_PROJECTION).to_list(1000)
+    totales = calcular_totales_servicios(servicios)
     
     return TurnoResponse(
         id=turno_id,
         **{k: v for k, v in updated_turno.items() if k != "_id"},
-        total_importe_clientes=total_clientes,
-        total_importe_particulares=total_particulares,
-        total_kilometros=total_km,
-        cantidad_servicios=len(servicios)
+        total_importe_clientes=totales["total_clientes"],
+        total_importe_particulares=totales["total_particulares"],
+        total_kilometros=totales["total_km"],
+        cantidad_servicios=totales["cantidad_servicios"]
     )
 
 # (F) COMBUSTIBLE: Estadísticas de combustible
@@ -2888,15 +4181,11 @@ async def get_combustible_estadisticas(
         if "-" in from_date:
             parts = from_date.split("-")
             from_date = f"{parts[2]}/{parts[1]}/{parts[0]}"
-        query["fecha_inicio"] = {"$gte": from_date}
     if to_date:
         if "-" in to_date:
             parts = to_date.split("-")
             to_date = f"{parts[2]}/{parts[1]}/{parts[0]}"
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = to_date
-        else:
-            query["fecha_inicio"] = {"$lte": to_date}
+    query.update(turno_fecha_filter(from_date, to_date))
     
     turnos = await db.turnos.find(query).to_list(10000)
     
@@ -2959,6 +4248,27 @@ async def get_combustible_estadisticas(
     }
 
 # Exportación de Turnos
+# ==========================================
+# EXPORTS: renderizadores con carga diferida
+# ==========================================
+# openpyxl + reportlab solo los necesitan los exports: export_renderers se importa
+# en el primer export (en un hilo, sin bloquear el event loop) y no en el arranque
+# de cada worker. EXPORT_PREWARM=1 lo carga en segundo plano tras el startup.
+import importlib
+
+EXPORT_PREWARM = os.environ.get("EXPORT_PREWARM", "0") == "1"
+
+_export_renderers = None
+
+async def get_export_renderers():
+    """Módulo export_renderers, importado una sola vez"""
+    global _export_renderers
+    if _export_renderers is None:
+        started = time.perf_counter()
+        _export_renderers = await asyncio.to_thread(importlib.import_module, "export_renderers")
+        logger.info(f"export_renderers cargado en {(time.perf_counter() - started) * 1000:.0f}ms")
+    return _export_renderers
+
 @api_router.get("/turnos/export/csv")
 async def export_turnos_csv(
     current_user: dict = Depends(get_current_admin),
@@ -2992,13 +4302,7 @@ async def export_turnos_csv(
             raise HTTPException(status_code=400, detail="El taxista no existe o no pertenece a esta organización")
         query["taxista_id"] = taxista_id
     
-    if fecha_inicio:
-        query["fecha_inicio"] = {"$gte": fecha_inicio}
-    if fecha_fin:
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = fecha_fin
-        else:
-            query["fecha_inicio"] = {"$lte": fecha_fin}
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
     if cerrado is not None:
         query["cerrado"] = cerrado
     if liquidado is not None:
@@ -3127,13 +4431,7 @@ async def export_turnos_excel(
             raise HTTPException(status_code=400, detail="El taxista no existe o no pertenece a esta organización")
         query["taxista_id"] = taxista_id
     
-    if fecha_inicio:
-        query["fecha_inicio"] = {"$gte": fecha_inicio}
-    if fecha_fin:
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = fecha_fin
-        else:
-            query["fecha_inicio"] = {"$lte": fecha_fin}
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
     if cerrado is not None:
         query["cerrado"] = cerrado
     if liquidado is not None:
@@ -3144,119 +4442,7 @@ async def export_turnos_excel(
     # Usar helper function con org_filter para evitar contaminación de servicios
     turnos_con_totales = await get_turnos_with_servicios(turnos, org_filter=org_filter, include_servicios_detail=True)
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Turnos Detallados"
-    
-    # Header styling
-    header_fill = PatternFill(start_color="0066CC", end_color="0066CC", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    turno_fill = PatternFill(start_color="FFD966", end_color="FFD966", fill_type="solid")
-    servicio_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-    
-    headers = [
-        "Tipo", "Taxista", "Vehículo", "Fecha Inicio", "Hora Inicio", "KM Inicio",
-        "Fecha Fin", "Hora Fin", "KM Fin", "Total KM",
-        "N° Servicios", "Total Clientes (€)", "Total Particulares (€)", "Total (€)",
-        "Cerrado", "Liquidado",
-        "⛽ Repostó", "⛽ Litros", "⛽ Vehículo", "⛽ KM",
-        "Servicio #", "Fecha Serv.", "Hora Serv.", "Origen", "Destino", "Tipo Serv.", 
-        "Empresa", "Importe", "Imp. Espera", "Total Serv.", "KM Serv."
-    ]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Data
-    current_row = 2
-    for turno in turnos_con_totales:
-        total_km_turno = turno.get("km_fin", 0) - turno["km_inicio"] if turno.get("km_fin") else 0
-        total_importe = turno["total_clientes"] + turno["total_particulares"]
-        
-        # Campos de combustible
-        combustible = turno.get("combustible", {}) or {}
-        comb_repostado = "Sí" if combustible.get("repostado") else "No"
-        comb_litros = combustible.get("litros", "") if combustible.get("repostado") else ""
-        comb_vehiculo = combustible.get("vehiculo_matricula", "") if combustible.get("repostado") else ""
-        comb_km = combustible.get("km_vehiculo", "") if combustible.get("repostado") else ""
-        
-        # Fila resumen del turno (con fondo amarillo)
-        ws.cell(row=current_row, column=1, value="TURNO")
-        ws.cell(row=current_row, column=2, value=turno["taxista_nombre"])
-        ws.cell(row=current_row, column=3, value=turno["vehiculo_matricula"])
-        ws.cell(row=current_row, column=4, value=turno["fecha_inicio"])
-        ws.cell(row=current_row, column=5, value=turno["hora_inicio"])
-        ws.cell(row=current_row, column=6, value=turno["km_inicio"])
-        ws.cell(row=current_row, column=7, value=turno.get("fecha_fin", ""))
-        ws.cell(row=current_row, column=8, value=turno.get("hora_fin", ""))
-        ws.cell(row=current_row, column=9, value=turno.get("km_fin", ""))
-        ws.cell(row=current_row, column=10, value=total_km_turno)
-        ws.cell(row=current_row, column=11, value=turno["cantidad_servicios"])
-        ws.cell(row=current_row, column=12, value=round(turno["total_clientes"], 2))
-        ws.cell(row=current_row, column=13, value=round(turno["total_particulares"], 2))
-        ws.cell(row=current_row, column=14, value=round(total_importe, 2))
-        ws.cell(row=current_row, column=15, value="Sí" if turno.get("cerrado") else "No")
-        ws.cell(row=current_row, column=16, value="Sí" if turno.get("liquidado") else "No")
-        # Columnas de combustible
-        ws.cell(row=current_row, column=17, value=comb_repostado)
-        ws.cell(row=current_row, column=18, value=comb_litros)
-        ws.cell(row=current_row, column=19, value=comb_vehiculo)
-        ws.cell(row=current_row, column=20, value=comb_km)
-        
-        # Aplicar fondo amarillo a la fila del turno
-        for col in range(1, 32):
-            ws.cell(row=current_row, column=col).fill = turno_fill
-        
-        current_row += 1
-        
-        # Filas de servicios del turno (con fondo gris claro)
-        servicios = turno.get("servicios", [])
-        for idx, servicio in enumerate(servicios, 1):
-            importe = servicio.get("importe", 0)
-            importe_espera = servicio.get("importe_espera", 0)
-            importe_total = servicio.get("importe_total", importe + importe_espera)
-            empresa_nombre = servicio.get("empresa_nombre", "")
-            
-            ws.cell(row=current_row, column=1, value="SERVICIO")
-            ws.cell(row=current_row, column=21, value=idx)
-            ws.cell(row=current_row, column=22, value=servicio.get("fecha", ""))
-            ws.cell(row=current_row, column=23, value=servicio.get("hora", ""))
-            ws.cell(row=current_row, column=24, value=servicio.get("origen", ""))
-            ws.cell(row=current_row, column=25, value=servicio.get("destino", ""))
-            ws.cell(row=current_row, column=26, value=servicio.get("tipo", ""))
-            ws.cell(row=current_row, column=27, value=empresa_nombre if servicio.get("tipo") == "empresa" else "")
-            ws.cell(row=current_row, column=28, value=round(importe, 2))
-            ws.cell(row=current_row, column=29, value=round(importe_espera, 2))
-            ws.cell(row=current_row, column=30, value=round(importe_total, 2))
-            ws.cell(row=current_row, column=31, value=servicio.get("kilometros", 0) if servicio.get("kilometros") is not None else 0)
-            
-            # Aplicar fondo gris claro a la fila del servicio
-            for col in range(1, 32):
-                ws.cell(row=current_row, column=col).fill = servicio_fill
-            
-            current_row += 1
-        
-        # Fila vacía para separar turnos
-        current_row += 1
-    
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        adjusted_width = min((max_length + 2), 50)  # Máximo 50 caracteres de ancho
-        ws.column_dimensions[column].width = adjusted_width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    output = io.BytesIO((await get_export_renderers()).render_turnos_excel(turnos_con_totales))
     
     headers = {"Content-Disposition": "attachment; filename=turnos_detallado.xlsx"}
     if applied_default_limit:
@@ -3300,13 +4486,7 @@ async def export_turnos_pdf(
             raise HTTPException(status_code=400, detail="El taxista no existe o no pertenece a esta organización")
         query["taxista_id"] = taxista_id
     
-    if fecha_inicio:
-        query["fecha_inicio"] = {"$gte": fecha_inicio}
-    if fecha_fin:
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = fecha_fin
-        else:
-            query["fecha_inicio"] = {"$lte": fecha_fin}
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
     if cerrado is not None:
         query["cerrado"] = cerrado
     if liquidado is not None:
@@ -3317,134 +4497,183 @@ async def export_turnos_pdf(
     # Usar helper function con org_filter para evitar contaminación de servicios
     turnos_con_totales = await get_turnos_with_servicios(turnos, org_filter=org_filter, include_servicios_detail=True)
     
-    output = io.BytesIO()
-    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    title = Paragraph("<b>Turnos Detallados - TaxiFast</b>", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Procesar cada turno con sus servicios
-    for turno_idx, turno in enumerate(turnos_con_totales):
-        # Título del turno
-        turno_title = Paragraph(
-            f"<b>Turno {turno_idx + 1}: {turno['taxista_nombre']} - {turno['vehiculo_matricula']}</b>",
-            styles['Heading2']
+    output = io.BytesIO((await get_export_renderers()).render_turnos_pdf(turnos_con_totales))
+    headers = {"Content-Disposition": "attachment; filename=turnos_detallado.pdf"}
+    if applied_default_limit:
+        headers["X-Export-Default-Date-Range"] = "31d"
+    return StreamingResponse(
+        output,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+# ==========================================
+# EXPORT BUNDLE: un fichero por taxista en un ZIP
+# ==========================================
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Workers de render (PDF/Excel son CPU-bound, no deben bloquear el event loop)
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+_export_pool: Optional[ProcessPoolExecutor] = None
+
+def get_export_pool() -> ProcessPoolExecutor:
+    """Pool de procesos para renderizar exports. Se crea en el primer uso.
+    Usa 'spawn' para que los workers solo importen export_renderers (no server.py
+    ni el cliente de Mongo)."""
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(
+            max_workers=EXPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
         )
-        elements.append(turno_title)
-        elements.append(Spacer(1, 0.1*inch))
-        
-        # Información del turno
-        estado = []
-        if turno.get("cerrado"):
-            estado.append("Cerrado")
-        else:
-            estado.append("Activo")
-        if turno.get("liquidado"):
-            estado.append("Liquidado")
-        
-        total_km_turno = turno.get("km_fin", 0) - turno["km_inicio"] if turno.get("km_fin") else 0
-        total_importe = turno["total_clientes"] + turno["total_particulares"]
-        
-        info_turno = [
-            ["Fecha Inicio:", f"{turno['fecha_inicio']} {turno['hora_inicio']}", 
-             "Fecha Fin:", f"{turno.get('fecha_fin', 'N/A')} {turno.get('hora_fin', '')}" if turno.get('fecha_fin') else "En curso"],
-            ["KM Inicio:", str(turno["km_inicio"]), 
-             "KM Fin:", str(turno.get("km_fin", "N/A"))],
-            ["Total KM:", str(total_km_turno), 
-             "N° Servicios:", str(turno["cantidad_servicios"])],
-            ["Total Clientes:", f"{turno['total_clientes']:.2f}€", 
-             "Total Particulares:", f"{turno['total_particulares']:.2f}€"],
-            ["Total General:", f"{total_importe:.2f}€", 
-             "Estado:", " / ".join(estado)]
-        ]
-        
-        # Añadir fila de combustible si repostó
-        combustible = turno.get("combustible", {}) or {}
-        if combustible.get("repostado"):
-            comb_litros = combustible.get("litros", "N/A")
-            comb_vehiculo = combustible.get("vehiculo_matricula", "N/A")
-            comb_km = combustible.get("km_vehiculo", "N/A")
-            info_turno.append([
-                "⛽ Repostaje:", f"{comb_litros} L",
-                "Vehículo/KM:", f"{comb_vehiculo} / {comb_km} km"
-            ])
-        
-        info_table = Table(info_turno, colWidths=[2*inch, 2*inch, 2*inch, 2*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#E7E6E6')),
-            ('BACKGROUND', (2, 0), (2, -1), colors.HexColor('#E7E6E6')),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        
-        elements.append(info_table)
-        elements.append(Spacer(1, 0.15*inch))
-        
-        # Tabla de servicios del turno
-        servicios = turno.get("servicios", [])
-        if servicios:
-            servicios_title = Paragraph("<b>Servicios:</b>", styles['Heading3'])
-            elements.append(servicios_title)
-            elements.append(Spacer(1, 0.05*inch))
-            
-            servicios_data = [["#", "Fecha", "Hora", "Origen", "Destino", "Tipo", "Importe", "KM"]]
-            
-            for idx, servicio in enumerate(servicios, 1):
-                importe_total = servicio.get("importe_total", servicio.get("importe", 0) + servicio.get("importe_espera", 0))
-                origen = servicio.get("origen", "")[:15]
-                destino = servicio.get("destino", "")[:15]
-                
-                servicios_data.append([
-                    str(idx),
-                    servicio.get("fecha", ""),
-                    servicio.get("hora", ""),
-                    origen,
-                    destino,
-                    servicio.get("tipo", "")[:4].upper(),
-                    f"{importe_total:.2f}€",
-                    str(servicio.get("kilometros", 0))
-                ])
-            
-            servicios_table = Table(servicios_data, colWidths=[0.3*inch, 0.9*inch, 0.7*inch, 1.5*inch, 1.5*inch, 0.6*inch, 0.8*inch, 0.5*inch])
-            servicios_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 7),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ('FONTSIZE', (0, 1), (-1, -1), 6),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
-            
-            elements.append(servicios_table)
-        else:
-            no_servicios = Paragraph("<i>Este turno no tiene servicios registrados</i>", styles['Normal'])
-            elements.append(no_servicios)
-        
-        # Separador entre turnos
-        elements.append(Spacer(1, 0.3*inch))
-        if turno_idx < len(turnos_con_totales) - 1:
-            elements.append(Paragraph("<hr/>", styles['Normal']))
-            elements.append(Spacer(1, 0.2*inch))
+        logger.info(f"Export pool iniciado con {EXPORT_WORKERS} workers")
+    return _export_pool
+
+def shutdown_export_pool():
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+        _export_pool = None
+
+class _ZipStreamBuffer:
+    """Destino no-seekable para zipfile: acumula lo escrito y se vacía con drain()"""
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# Renders en curso: el shutdown espera a que terminen antes de cerrar el pool
+EXPORT_DRAIN_SECONDS = float(os.environ.get("EXPORT_DRAIN_SECONDS", "30"))
+_exports_in_flight = 0
+_exports_idle = asyncio.Event()
+_exports_idle.set()
+
+async def _render_in_pool(func, *args) -> bytes:
+    global _exports_in_flight
+    loop = asyncio.get_running_loop()
+    _exports_in_flight += 1
+    _exports_idle.clear()
+    try:
+        return await loop.run_in_executor(get_export_pool(), func, *args)
+    finally:
+        _exports_in_flight -= 1
+        if not _exports_in_flight:
+            _exports_idle.set()
+
+async def drain_exports(timeout: float):
+    if not _exports_in_flight:
+        return
+    logger.info(f"Shutdown: esperando {_exports_in_flight} renders de export en curso (máx {timeout:g}s)")
+    try:
+        await asyncio.wait_for(_exports_idle.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Shutdown: {_exports_in_flight} renders de export sin terminar tras {timeout:g}s, se cancelan")
+
+async def stream_zip_entries(renders: dict):
+    """
+    Genera un ZIP en streaming a partir de {nombre_fichero: (render_func, args)}.
+    Los renders se lanzan todos en el pool y cada entrada se escribe en cuanto
+    termina (orden de finalización, no de envío).
+    """
+    sink = _ZipStreamBuffer()
+    async def _named(name, func, args):
+        return name, await _render_in_pool(func, *args)
+    pending = [asyncio.ensure_future(_named(name, func, args)) for name, (func, args) in renders.items()]
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for next_done in asyncio.as_completed(pending):
+                name, data = await next_done
+                zf.writestr(name, data)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        # Directorio central del ZIP
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    finally:
+        for task in pending:
+            task.cancel()
+
+@api_router.get("/turnos/export/bundle")
+async def export_turnos_bundle(
+    current_user: dict = Depends(get_current_admin),
+    formato: str = Query("pdf", description="Formato de cada fichero: pdf|excel"),
+    fecha_inicio: Optional[str] = Query(None),
+    fecha_fin: Optional[str] = Query(None),
+    cerrado: Optional[bool] = Query(None),
+    liquidado: Optional[bool] = Query(None)
+):
+    """
+    Exporta los turnos del período en un ZIP con un fichero (PDF o Excel) por taxista.
+    Los datos se consultan una sola vez y se reparten por taxista; el render de
+    cada fichero se hace en paralelo en el pool de exports y el ZIP se envía
+    según van terminando las entradas.
+    """
+    if formato not in ("pdf", "excel"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'pdf' o 'excel'")
+    
+    # SEGURIDAD: Filtrar por organización
+    org_filter = await get_org_filter(current_user)
+    query = {**org_filter}
+    
+    # ROBUSTEZ: Si no hay filtros de fecha, limitar a últimos 31 días
+    applied_default_limit = False
+    if not fecha_inicio and not fecha_fin:
+        default_start = (datetime.utcnow() - timedelta(days=31)).strftime("%d/%m/%Y")
+        fecha_inicio = default_start
+        applied_default_limit = True
+        logger.info(f"Export turnos bundle sin filtros: aplicando límite automático desde {default_start}")
+    
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
+    if cerrado is not None:
+        query["cerrado"] = cerrado
+    if liquidado is not None:
+        query["liquidado"] = liquidado
     
-    doc.build(elements)
+    turnos = await db.turnos.find(query).sort("fecha_inicio", -1).to_list(10000)
     
-    output.seek(0)
-    headers = {"Content-Disposition": "attachment; filename=turnos_detallado.pdf"}
+    # Una sola batch query de servicios para todo el período
+    turnos_con_totales = await get_turnos_with_servicios(turnos, org_filter=org_filter, include_servicios_detail=True)
+    
+    # Particionar por taxista (manteniendo el orden de fecha)
+    turnos_by_taxista = {}
+    for turno in turnos_con_totales:
+        turnos_by_taxista.setdefault(turno["taxista_id"], []).append(turno)
+    
+    renderers = await get_export_renderers()
+    extension = "pdf" if formato == "pdf" else "xlsx"
+    renders = {}
+    for taxista_id, turnos_taxista in turnos_by_taxista.items():
+        nombre = turnos_taxista[0].get("taxista_nombre") or "taxista"
+        filename = f"turnos_{generate_slug(nombre) or 'taxista'}_{taxista_id[-6:]}.{extension}"
+        if formato == "pdf":
+            renders[filename] = (renderers.render_turnos_pdf, (turnos_taxista, f"Turnos - {nombre}"))
+        else:
+            renders[filename] = (renderers.render_turnos_excel, (turnos_taxista,))
+    
+    headers = {
+        "Content-Disposition": "attachment; filename=turnos_por_taxista.zip",
+        "X-Export-Files": str(len(renders))
+    }
     if applied_default_limit:
         headers["X-Export-Default-Date-Range"] = "31d"
     return StreamingResponse(
-        output,
-        media_type="application/pdf",
+        stream_zip_entries(renders),
+        media_type="application/zip",
         headers=headers
     )
 
@@ -3459,13 +4688,7 @@ async def get_turnos_estadisticas(
     org_filter = await get_org_filter(current_user)
     query = {**org_filter}
     
-    if fecha_inicio:
-        query["fecha_inicio"] = {"$gte": fecha_inicio}
-    if fecha_fin:
-        if "fecha_inicio" in query:
-            query["fecha_inicio"]["$lte"] = fecha_fin
-        else:
-            query["fecha_inicio"] = {"$lte": fecha_fin}
+    query.update(turno_fecha_filter(fecha_inicio, fecha_fin))
     
     turnos = await db.turnos.find(query).to_list(10000)
     
@@ -3512,11 +4735,12 @@ async def get_reporte_diario(
     
     # Obtener taxistas de la organización
     taxistas_query = {"role": "taxista", **org_filter}
-    taxistas = await db.users.find(taxistas_query).to_list(1000)
+    taxistas = await db.users.find(taxistas_query, {"nombre": 1}).to_list(1000)
     
     # OPTIMIZACIÓN: Batch query - traer servicios de la fecha filtrados por org
+    # (solo campos de totales: lectura cubierta por idx_org_fecha_totals)
     services_query = {"fecha": fecha, **org_filter}
-    all_servicios = await db.services.find(services_query).to_list(10000)
+    all_servicios = await db.services.find(services_query, SERVICE_TOTALS_BY_TAXISTA_PROJECTION).to_list(10000)
     
     # Agrupar servicios por taxista_id en memoria
     servicios_by_taxista = {}
@@ -3538,10 +4762,11 @@ async def get_reporte_diario(
             continue  # Omitir taxistas sin servicios ese día
         
         # Calcular totales
-        total_servicios = len(servicios)
-        total_km = sum(s.get("kilometros") or 0 for s in servicios)
-        rec_clientes = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "empresa")
-        rec_particulares = sum(s.get("importe_total", s.get("importe", 0)) for s in servicios if s.get("tipo") == "particular")
+        totales = calcular_totales_servicios(servicios)
+        total_servicios = totales["cantidad_servicios"]
+        total_km = totales["total_km"]
+        rec_clientes = totales["total_clientes"]
+        rec_particulares = totales["total_particulares"]
         
         reporte.append({
             "taxista_id": taxista_id,
@@ -3702,6 +4927,7 @@ async def create_service(service: ServiceCreate, current_user: dict = Depends(ge
     service_dict["taxista_id"] = str(current_user["_id"])
     service_dict["taxista_nombre"] = current_user["nombre"]
     service_dict["created_at"] = datetime.utcnow()
+    service_dict["updated_at"] = service_dict["created_at"]
     service_dict["synced"] = True
     
     # Calcular service_dt_utc para ordenacion y filtros correctos
@@ -3825,6 +5051,12 @@ async def sync_services(service_sync: ServiceSync, current_user: dict = Depends(
             org_features = org_doc.get("features", {})
     has_taxitur_origen_feature = org_features.get("taxitur_origen", False)
     
+    # service_dt_utc de todo el lote en una sola conversión vectorizada
+    service_dts = parse_spanish_dates_to_utc(
+        [service.fecha for service in service_sync.services],
+        [service.hora for service in service_sync.services]
+    )
+    
     for idx, service in enumerate(service_sync.services):
         try:
             service_dict = service.dict()
@@ -3926,14 +5158,15 @@ async def sync_services(service_sync: ServiceSync, current_user: dict = Depends(
             service_dict["taxista_id"] = str(current_user["_id"])
             service_dict["taxista_nombre"] = current_user["nombre"]
             service_dict["created_at"] = datetime.utcnow()
+            service_dict["updated_at"] = service_dict["created_at"]
             service_dict["synced"] = True
             service_dict["organization_id"] = org_id
             
             # Calcular importe_total
             service_dict["importe_total"] = service_dict.get("importe", 0) + service_dict.get("importe_espera", 0)
             
-            # Calcular service_dt_utc para ordenacion y filtros correctos
-            service_dt_utc = parse_spanish_date_to_utc(service_dict["fecha"], service_dict.get("hora", "00:00"))
+            # service_dt_utc para ordenacion y filtros correctos (calculado antes del bucle)
+            service_dt_utc = service_dts[idx]
             if service_dt_utc:
                 service_dict["service_dt_utc"] = service_dt_utc
             
@@ -4007,6 +5240,47 @@ async def sync_services(service_sync: ServiceSync, current_user: dict = Depends(
         "errors": errors if errors else None
     }
 
+# ==========================================
+# STREAMING JSON (listados grandes)
+# ==========================================
+# Los listados grandes se serializan elemento a elemento desde el cursor de Mongo
+# en lugar de construir la lista completa + su JSON en memoria.
+JSON_STREAM_BATCH = int(os.environ.get("JSON_STREAM_BATCH", "500"))
+
+def _doc_to_response_dict(doc: dict) -> dict:
+    """Documento Mongo -> dict para un *Response (id string en lugar de _id)"""
+    return {"id": str(doc["_id"]), **{k: v for k, v in doc.items() if k != "_id"}}
+
+async def _iter_json_array(cursor, model: Type[BaseModel]):
+    """
+    Genera un array JSON desde un cursor async, validando cada documento con `model`
+    (mismo contrato que response_model) y serializando con pydantic-core.
+    Se emite un chunk cada JSON_STREAM_BATCH elementos.
+    """
+    separator = ""
+    parts = ["["]
+    try:
+        async for doc in cursor:
+            parts.append(separator)
+            parts.append(model.model_validate(_doc_to_response_dict(doc)).model_dump_json())
+            separator = ","
+            if len(parts) >= JSON_STREAM_BATCH * 2:
+                yield "".join(parts).encode("utf-8")
+                parts = []
+        parts.append("]")
+        yield "".join(parts).encode("utf-8")
+    except Exception as e:
+        # Con la respuesta ya iniciada no se puede devolver un 500: se corta el stream
+        logger.error(f"Error streaming {model.__name__} list: {e}")
+        raise
+    finally:
+        await cursor.close()
+
+def stream_json_list(cursor, model: Type[BaseModel]) -> StreamingResponse:
+    """StreamingResponse con un array JSON de `model` leído desde `cursor`"""
+    cursor.batch_size(JSON_STREAM_BATCH)
+    return StreamingResponse(_iter_json_array(cursor, model), media_type="application/json")
+
 @api_router.get("/services", response_model=List[ServiceResponse])
 async def get_services(
     current_user: dict = Depends(get_current_user),
@@ -4097,14 +5371,9 @@ async def get_services(
         limit = 10000  # Maximum
     
     # Ordenar por service_dt_utc (datetime real) descendente, fallback a created_at
-    services = await db.services.find(query).sort([("service_dt_utc", -1), ("created_at", -1)]).limit(limit).to_list(limit)
-    return [
-        ServiceResponse(
-            id=str(service["_id"]),
-            **{k: v for k, v in service.items() if k != "_id"}
-        )
-        for service in services
-    ]
+    # Streaming desde el cursor: memoria constante aunque limit sea 10000
+    cursor = db.services.find(query).sort([("service_dt_utc", -1), ("created_at", -1)]).limit(limit)
+    return stream_json_list(cursor, ServiceResponse)
 
 @api_router.put("/services/{service_id}", response_model=ServiceResponse)
 async def update_service(service_id: str, service: ServiceCreate, current_user: dict = Depends(get_current_user)):
@@ -4184,6 +5453,7 @@ async def update_service(service_id: str, service: ServiceCreate, current_user:
         if service_dt_utc:
             service_dict["service_dt_utc"] = service_dt_utc
     
+    service_dict["updated_at"] = datetime.utcnow()
     result = await db.services.update_one(
         {"_id": ObjectId(service_id), **org_filter},  # Doble check con org_filter
         {"$set": service_dict}
@@ -4213,6 +5483,8 @@ async def delete_service(service_id: str, current_user: dict = Depends(get_curre
         raise HTTPException(status_code=403, detail="Not authorized to delete this service")
     
     result = await db.services.delete_one({"_id": ObjectId(service_id), **org_filter})
+    if result.deleted_count:
+        await record_feed_deletions("services", [existing_service["_id"]], existing_service.get("organization_id"))
     return {"message": "Service deleted successfully"}
 
 # Export endpoints
@@ -4332,65 +5604,7 @@ async def export_excel(
     
     services = await db.services.find(query).sort("fecha", 1).to_list(10000)
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Servicios"
-    
-    # Header styling
-    header_fill = PatternFill(start_color="0066CC", end_color="0066CC", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    
-    headers = ["Fecha", "Hora", "Taxista", "Origen", "Destino", "Importe (€)", "Importe Espera (€)", "Importe Total (€)", "Kilómetros", "Tipo", "Empresa", "Cobrado", "Facturar", "Método Pago", "Origen Taxitur", "Vehículo ID", "Vehículo Matrícula", "Vehículo Cambiado", "Km Inicio Vehículo", "Km Fin Vehículo"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Data
-    for row_idx, service in enumerate(services, 2):
-        importe = service.get("importe", 0)
-        importe_espera = service.get("importe_espera", 0)
-        importe_total = service.get("importe_total", importe + importe_espera)
-        
-        ws.cell(row=row_idx, column=1, value=service["fecha"])
-        ws.cell(row=row_idx, column=2, value=service["hora"])
-        ws.cell(row=row_idx, column=3, value=service["taxista_nombre"])
-        ws.cell(row=row_idx, column=4, value=service["origen"])
-        ws.cell(row=row_idx, column=5, value=service["destino"])
-        ws.cell(row=row_idx, column=6, value=round(importe, 2))
-        ws.cell(row=row_idx, column=7, value=round(importe_espera, 2))
-        ws.cell(row=row_idx, column=8, value=round(importe_total, 2))
-        ws.cell(row=row_idx, column=9, value=service.get("kilometros", ""))
-        ws.cell(row=row_idx, column=10, value=service["tipo"])
-        ws.cell(row=row_idx, column=11, value=service.get("empresa_nombre", ""))
-        ws.cell(row=row_idx, column=12, value="Sí" if service.get("cobrado", False) else "No")
-        ws.cell(row=row_idx, column=13, value="Sí" if service.get("facturar", False) else "No")
-        # Nuevos campos PR1
-        ws.cell(row=row_idx, column=14, value=service.get("metodo_pago", "") or "")
-        ws.cell(row=row_idx, column=15, value=service.get("origen_taxitur", "") or "")
-        ws.cell(row=row_idx, column=16, value=service.get("vehiculo_id", "") or "")
-        ws.cell(row=row_idx, column=17, value=service.get("vehiculo_matricula", "") or "")
-        ws.cell(row=row_idx, column=18, value="Sí" if service.get("vehiculo_cambiado", False) else "No")
-        ws.cell(row=row_idx, column=19, value=service.get("km_inicio_vehiculo", "") if service.get("km_inicio_vehiculo") is not None else "")
-        ws.cell(row=row_idx, column=20, value=service.get("km_fin_vehiculo", "") if service.get("km_fin_vehiculo") is not None else "")
-    
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    output = io.BytesIO((await get_export_renderers()).render_services_excel(services))
     
     headers = {"Content-Disposition": "attachment; filename=servicios.xlsx"}
     if applied_default_limit:
@@ -4440,63 +5654,489 @@ async def export_pdf(
     
     services = await db.services.find(query).sort("fecha", 1).to_list(10000)
     
-    output = io.BytesIO()
-    # Usar landscape (horizontal) para tener más espacio
-    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
-    elements = []
+    output = io.BytesIO((await get_export_renderers()).render_services_pdf(services))
+    headers = {"Content-Disposition": "attachment; filename=servicios.pdf"}
+    if applied_default_limit:
+        headers["X-Export-Default-Date-Range"] = "31d"
+    return StreamingResponse(
+        output,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+# ==========================================
+# FACTURACIÓN: extractos por empresa cliente (servicios facturar=True)
+# ==========================================
+class FacturacionRunRequest(BaseModel):
+    fecha_inicio: str  # formato dd/mm/yyyy
+    fecha_fin: str     # formato dd/mm/yyyy
+    marcar_facturados: bool = False  # Si True, marca los servicios incluidos como facturados
+    incluir_facturados: bool = False  # Si True, incluye servicios ya facturados en otro lote
+    empresa_ids: Optional[List[str]] = None  # Restringir a estas empresas
+    organization_id: Optional[str] = None  # Solo superadmin: organización a facturar
+
+# Campos de cada servicio que aparecen en el detalle del extracto
+FACTURA_LINEA_FIELDS = [
+    "fecha", "hora", "taxista_nombre", "origen", "destino", "importe",
+    "importe_espera", "importe_total", "kilometros", "vehiculo_matricula", "cobrado"
+]
+
+# Bucket GridFS de los extractos: un PDF/CSV puede superar el límite de 16 MB de un documento
+FACTURAS_BUCKET = "facturas_files"
+
+def _facturas_fs() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=FACTURAS_BUCKET)
+
+def _importe_linea(linea: dict):
+    """importe_total o, si falta, importe (como $ifNull); None si no es numérico (como $sum)"""
+    value = linea.get("importe_total")
+    if value is None:
+        value = linea.get("importe")
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def _factura_totales(lineas: list) -> dict:
+    total = total_cobrado = total_km = 0
+    for linea in lineas:
+        importe = _importe_linea(linea)
+        if importe is not None:
+            total += importe
+            if linea.get("cobrado") is True:
+                total_cobrado += importe
+        km = linea.get("kilometros")
+        if isinstance(km, (int, float)) and not isinstance(km, bool):
+            total_km += km
+    return {"n_servicios": len(lineas), "total": round(total, 2), "total_cobrado": round(total_cobrado, 2), "total_km": round(total_km, 2)}
+
+@api_router.post("/facturacion/run")
+async def run_facturacion(request: FacturacionRunRequest, current_user: dict = Depends(get_current_admin)):
+    """
+    Genera en un solo lote los extractos (PDF + CSV de líneas) de todas las empresas
+    cliente con servicios facturar=True en el período.
+    - 1 sola lectura ordenada de los servicios, agrupados por empresa según llega el
+      cursor (sin $group: un $push de todas las líneas superaría 16 MB)
+    - Los documentos se renderizan en paralelo en el pool de exports
+    - Los renders van a GridFS; facturas guarda solo el resumen y las referencias
+    - El lote (facturacion_batches) se inserta el último: si algo falla antes, se
+      deshace lo escrito y no queda un lote a medias
+    - Opcional: marca los servicios como facturados con una única escritura, antes
+      de renderizar; si otro lote concurrente ya ha marcado alguno, se aborta (409)
+    """
+    if is_superadmin(current_user):
+        if not request.organization_id:
+            raise HTTPException(status_code=400, detail="Superadmin debe indicar organization_id")
+        org_id = request.organization_id
+    else:
+        org_id = get_user_organization_id(current_user)
+        if not org_id:
+            raise HTTPException(status_code=403, detail="Usuario sin organización asignada. Contacte al administrador.")
     
-    styles = getSampleStyleSheet()
-    title = Paragraph("<b>Servicios de Taxi - TaxiFast</b>", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 0.3*inch))
+    org_oid = _get_object_id_or_400(org_id, "organization_id")
+    organizacion = await db.organizations.find_one({"_id": org_oid})
+    if not organizacion:
+        raise HTTPException(status_code=404, detail="Organización no encontrada")
     
-    # Table data con más columnas (incluyendo nuevos campos PR1)
-    data = [["Fecha", "Hora", "Taxista", "Origen", "Destino", "Importe", "Total", "KM", "Tipo", "Cobrado", "Pago", "Orig.Tax", "Veh.Cambio"]]
+    start_utc, end_utc = get_date_range_utc(request.fecha_inicio, request.fecha_fin)
+    if not start_utc or not end_utc:
+        raise HTTPException(status_code=400, detail="fecha_inicio y fecha_fin deben tener formato dd/mm/yyyy")
+    if start_utc > end_utc:
+        raise HTTPException(status_code=400, detail="fecha_inicio debe ser anterior a fecha_fin")
     
-    for service in services:
-        importe = service.get("importe", 0)
-        importe_espera = service.get("importe_espera", 0)
-        importe_total = service.get("importe_total", importe + importe_espera)
+    match = {
+        "organization_id": org_id,
+        "facturar": True,
+        "empresa_id": {"$nin": [None, ""]},
+        "service_dt_utc": {"$gte": start_utc, "$lte": end_utc}
+    }
+    if request.empresa_ids:
+        match["empresa_id"] = {"$in": request.empresa_ids}
+    if not request.incluir_facturados:
+        match["factura_batch_id"] = {"$exists": False}
+    
+    # Una sola lectura ordenada por fecha (idx_org_service_dt), agrupada por empresa
+    # según llega el cursor. Los totales se calculan sobre estas líneas: el mismo
+    # conjunto que se marca como facturado
+    projection = {f: 1 for f in FACTURA_LINEA_FIELDS}
+    projection.update(empresa_id=1, empresa_nombre=1, factura_batch_id=1, facturado_at=1)
+    grupos_map = {}
+    previous_batch = {}  # service_id -> (factura_batch_id, facturado_at) previos (incluir_facturados)
+    async for service in db.services.find(match, projection).sort("service_dt_utc", 1):
+        grupo = grupos_map.get(service["empresa_id"])
+        if grupo is None:
+            grupo = grupos_map[service["empresa_id"]] = {
+                "_id": service["empresa_id"], "empresa_nombre": service.get("empresa_nombre"), "service_ids": [], "lineas": []
+            }
+        grupo["service_ids"].append(service["_id"])
+        if service.get("factura_batch_id"):
+            previous_batch[service["_id"]] = (service["factura_batch_id"], service.get("facturado_at"))
+        grupo["lineas"].append({f: service[f] for f in FACTURA_LINEA_FIELDS if f in service})
+    grupos = sorted(grupos_map.values(), key=lambda g: str(g["empresa_nombre"] or ""))
+    
+    # Datos de las empresas (cabecera del extracto) en una sola query
+    empresa_oids = [ObjectId(g["_id"]) for g in grupos if ObjectId.is_valid(g["_id"])]
+    empresas = await db.companies.find({"_id": {"$in": empresa_oids}, "organization_id": org_id}).to_list(None)
+    empresas_map = {str(e["_id"]): e for e in empresas}
+    
+    now = datetime.utcnow()
+    batch_id = ObjectId()
+    all_ids = [sid for g in grupos for sid in g["service_ids"]]
+    
+    # Marcar servicios como facturados en una única escritura. Sin incluir_facturados,
+    # el filtro solo reclama servicios libres: si otro lote se ha adelantado con alguno,
+    # modified_count no cuadra y se deshace la marca
+    servicios_marcados = 0
+    if request.marcar_facturados and all_ids:
+        mark_filter = {"_id": {"$in": all_ids}, "organization_id": org_id}
+        if not request.incluir_facturados:
+            mark_filter["factura_batch_id"] = {"$exists": False}
+        mark_result = await db.services.update_many(
+            mark_filter,
+            {"$set": {"factura_batch_id": str(batch_id), "facturado_at": now, "updated_at": now}}
+        )
+        servicios_marcados = mark_result.modified_count
+        if servicios_marcados != len(all_ids):
+            if not request.incluir_facturados:
+                await _release_facturados(batch_id, all_ids, org_id)
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"{len(all_ids) - servicios_marcados} servicios han sido facturados por otro lote mientras se generaba este. Vuelva a ejecutar la facturación."
+                )
+            logger.warning(f"Facturación lote {batch_id}: marcados {servicios_marcados} de {len(all_ids)} servicios")
+    
+    periodo = f"{request.fecha_inicio} - {request.fecha_fin}"
+    org_data = {k: organizacion.get(k, "") for k in ("nombre", "cif", "direccion")}
+    fs = _facturas_fs()
+    file_ids = []
+    
+    async def _render_empresa(renderers, grupo):
+        empresa = empresas_map.get(grupo["_id"]) or {"nombre": grupo.get("empresa_nombre") or grupo["_id"]}
+        empresa_data = {k: empresa.get(k, "") for k in ("nombre", "cif", "direccion", "numero_cliente")}
+        pdf_bytes, csv_bytes = await asyncio.gather(
+            _render_in_pool(renderers.render_factura_pdf, empresa_data, org_data, periodo, grupo["lineas"]),
+            _render_in_pool(renderers.render_factura_csv, grupo["lineas"])
+        )
+        return empresa_data, {"pdf": pdf_bytes, "csv": csv_bytes}
+    
+    try:
+        renderers = await get_export_renderers()
+        renders = await asyncio.gather(*[_render_empresa(renderers, g) for g in grupos])
         
-        data.append([
-            service["fecha"],
-            service["hora"],
-            service["taxista_nombre"][:10],
-            service["origen"][:10],
-            service["destino"][:10],
-            f"{importe:.2f}€",
-            f"{importe_total:.2f}€",
-            service.get("kilometros", "") or "",
-            service["tipo"][:3].upper(),
-            "Sí" if service.get("cobrado", False) else "No",
-            (service.get("metodo_pago", "") or "")[:3].upper(),
-            (service.get("origen_taxitur", "") or "")[:4],
-            "Sí" if service.get("vehiculo_cambiado", False) else "No"
-        ])
+        resumen_empresas = []
+        facturas_docs = []
+        for grupo, (empresa_data, rendered) in zip(grupos, renders):
+            stored = {}
+            for formato, data in rendered.items():
+                file_id = await fs.upload_from_stream(
+                    f"{batch_id}_{grupo['_id']}.{formato}", data,
+                    metadata={"batch_id": str(batch_id), "empresa_id": grupo["_id"], "organization_id": org_id}
+                )
+                file_ids.append(file_id)
+                stored[f"{formato}_file_id"] = file_id
+            resumen = {
+                "empresa_id": grupo["_id"],
+                "empresa_nombre": empresa_data["nombre"],
+                **_factura_totales(grupo["lineas"])
+            }
+            resumen_empresas.append(resumen)
+            facturas_docs.append({
+                **resumen,
+                "batch_id": str(batch_id),
+                "organization_id": org_id,
+                **stored,
+                "created_at": now
+            })
+        
+        batch_doc = {
+            "_id": batch_id,
+            "organization_id": org_id,
+            "fecha_inicio": request.fecha_inicio,
+            "fecha_fin": request.fecha_fin,
+            "created_at": now,
+            "created_by": str(current_user["_id"]),
+            "marcar_facturados": request.marcar_facturados,
+            "n_empresas": len(resumen_empresas),
+            "n_servicios": sum(r["n_servicios"] for r in resumen_empresas),
+            "total": round(sum(r["total"] for r in resumen_empresas), 2),
+            "empresas": resumen_empresas
+        }
+        if facturas_docs:
+            await db.facturas.insert_many(facturas_docs)
+        await db.facturacion_batches.insert_one(batch_doc)
+    except BaseException:
+        # Deshacer lo escrito de este lote (también si la petición se cancela); los
+        # servicios que ya estaban en otro lote (incluir_facturados) vuelven a él
+        claimed = all_ids if request.marcar_facturados else []
+        await asyncio.shield(_discard_factura_batch(batch_id, file_ids, claimed, previous_batch, org_id))
+        raise
+    
+    logger.info(f"Facturación lote {batch_id}: {batch_doc['n_empresas']} empresas, {batch_doc['n_servicios']} servicios")
     
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 6),
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
+    return {
+        "batch_id": str(batch_id),
+        "organization_id": org_id,
+        "periodo": periodo,
+        "n_empresas": batch_doc["n_empresas"],
+        "n_servicios": batch_doc["n_servicios"],
+        "total": batch_doc["total"],
+        "servicios_marcados": servicios_marcados,
+        "empresas": resumen_empresas
+    }
+
+async def _release_facturados(batch_id: ObjectId, service_ids: list, org_id: str, previous_batch: Optional[dict] = None):
+    """
+    Quita la marca de facturado que puso un lote que no ha llegado a guardarse.
+    previous_batch {service_id: (factura_batch_id, facturado_at)}: servicios que ya
+    estaban facturados en otro lote y se devuelven a él.
+    """
+    previous_batch = previous_batch or {}
+    restore = defaultdict(list)
+    for service_id, previous in previous_batch.items():
+        restore[previous].append(service_id)
+    now = datetime.utcnow()
+    for (previous_id, previous_at), ids in restore.items():
+        await db.services.update_many(
+            {"_id": {"$in": ids}, "organization_id": org_id, "factura_batch_id": str(batch_id)},
+            {"$set": {"factura_batch_id": previous_id, "facturado_at": previous_at, "updated_at": now}}
+        )
+    service_ids = [service_id for service_id in service_ids if service_id not in previous_batch]
+    if not service_ids:
+        return
+    await db.services.update_many(
+        {"_id": {"$in": service_ids}, "organization_id": org_id, "factura_batch_id": str(batch_id)},
+        {"$unset": {"factura_batch_id": "", "facturado_at": ""}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+async def _discard_factura_batch(batch_id: ObjectId, file_ids: list, release_ids: list, previous_batch: dict, org_id: str):
+    try:
+        await db.facturas.delete_many({"batch_id": str(batch_id)})
+        fs = _facturas_fs()
+        for file_id in file_ids:
+            await fs.delete(file_id)
+        if release_ids:
+            await _release_facturados(batch_id, release_ids, org_id, previous_batch)
+    except Exception as e:
+        logger.error(f"Facturación lote {batch_id}: error deshaciendo el lote fallido: {e}")
+
+def _batch_to_response(batch: dict) -> dict:
+    return {
+        "batch_id": str(batch["_id"]),
+        **{k: v for k, v in batch.items() if k != "_id"}
+    }
+
+@api_router.get("/facturacion/batches")
+async def list_facturacion_batches(
+    current_user: dict = Depends(get_current_admin),
+    limit: int = Query(50, le=200)
+):
+    """Listar lotes de facturación de la organización (sin el detalle por empresa)"""
+    org_filter = await get_org_filter(current_user)
+    batches = await db.facturacion_batches.find(
+        org_filter, {"empresas": 0}
+    ).sort("created_at", -1).limit(limit).to_list(limit)
+    return [_batch_to_response(b) for b in batches]
+
+@api_router.get("/facturacion/batches/{batch_id}")
+async def get_facturacion_batch(batch_id: str, current_user: dict = Depends(get_current_admin)):
+    """Detalle de un lote de facturación con el resumen por empresa"""
+    org_filter = await get_org_filter(current_user)
+    batch_oid = _get_object_id_or_400(batch_id, "batch_id")
+    batch = await db.facturacion_batches.find_one({"_id": batch_oid, **org_filter})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Lote de facturación no encontrado")
+    return _batch_to_response(batch)
+
+@api_router.get("/facturacion/batches/{batch_id}/empresas/{empresa_id}/{formato}")
+async def download_factura(
+    batch_id: str,
+    empresa_id: str,
+    formato: str,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Descargar el extracto (pdf) o el detalle de líneas (csv) de una empresa de un lote"""
+    if formato not in ("pdf", "csv"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'pdf' o 'csv'")
+    org_filter = await get_org_filter(current_user)
+    factura = await db.facturas.find_one(
+        {"batch_id": batch_id, "empresa_id": empresa_id, **org_filter},
+        {f"{formato}_file_id": 1, "empresa_nombre": 1}
+    )
+    if not factura or factura.get(f"{formato}_file_id") is None:
+        raise HTTPException(status_code=404, detail="Extracto no encontrado")
+    grid_out = await _facturas_fs().open_download_stream(factura[f"{formato}_file_id"])
+    async def _chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    filename = f"extracto_{generate_slug(factura.get('empresa_nombre') or '') or empresa_id}.{formato}"
+    media_type = "application/pdf" if formato == "pdf" else "text/csv"
+    return StreamingResponse(
+        _chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+# ==========================================
+# CHANGE FEED (ingesta incremental BI / contabilidad)
+# ==========================================
+import base64
+import zlib
+
+FEED_COLLECTIONS = ("services", "turnos")
+# Margen de seguridad: no se emiten cambios más recientes que esto, para no
+# saltarse escrituras concurrentes con un updated_at ligeramente anterior
+FEED_SAFETY_LAG_SECONDS = int(os.environ.get("FEED_SAFETY_LAG_SECONDS", "5"))
+# Retención de tombstones (borrados). Un consumidor que tarde más en volver debe resincronizar completo
+FEED_TOMBSTONE_TTL_DAYS = int(os.environ.get("FEED_TOMBSTONE_TTL_DAYS", "90"))
+FEED_MAX_LIMIT = 50000
+FEED_CHUNK_DOCS = 500
+
+async def record_feed_deletions(collection: str, doc_ids: list, organization_id: Optional[str]):
+    """Registra tombstones de documentos borrados para que el change feed los emita"""
+    if not doc_ids:
+        return
+    now = datetime.utcnow()
+    try:
+        await db.feed_tombstones.insert_many([
+            {"coll": collection, "doc_id": doc_id, "organization_id": organization_id, "updated_at": now}
+            for doc_id in doc_ids
+        ], ordered=False)
+    except Exception as e:
+        # El borrado ya se hizo: no fallar la request, pero dejar rastro
+        logger.error(f"[FEED] No se pudieron registrar {len(doc_ids)} tombstones de {collection}: {e}")
+
+async def delete_with_feed_tombstones(collection: str, organization_id: str, batch_size: int = 5000) -> int:
+    """Borra todos los documentos de la organización en `collection` registrando sus tombstones.
+    Por lotes de _id para no cargar la colección entera en memoria; devuelve cuántos se borraron"""
+    deleted = 0
+    while True:
+        ids = [d["_id"] async for d in db[collection].find({"organization_id": organization_id}, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return deleted
+        result = await db[collection].delete_many({"_id": {"$in": ids}, "organization_id": organization_id})
+        await record_feed_deletions(collection, ids, organization_id)
+        deleted += result.deleted_count
+
+def _encode_feed_token(pos_upserts, pos_deletes) -> str:
+    def _pos(p):
+        return [p[0].isoformat(), str(p[1])] if p else None
+    raw = json.dumps({"v": 1, "u": _pos(pos_upserts), "d": _pos(pos_deletes)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_feed_token(token: Optional[str]):
+    """Devuelve (pos_upserts, pos_deletes); cada pos es (updated_at, ObjectId) o None"""
+    if not token:
+        return None, None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data.get("v") != 1:
+            raise ValueError("version")
+        def _pos(p):
+            return (datetime.fromisoformat(p[0]), ObjectId(p[1])) if p else None
+        return _pos(data.get("u")), _pos(data.get("d"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="resume_token inválido")
+
+def _feed_json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat() + ("Z" if value.tzinfo is None else "")
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+def _feed_query(base: dict, pos, upper: datetime) -> dict:
+    query = {**base, "updated_at": {"$lte": upper}}
+    if pos:
+        ts, oid = pos
+        query["$or"] = [{"updated_at": {"$gt": ts}}, {"updated_at": ts, "_id": {"$gt": oid}}]
+    return query
+
+async def _iter_feed_lines(collection: str, org_filter: dict, pos_u, pos_d, limit: int):
+    """
+    Genera las líneas NDJSON: primero upserts y luego deletes (un borrado es
+    terminal, así que aplicarlos después es siempre correcto). La última línea
+    es un checkpoint con el resume_token para la siguiente llamada.
+    """
+    upper = datetime.utcnow() - timedelta(seconds=FEED_SAFETY_LAG_SECONDS)
+    emitted = 0
+    has_more = False
+    
+    cursor = db[collection].find(_feed_query(org_filter, pos_u, upper)).sort(
+        [("updated_at", 1), ("_id", 1)]
+    ).limit(limit + 1).batch_size(FEED_CHUNK_DOCS)
+    async for doc in cursor:
+        if emitted >= limit:
+            has_more = True
+            break
+        pos_u = (doc["updated_at"], doc["_id"])
+        yield {"op": "upsert", "collection": collection, "id": doc["_id"], "doc": doc}
+        emitted += 1
+    
+    if not has_more:
+        tomb_base = {**org_filter, "coll": collection}
+        cursor = db.feed_tombstones.find(_feed_query(tomb_base, pos_d, upper)).sort(
+            [("updated_at", 1), ("_id", 1)]
+        ).limit(limit - emitted + 1).batch_size(FEED_CHUNK_DOCS)
+        async for tomb in cursor:
+            if emitted >= limit:
+                has_more = True
+                break
+            pos_d = (tomb["updated_at"], tomb["_id"])
+            yield {"op": "delete", "collection": collection, "id": tomb["doc_id"], "deleted_at": tomb["updated_at"]}
+            emitted += 1
+    
+    yield {"op": "checkpoint", "resume_token": _encode_feed_token(pos_u, pos_d), "has_more": has_more, "count": emitted}
+
+async def _stream_feed(lines, gzip_enabled: bool):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_enabled else None
+    buffer = []
+    async for line in lines:
+        buffer.append(json.dumps(line, default=_feed_json_default, ensure_ascii=False, separators=(",", ":")))
+        if len(buffer) >= FEED_CHUNK_DOCS:
+            payload = ("\n".join(buffer) + "\n").encode("utf-8")
+            buffer.clear()
+            if compressor:
+                payload = compressor.compress(payload)
+            if payload:
+                yield payload
+    payload = ("\n".join(buffer) + "\n").encode("utf-8") if buffer else b""
+    if compressor:
+        payload = compressor.compress(payload) + compressor.flush()
+    if payload:
+        yield payload
+
+@api_router.get("/feeds/{collection}")
+async def get_change_feed(
+    collection: str,
+    request: Request,
+    current_user: dict = Depends(get_current_admin),
+    since: Optional[str] = Query(None, description="resume_token devuelto en el checkpoint anterior (vacío = carga completa)"),
+    limit: int = Query(10000, ge=1, le=FEED_MAX_LIMIT, description="Máximo de cambios por llamada")
+):
+    """
+    Change feed incremental (NDJSON, gzip) de services o turnos de la organización.
+    Emite todos los documentos creados/modificados y los borrados después del
+    resume_token. La última línea es {"op": "checkpoint", "resume_token", "has_more"}:
+    repetir la llamada con ese token hasta has_more=false. Tras un fallo basta con
+    reintentar con el último token recibido.
+    """
+    if collection not in FEED_COLLECTIONS:
+        raise HTTPException(status_code=404, detail=f"Feed no disponible. Disponibles: {', '.join(FEED_COLLECTIONS)}")
     
-    output.seek(0)
-    headers = {"Content-Disposition": "attachment; filename=servicios.pdf"}
-    if applied_default_limit:
-        headers["X-Export-Default-Date-Range"] = "31d"
+    org_filter = await get_org_filter(current_user)
+    pos_u, pos_d = _decode_feed_token(since)
+    
+    gzip_enabled = "gzip" in request.headers.get("accept-encoding", "").lower()
+    headers = {"Cache-Control": "no-store"}
+    if gzip_enabled:
+        headers["Content-Encoding"] = "gzip"
     return StreamingResponse(
-        output,
-        media_type="application/pdf",
+        _stream_feed(_iter_feed_lines(collection, org_filter, pos_u, pos_d, limit), gzip_enabled),
+        media_type="application/x-ndjson",
         headers=headers
     )
 
@@ -4636,303 +6276,484 @@ async def superadmin_update_config(config: dict, current_user: dict = Depends(ge
         }
     }
 
-# ========================================
-# MIGRACIÓN INCREMENTAL: datetime fields
-# ========================================
-MIGRATION_BATCH_SIZE = 2000
+# ==========================================
+# ÍNDICES (manifiesto declarativo, ver db_indexes.py)
+# ==========================================
+INDEX_MANIFEST = build_index_manifest(feed_tombstone_ttl_seconds=FEED_TOMBSTONE_TTL_DAYS * 86400)
 
-async def run_datetime_migration():
+class IndexReconciler:
     """
-    Migración incremental e idempotente para backfill de campos datetime.
-    Procesa en batches para no bloquear el arranque.
+    Compara INDEX_MANIFEST con index_information() de cada colección y ejecuta,
+    una a una y en segundo plano, solo las acciones necesarias.
     """
+
+    def __init__(self):
+        self._task = None
+        self.status = {"state": "idle", "started_at": None, "finished_at": None, "actions": [], "unmanaged": {}}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        """Espera a que termine la reconciliación en curso (sin cancelarla si se cancela la espera)"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        # Un createIndexes ya enviado sigue en el servidor; solo se deja de esperar
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _plan(self) -> list:
+        plan = []
+        for collection, specs in INDEX_MANIFEST.items():
+            existing = await db[collection].index_information()
+            actions = reconcile_plan(specs, existing, RETIRED_INDEXES.get(collection))
+            known = {spec["name"] for spec in specs} | {a["name"] for a in actions if a["action"] == "drop_retired"}
+            unmanaged = [name for name in existing if name != "_id_" and name not in known]
+            if unmanaged:
+                self.status["unmanaged"][collection] = unmanaged
+            plan += [{"collection": collection, **action, "state": "pending"} for action in actions]
+        return plan
+
+    async def _apply(self, item: dict):
+        collection = db[item["collection"]]
+        spec = item.get("spec")
+        if item["action"] in ("drop_retired", "rebuild"):
+            await collection.drop_index(item["name"])
+        if item["action"] in ("create", "rebuild"):
+            await collection.create_index(spec["keys"], name=spec["name"], **spec["options"])
+        elif item["action"] == "set_ttl":
+            await db.command({
+                "collMod": item["collection"],
+                "index": {"name": item["name"], "expireAfterSeconds": spec["options"]["expireAfterSeconds"]}
+            })
+
+    async def _run(self):
+        self.status.update(state="planning", started_at=datetime.utcnow().isoformat(), finished_at=None, actions=[], unmanaged={})
+        try:
+            plan = await self._plan()
+            self.status["actions"] = plan
+            self.status["state"] = "running"
+            if plan:
+                print(f"[INDEXES] {len(plan)} acciones pendientes: " + ", ".join(f"{a['action']} {a['collection']}.{a['name']}" for a in plan))
+            for item in plan:
+                if item["action"] == "skip":
+                    item["state"] = "skipped"
+                    continue
+                if item["action"] == "manual":
+                    item["state"] = "manual"
+                    print(f"[INDEXES] {item['collection']}.{item['name']}: {item['reason']}")
+                    continue
+                item["state"] = "building"
+                item["started_at"] = datetime.utcnow().isoformat()
+                try:
+                    await self._apply(item)
+                    item["state"] = "done"
+                except Exception as e:
+                    item["state"] = "error"
+                    item["error"] = str(e)[:300]
+                    print(f"[INDEXES] Error en {item['action']} {item['collection']}.{item['name']}: {str(e)[:200]}")
+                item["finished_at"] = datetime.utcnow().isoformat()
+            self.status["state"] = "done"
+            print(f"[INDEXES] Reconciliación completada ({len(plan)} acciones)")
+        except Exception as e:
+            self.status["state"] = "error"
+            self.status["error"] = str(e)[:300]
+            logger.error(f"[INDEXES] Error reconciliando índices: {e}")
+        finally:
+            self.status["finished_at"] = datetime.utcnow().isoformat()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.status,
+            "actions": [{k: v for k, v in item.items() if k != "spec"} for item in self.status["actions"]],
+        }
+
+index_reconciler = IndexReconciler()
+
+async def get_index_builds_in_progress():
+    """Builds de índices en curso en el cluster ($currentOp), con su progreso"""
     try:
-        # --- Migración de services.service_dt_utc ---
-        migration_key = "services_datetime_v1"
-        migration_state = await db.migrations.find_one({"_id": migration_key})
-        
-        if not migration_state:
-            migration_state = {"_id": migration_key, "last_id": None, "done": False, "migrated_count": 0}
-            await db.migrations.insert_one(migration_state)
-        
-        if not migration_state.get("done", False):
-            # Buscar services sin service_dt_utc
-            query = {"service_dt_utc": {"$exists": False}}
-            if migration_state.get("last_id"):
-                query["_id"] = {"$gt": ObjectId(migration_state["last_id"])}
-            
-            services_to_migrate = await db.services.find(query).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
-            
-            if services_to_migrate:
-                migrated = 0
-                last_id = None
-                for service in services_to_migrate:
-                    fecha = service.get("fecha", "")
-                    hora = service.get("hora", "00:00")
-                    service_dt_utc = parse_spanish_date_to_utc(fecha, hora)
-                    
-                    if service_dt_utc:
-                        await db.services.update_one(
-                            {"_id": service["_id"]},
-                            {"$set": {"service_dt_utc": service_dt_utc}}
-                        )
-                        migrated += 1
-                    else:
-                        # Fecha malformada - loggear y continuar
-                        logger.warning(f"[MIGRATION] Service {service['_id']} tiene fecha malformada: '{fecha}' '{hora}'")
-                    
-                    last_id = str(service["_id"])
-                
-                # Actualizar estado de migracion
-                total_migrated = migration_state.get("migrated_count", 0) + migrated
-                await db.migrations.update_one(
-                    {"_id": migration_key},
-                    {"$set": {"last_id": last_id, "migrated_count": total_migrated}}
-                )
-                print(f"[MIGRATION] Services: migrados {migrated} documentos (total: {total_migrated})")
-            else:
-                # No quedan documentos sin migrar
-                await db.migrations.update_one(
-                    {"_id": migration_key},
-                    {"$set": {"done": True}}
-                )
-                print(f"[MIGRATION] Services: migracion completada ({migration_state.get('migrated_count', 0)} docs)")
+        cursor = client.admin.aggregate([
+            {"$currentOp": {"allUsers": True, "idleConnections": False}},
+            {"$match": {"$or": [{"command.createIndexes": {"$exists": True}}, {"msg": {"$regex": "^Index Build"}}]}},
+        ])
+        ops = await cursor.to_list(100)
+    except Exception as e:
+        return {"error": f"$currentOp no disponible: {str(e)[:200]}"}
+    return [
+        {
+            "collection": op.get("command", {}).get("createIndexes") or op.get("ns"),
+            "indexes": [index.get("name") for index in op.get("command", {}).get("indexes", [])],
+            "msg": op.get("msg"),
+            "progress": op.get("progress"),
+            "secs_running": op.get("secs_running"),
+        }
+        for op in ops
+    ]
+
+@api_router.get("/superadmin/indexes")
+async def get_index_status(current_user: dict = Depends(get_current_superadmin)):
+    """Estado de la reconciliación de índices del manifiesto y builds en curso"""
+    return {
+        **index_reconciler.snapshot(),
+        "builds_in_progress": await get_index_builds_in_progress(),
+    }
+
+# Días mínimos de estadísticas de $indexStats antes de proponer podar un índice sin uso
+# (los contadores se reinician con cada reinicio de mongod y en cada nodo por separado)
+INDEX_USAGE_MIN_OBSERVED_DAYS = int(os.environ.get("INDEX_USAGE_MIN_OBSERVED_DAYS", "14"))
+
+async def collect_index_usage(collection_name: str, now: datetime) -> dict:
+    """$indexStats + storageStats de una colección y su informe de poda (db_indexes.index_usage_report)"""
+    collection = db[collection_name]
+    existing, index_stats, coll_stats = await asyncio.gather(
+        collection.index_information(),
+        collection.aggregate([{"$indexStats": {}}]).to_list(None),
+        collection.aggregate([{"$collStats": {"storageStats": {}}}]).to_list(None),
+    )
+    # Un documento por índice y nodo: se suman los accesos y se toma el reinicio más reciente
+    usage = {}
+    for stat in index_stats:
+        entry = usage.setdefault(stat["name"], {"ops": 0, "since": None})
+        entry["ops"] += int(stat.get("accesses", {}).get("ops", 0))
+        since = stat.get("accesses", {}).get("since")
+        if since and (entry["since"] is None or since > entry["since"]):
+            entry["since"] = since
+    storage = coll_stats[0].get("storageStats", {}) if coll_stats else {}
+    report = index_usage_report(
+        existing, usage, storage.get("indexSizes", {}),
+        managed={spec["name"] for spec in INDEX_MANIFEST.get(collection_name, [])},
+        now=now, min_observed_seconds=INDEX_USAGE_MIN_OBSERVED_DAYS * 86400,
+    )
+    return {
+        "collection": collection_name,
+        "documents": storage.get("count"),
+        "data_bytes": storage.get("size"),
+        "total_index_bytes": storage.get("totalIndexSize"),
+        **report,
+    }
+
+@api_router.get("/superadmin/indexes/usage")
+async def get_index_usage(
+    collections: Optional[str] = Query(None, description="Colecciones separadas por comas (por defecto, las del manifiesto)"),
+    current_user: dict = Depends(get_current_superadmin)
+):
+    """
+    Tamaño, accesos y redundancia de cada índice, con un plan de poda recomendado.
+    Solo informa: las bajas de índices del manifiesto se hacen en db_indexes.py.
+    """
+    names = [c.strip() for c in collections.split(",") if c.strip()] if collections else list(INDEX_MANIFEST)
+    now = datetime.utcnow()
+    results = await asyncio.gather(*[collect_index_usage(name, now) for name in names], return_exceptions=True)
+    report, errors = [], {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            errors[name] = str(result)[:300]
         else:
-            print(f"[MIGRATION] Services: ya completada")
-        
-        # --- Migración de turnos.inicio_dt_utc/fin_dt_utc ---
-        migration_key_turnos = "turnos_datetime_v1"
-        migration_state_turnos = await db.migrations.find_one({"_id": migration_key_turnos})
+            report.append(result)
+    return {
+        "generated_at": now.isoformat(),
+        "min_observed_days": INDEX_USAGE_MIN_OBSERVED_DAYS,
+        "collections": report,
+        "errors": errors,
+        "summary": {
+            "indexes": sum(c["indexes_per_insert"] for c in report),
+            "prunable": sum(len(c["prune_plan"]) for c in report),
+            "reclaimable_bytes": sum(c["reclaimable_bytes"] for c in report),
+        },
+    }
+
+# ========================================
+# MIGRACIONES DE DATOS EN SEGUNDO PLANO
+# ========================================
+# Cada migración recorre su colección por lotes en orden de _id y guarda el cursor
+# (last_id) en db.migrations tras cada lote: se reanuda donde quedó si el proceso
+# se reinicia y, una vez "done", no vuelve a ejecutarse.
+from pymongo import UpdateOne
+
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "2000"))
+MIGRATION_THROTTLE_MS = int(os.environ.get("MIGRATION_THROTTLE_MS", "200"))
+
+class Migration:
+    """
+    key: identificador versionado (p. ej. "services_datetime_v1"); para rehacer una
+    migración con otra lógica se registra una nueva versión.
+    build_ops(docs) recibe el lote completo y devuelve una operación de bulk_write
+    por documento, o None si ese documento no se puede migrar (se registra y se salta).
+    """
+
+    def __init__(self, key: str, collection: str, query: dict, build_ops: Callable, projection: Optional[dict] = None, description: str = ""):
+        self.key = key
+        self.collection = collection
+        self.query = query
+        self.build_ops = build_ops
+        self.projection = projection
+        self.description = description
+
+def per_document(build_op: Callable) -> Callable:
+    """Adapta un builder de un documento (doc -> op | None) a build_ops"""
+    return lambda docs: [build_op(doc) for doc in docs]
+
+def _migrate_service_datetime(services: List[dict]):
+    # Conversión vectorizada del lote entero (spain_time.parse_spanish_dates_to_utc)
+    service_dts = parse_spanish_dates_to_utc(
+        [s.get("fecha", "") for s in services], [s.get("hora", "00:00") for s in services]
+    )
+    # updated_at: el change feed vuelve a emitir el documento con el campo nuevo
+    now = datetime.utcnow()
+    return [
+        UpdateOne({"_id": service["_id"]}, {"$set": {"service_dt_utc": service_dt_utc, "updated_at": now}}) if service_dt_utc else None
+        for service, service_dt_utc in zip(services, service_dts)
+    ]
+
+def _migrate_turno_datetime(turnos: List[dict]):
+    inicio_dts = parse_spanish_dates_to_utc(
+        [t.get("fecha_inicio", "") for t in turnos], [t.get("hora_inicio", "00:00") for t in turnos]
+    )
+    # fin_dt_utc (solo si tiene fecha_fin)
+    fin_dts = parse_spanish_dates_to_utc(
+        [t.get("fecha_fin") for t in turnos], [t.get("hora_fin", "00:00") for t in turnos]
+    )
+    now = datetime.utcnow()
+    ops = []
+    for turno, inicio_dt_utc, fin_dt_utc in zip(turnos, inicio_dts, fin_dts):
+        update_fields = {}
+        if inicio_dt_utc:
+            update_fields["inicio_dt_utc"] = inicio_dt_utc
+        if fin_dt_utc:
+            update_fields["fin_dt_utc"] = fin_dt_utc
+        ops.append(UpdateOne({"_id": turno["_id"]}, {"$set": {**update_fields, "updated_at": now}}) if update_fields else None)
+    return ops
+
+def _migrate_feed_updated_at(doc: dict):
+    # $$NOW y no created_at: la migración corre en segundo plano y un consumidor puede
+    # haber terminado su carga inicial (sin ver estos documentos) con un token posterior
+    # a created_at; con la hora actual quedan por delante de cualquier token emitido
+    return UpdateOne(
+        {"_id": doc["_id"], "updated_at": {"$exists": False}},
+        [{"$set": {"updated_at": "$$NOW"}}]
+    )
+
+def _migrate_client_uuid_cleanup(service: dict):
+    # client_uuid null/vacío fuera del documento: el índice ux_org_client_uuid solo
+    # indexa strings no vacíos y los clientes tratan "ausente" como "sin uuid"
+    return UpdateOne({"_id": service["_id"]}, {"$unset": {"client_uuid": ""}})
+
+MIGRATIONS = [
+    Migration(
+        "services_datetime_v1", "services", {"service_dt_utc": {"$exists": False}}, _migrate_service_datetime,
+        projection={"fecha": 1, "hora": 1}, description="Backfill de services.service_dt_utc"
+    ),
+    Migration(
+        "turnos_datetime_v1", "turnos", {"inicio_dt_utc": {"$exists": False}}, _migrate_turno_datetime,
+        projection={"fecha_inicio": 1, "hora_inicio": 1, "fecha_fin": 1, "hora_fin": 1},
+        description="Backfill de turnos.inicio_dt_utc / fin_dt_utc"
+    ),
+    *[
+        Migration(
+            f"feed_updated_at_{collection}_v1", collection, {"updated_at": {"$exists": False}}, per_document(_migrate_feed_updated_at),
+            projection={"_id": 1}, description=f"Backfill de {collection}.updated_at (= hora de la migración) para el change feed"
+        )
+        for collection in FEED_COLLECTIONS
+    ],
+    Migration(
+        "services_client_uuid_cleanup_v1", "services",
+        {"client_uuid": {"$in": [None, ""], "$exists": True}}, per_document(_migrate_client_uuid_cleanup),
+        projection={"_id": 1}, description="Eliminar client_uuid null/vacío de services"
+    ),
+]
+
+class MigrationRunner:
+    """
+    Ejecuta MIGRATIONS en orden, en una tarea de fondo: lotes de MIGRATION_BATCH_SIZE
+    con bulk_write no ordenado y una pausa de MIGRATION_THROTTLE_MS entre lotes para
+    no competir con el tráfico. Un error deja la migración en "error" con el cursor
+    del último lote completo; se reintenta en el siguiente arranque.
+    """
+
+    def __init__(self, migrations: List[Migration]):
+        self.migrations = migrations
+        self._task = None
+        # Progreso de esta ejecución (el persistente está en db.migrations)
+        self._progress = {m.key: {"state": "pending"} for m in migrations}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        """Espera a que terminen las migraciones en curso (sin cancelarlas si se cancela la espera)"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        # El cursor del último lote completo ya está guardado
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        for migration in self.migrations:
+            progress = self._progress[migration.key]
+            try:
+                await self._run_migration(migration, progress)
+            except asyncio.CancelledError:
+                progress["state"] = "interrupted"
+                raise
+            except Exception as e:
+                progress["state"] = "error"
+                progress["error"] = str(e)[:300]
+                logger.error(f"[MIGRATION] {migration.key}: error, se reanudará en el próximo arranque: {e}")
+
+    async def _run_migration(self, migration: Migration, progress: dict):
+        state = await db.migrations.find_one({"_id": migration.key}) or {}
+        if state.get("done"):
+            progress["state"] = "done"
+            return
         
-        if not migration_state_turnos:
-            migration_state_turnos = {"_id": migration_key_turnos, "last_id": None, "done": False, "migrated_count": 0}
-            await db.migrations.insert_one(migration_state_turnos)
+        now = datetime.utcnow()
+        await db.migrations.update_one(
+            {"_id": migration.key},
+            {
+                "$setOnInsert": {"last_id": None, "done": False, "migrated_count": 0, "scanned_count": 0, "created_at": now},
+                "$set": {"description": migration.description, "collection": migration.collection}
+            },
+            upsert=True
+        )
+        collection = db[migration.collection]
+        last_id = state.get("last_id")
+        migrated = state.get("migrated_count", 0)
+        scanned = state.get("scanned_count", 0)
+        started = time.monotonic()
+        progress.update(
+            state="running", started_at=now.isoformat(), batches=0, scanned=0, migrated=0, docs_per_sec=0.0,
+            remaining_at_start=await collection.count_documents(migration.query)
+        )
+        print(f"[MIGRATION] {migration.key}: {progress['remaining_at_start']} documentos pendientes")
         
-        if not migration_state_turnos.get("done", False):
-            # Buscar turnos sin inicio_dt_utc
-            query = {"inicio_dt_utc": {"$exists": False}}
-            if migration_state_turnos.get("last_id"):
-                query["_id"] = {"$gt": ObjectId(migration_state_turnos["last_id"])}
+        while True:
+            query = dict(migration.query)
+            if last_id:
+                query["_id"] = {"$gt": ObjectId(last_id)}
+            docs = await collection.find(query, migration.projection).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+            if not docs:
+                break
             
-            turnos_to_migrate = await db.turnos.find(query).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+            ops = []
+            for doc, op in zip(docs, migration.build_ops(docs)):
+                if op is None:
+                    # Dato malformado - loggear y continuar
+                    logger.warning(f"[MIGRATION] {migration.key}: documento {doc['_id']} no migrable")
+                else:
+                    ops.append(op)
+            modified = 0
+            if ops:
+                result = await collection.bulk_write(ops, ordered=False)
+                modified = result.modified_count
             
-            if turnos_to_migrate:
-                migrated = 0
-                last_id = None
-                for turno in turnos_to_migrate:
-                    update_fields = {}
-                    
-                    # inicio_dt_utc
-                    fecha_inicio = turno.get("fecha_inicio", "")
-                    hora_inicio = turno.get("hora_inicio", "00:00")
-                    inicio_dt_utc = parse_spanish_date_to_utc(fecha_inicio, hora_inicio)
-                    if inicio_dt_utc:
-                        update_fields["inicio_dt_utc"] = inicio_dt_utc
-                    
-                    # fin_dt_utc (solo si tiene fecha_fin)
-                    fecha_fin = turno.get("fecha_fin")
-                    hora_fin = turno.get("hora_fin", "00:00")
-                    if fecha_fin:
-                        fin_dt_utc = parse_spanish_date_to_utc(fecha_fin, hora_fin)
-                        if fin_dt_utc:
-                            update_fields["fin_dt_utc"] = fin_dt_utc
-                    
-                    if update_fields:
-                        await db.turnos.update_one(
-                            {"_id": turno["_id"]},
-                            {"$set": update_fields}
-                        )
-                        migrated += 1
-                    else:
-                        logger.warning(f"[MIGRATION] Turno {turno['_id']} tiene fechas malformadas")
-                    
-                    last_id = str(turno["_id"])
-                
-                # Actualizar estado de migracion
-                total_migrated = migration_state_turnos.get("migrated_count", 0) + migrated
-                await db.migrations.update_one(
-                    {"_id": migration_key_turnos},
-                    {"$set": {"last_id": last_id, "migrated_count": total_migrated}}
-                )
-                print(f"[MIGRATION] Turnos: migrados {migrated} documentos (total: {total_migrated})")
-            else:
-                # No quedan documentos sin migrar
-                await db.migrations.update_one(
-                    {"_id": migration_key_turnos},
-                    {"$set": {"done": True}}
-                )
-                print(f"[MIGRATION] Turnos: migracion completada ({migration_state_turnos.get('migrated_count', 0)} docs)")
-        else:
-            print(f"[MIGRATION] Turnos: ya completada")
+            last_id = str(docs[-1]["_id"])
+            migrated += modified
+            scanned += len(docs)
+            await db.migrations.update_one(
+                {"_id": migration.key},
+                {"$set": {"last_id": last_id, "migrated_count": migrated, "scanned_count": scanned, "updated_at": datetime.utcnow()}}
+            )
+            progress["batches"] += 1
+            progress["scanned"] += len(docs)
+            progress["migrated"] += modified
+            progress["docs_per_sec"] = round(progress["scanned"] / max(time.monotonic() - started, 0.001), 1)
             
-    except Exception as e:
-        logger.error(f"[MIGRATION] Error en migracion datetime: {e}")
-        # No crashear el startup por errores de migración
+            if len(docs) < MIGRATION_BATCH_SIZE:
+                break
+            await asyncio.sleep(MIGRATION_THROTTLE_MS / 1000)
+        
+        await db.migrations.update_one(
+            {"_id": migration.key},
+            {"$set": {"done": True, "finished_at": datetime.utcnow()}}
+        )
+        progress["state"] = "done"
+        progress["elapsed_seconds"] = round(time.monotonic() - started, 1)
+        print(f"[MIGRATION] {migration.key}: completada ({progress['migrated']} documentos en {progress['elapsed_seconds']}s)")
+
+    async def status(self) -> list:
+        persisted = {doc["_id"]: doc for doc in await db.migrations.find({}).to_list(100)}
+        result = []
+        for migration in self.migrations:
+            doc = persisted.get(migration.key, {})
+            result.append({
+                "key": migration.key,
+                "collection": migration.collection,
+                "description": migration.description,
+                "done": bool(doc.get("done")),
+                "migrated_count": doc.get("migrated_count", 0),
+                "scanned_count": doc.get("scanned_count", 0),
+                "last_id": doc.get("last_id"),
+                "finished_at": doc["finished_at"].isoformat() if doc.get("finished_at") else None,
+                "run": self._progress[migration.key],
+            })
+        return result
+
+migration_runner = MigrationRunner(MIGRATIONS)
+
+@api_router.get("/superadmin/migrations")
+async def get_migrations_status(current_user: dict = Depends(get_current_superadmin)):
+    """Progreso por migración: estado persistido y ritmo de la ejecución actual"""
+    return {
+        "batch_size": MIGRATION_BATCH_SIZE,
+        "throttle_ms": MIGRATION_THROTTLE_MS,
+        "migrations": await migration_runner.status(),
+    }
 
 # Initialize default admin user and config
 @app.on_event("startup")
 async def startup_event():
+    ensure_worker_mongo_client()
+    # Antes que nada: así también se miden los bloqueos de las migraciones de arranque
+    loop_monitor.start()
+    metrics_aggregator.start()
+    health_checker.start()
+    
     # ========================================
-    # MIGRACIÓN DE ÍNDICES MULTI-TENANT
+    # ÍNDICES: manifiesto declarativo reconciliado en segundo plano
     # ========================================
-    print("[STARTUP] Migrando indices para multi-tenant...")
-    
-    # --- PRE-LIMPIEZA: Remover client_uuid null/None para que sparse funcione ---
-    try:
-        # Buscar documentos con client_uuid null o que exista pero sea None
-        cleanup_result = await db.services.update_many(
-            {"$or": [
-                {"client_uuid": None},
-                {"client_uuid": {"$type": "null"}},
-                {"client_uuid": ""}
-            ]},
-            {"$unset": {"client_uuid": ""}}
-        )
-        if cleanup_result.modified_count > 0:
-            print(f"[STARTUP] Limpiados {cleanup_result.modified_count} servicios con client_uuid null/vacio")
-        else:
-            print("[STARTUP] No hay servicios con client_uuid null/vacio para limpiar")
-    except Exception as cleanup_err:
-        print(f"[STARTUP] Error limpieza client_uuid: {cleanup_err}")
-    
-    # --- PRE-LIMPIEZA: Eliminar cualquier índice con client_uuid (parcial o completo) ---
-    try:
-        existing_indexes = await db.services.index_information()
-        for idx_name, idx_info in existing_indexes.items():
-            if idx_name == "_id_":
-                continue
-            keys = idx_info.get("key", [])
-            # Si el índice tiene client_uuid, eliminarlo
-            if any("client_uuid" in str(k) for k in keys):
-                print(f"[STARTUP] Eliminando indice existente con client_uuid: {idx_name}")
-                await db.services.drop_index(idx_name)
-                print(f"[STARTUP] Indice {idx_name} eliminado")
-    except Exception as drop_err:
-        print(f"[STARTUP] Info: Error eliminando indices client_uuid: {drop_err}")
-    
-    # --- Migrar índice de vehiculos.matricula ---
-    try:
-        vehiculos_indexes = await db.vehiculos.index_information()
-        # Buscar y eliminar índice único global sobre matricula
-        for idx_name, idx_info in vehiculos_indexes.items():
-            if idx_name == "_id_":
-                continue
-            keys = idx_info.get("key", [])
-            is_unique = idx_info.get("unique", False)
-            # Detectar índice único global: key=[("matricula", 1)] y unique=True
-            if is_unique and keys == [("matricula", 1)]:
-                print(f"[STARTUP] Eliminando indice unico global de vehiculos: {idx_name}")
-                await db.vehiculos.drop_index(idx_name)
-                print(f"[STARTUP] Indice {idx_name} eliminado correctamente")
-    except Exception as e:
-        print(f"[STARTUP] Info: No se pudo verificar indices de vehiculos: {e}")
-    
-    # --- Migrar índice de companies.numero_cliente ---
-    try:
-        companies_indexes = await db.companies.index_information()
-        # Buscar y eliminar índice único global sobre numero_cliente
-        for idx_name, idx_info in companies_indexes.items():
-            if idx_name == "_id_":
-                continue
-            keys = idx_info.get("key", [])
-            is_unique = idx_info.get("unique", False)
-            # Detectar índice único global: key=[("numero_cliente", 1)] y unique=True
-            if is_unique and keys == [("numero_cliente", 1)]:
-                print(f"[STARTUP] Eliminando indice unico global de companies: {idx_name}")
-                await db.companies.drop_index(idx_name)
-                print(f"[STARTUP] Indice {idx_name} eliminado correctamente")
-    except Exception as e:
-        print(f"[STARTUP] Info: No se pudo verificar indices de companies: {e}")
+    # Solo se construyen los índices que faltan o cambiaron (ver db_indexes.py),
+    # fuera del camino crítico del arranque. Progreso: GET /api/superadmin/indexes
+    index_reconciler.start()
+    slow_query_explainer.attach(asyncio.get_running_loop())
     
     # ========================================
-    # CREAR ÍNDICES DE BASE DE DATOS
+    # COLECCIONES AUXILIARES
     # ========================================
-    print("[STARTUP] Creando indices de base de datos...")
     try:
-        # Services indexes - Multi-tenant
-        await db.services.create_index("turno_id")
-        await db.services.create_index("taxista_id")
-        await db.services.create_index("fecha")
-        await db.services.create_index("tipo")
-        await db.services.create_index("organization_id")  # Multi-tenant index
-        await db.services.create_index([("fecha", 1), ("taxista_id", 1)])
-        await db.services.create_index([("organization_id", 1), ("fecha", 1)])  # Multi-tenant compound
-        
-        # Turnos indexes - Multi-tenant
-        await db.turnos.create_index("taxista_id")
-        await db.turnos.create_index("cerrado")
-        await db.turnos.create_index("liquidado")
-        await db.turnos.create_index("fecha_inicio")
-        await db.turnos.create_index("organization_id")  # Multi-tenant index
-        await db.turnos.create_index([("taxista_id", 1), ("cerrado", 1)])
-        await db.turnos.create_index([("organization_id", 1), ("cerrado", 1)])  # Multi-tenant compound
-        
-        # Users indexes - Multi-tenant
-        await db.users.create_index("username", unique=True)
-        await db.users.create_index("role")
-        await db.users.create_index("organization_id")  # Multi-tenant index
-        await db.users.create_index([("organization_id", 1), ("role", 1)])  # Multi-tenant compound
-        
-        # Vehiculos indexes - Multi-tenant (ÚNICO POR ORGANIZACIÓN)
-        await db.vehiculos.create_index("organization_id")  # Multi-tenant index
-        await db.vehiculos.create_index(
-            [("organization_id", 1), ("matricula", 1)], 
-            unique=True, 
-            name="ux_org_matricula"
-        )
-        print("[STARTUP] Indice ux_org_matricula creado (matricula unica por organizacion)")
-        
-        # Companies indexes - Multi-tenant (ÚNICO POR ORGANIZACIÓN)
-        await db.companies.create_index("organization_id")  # Multi-tenant index
-        await db.companies.create_index(
-            [("organization_id", 1), ("numero_cliente", 1)], 
-            unique=True, 
-            sparse=True,
-            name="ux_org_numero_cliente"
-        )
-        print("[STARTUP] Indice ux_org_numero_cliente creado (numero_cliente unico por organizacion)")
+        # Explain de consultas lentas: colección capped (tamaño acotado, orden de inserción)
+        if "slow_queries" not in await db.list_collection_names(filter={"name": "slow_queries"}):
+            await db.create_collection("slow_queries", capped=True, size=SLOW_QUERY_CAPPED_BYTES)
         
-        # Organizations indexes
-        await db.organizations.create_index("slug", unique=True)
-        await db.organizations.create_index("activa")
+        # Perfiles de requests bajo demanda (colección capped)
+        if "request_profiles" not in await db.list_collection_names(filter={"name": "request_profiles"}):
+            await db.create_collection("request_profiles", capped=True, size=PROFILE_CAPPED_BYTES)
         
-        # NUEVOS: Índices para datetime fields (filtros por rango de fechas)
-        await db.services.create_index([("organization_id", 1), ("service_dt_utc", -1)], name="idx_org_service_dt")
-        await db.turnos.create_index([("organization_id", 1), ("inicio_dt_utc", -1)], name="idx_org_inicio_dt")
-        print("[STARTUP] Indices datetime creados (service_dt_utc, inicio_dt_utc)")
-        
-        # NUEVO: Índice para idempotencia con client_uuid (Paso 5A)
-        # Este índice puede fallar si hay datos legacy - lo intentamos pero no bloqueamos
-        try:
-            # Primero eliminar cualquier índice parcialmente creado
-            try:
-                existing_indexes = await db.services.index_information()
-                if "ux_org_client_uuid" in existing_indexes:
-                    await db.services.drop_index("ux_org_client_uuid")
-                    print("[STARTUP] Indice ux_org_client_uuid eliminado (existia previamente)")
-            except:
-                pass
-            
-            await db.services.create_index(
-                [("organization_id", 1), ("client_uuid", 1)],
-                unique=True,
-                name="ux_org_client_uuid",
-                partialFilterExpression={"client_uuid": {"$type": "string", "$exists": True, "$ne": ""}}
-            )
-            print("[STARTUP] Indice ux_org_client_uuid creado (idempotencia)")
-        except Exception as idx_err:
-            print(f"[STARTUP] Info: Indice client_uuid no creado (datos legacy): {str(idx_err)[:100]}")
-            # La idempotencia funcionara sin el indice pero sera mas lenta
-        
-        print("[STARTUP] Todos los indices creados correctamente")
     except Exception as e:
-        print(f"[STARTUP WARNING] Error creando indices: {e}")
-        # No fallar si los índices ya existen
+        print(f"[STARTUP WARNING] Error preparando colecciones auxiliares: {e}")
     
     # ========================================
-    # MIGRACIÓN INCREMENTAL: Backfill datetime fields
+    # MIGRACIONES DE DATOS (segundo plano, reanudables)
     # ========================================
-    await run_datetime_migration()
+    # Progreso: GET /api/superadmin/migrations
+    migration_runner.start()
+    
+    if EXPORT_PREWARM:
+        asyncio.create_task(get_export_renderers())
     
     # Compatibilidad hacia atrás: Si existe TAXITUR_ORG_ID, activar feature flag
     # SOLO SI la key no existe aún (primera vez). Si ya existe (True o False),
@@ -5016,6 +6837,7 @@ async def startup_event():
         await db.config.insert_one(default_config)
         logger.info("Default config created")
     
+    health_checker.mark_startup_complete()
     print("[STARTUP] ✅ TaxiFast Multi-tenant SaaS Platform ready!")
 
 # Include router
@@ -5054,4 +6876,11 @@ app.add_middleware(
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await loop_monitor.stop()
+    await metrics_aggregator.stop()
+    await health_checker.stop()
+    await index_reconciler.stop()
+    await migration_runner.stop()
+    await drain_exports(EXPORT_DRAIN_SECONDS)
+    shutdown_export_pool()
     client.close()
@@ -0,0 +1,193 @@
+"""
+Conversión de fecha/hora local de España (Europe/Madrid) a UTC.
+
+Los offsets UTC se calculan una vez por día local y se cachean: en un día sin
+cambio de hora basta un offset; en los dos días de cambio de hora se guardan
+los 24 offsets por hora, con la misma resolución que pytz localize(is_dst=False):
+  - marzo, 02:00-02:59 (no existe): se interpreta como CET (+1)
+  - octubre, 02:00-02:59 (ocurre dos veces): se toma la segunda, CET (+1)
+
+parse_spanish_dates_to_utc() convierte listas enteras (migraciones, sync) con
+NumPy: cada fecha y hora distinta se parsea una sola vez y la resta de offsets
+se hace sobre arrays.
+
+Sin dependencias de la app.
+"""
+import functools
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pytz
+
+SPAIN_TZ = pytz.timezone('Europe/Madrid')
+
+logger = logging.getLogger(__name__)
+
+_MINUTE = np.timedelta64(1, "m")
+
+
+@functools.lru_cache(maxsize=8192)
+def _day_offsets_minutes(year: int, month: int, day: int) -> tuple:
+    """Offset UTC (minutos) de cada hora local del día: 24 valores"""
+    first = SPAIN_TZ.localize(datetime(year, month, day, 0), is_dst=False).utcoffset()
+    last = SPAIN_TZ.localize(datetime(year, month, day, 23), is_dst=False).utcoffset()
+    if first == last:
+        return (int(first.total_seconds()) // 60,) * 24
+    # Día de cambio de hora
+    return tuple(
+        int(SPAIN_TZ.localize(datetime(year, month, day, hour), is_dst=False).utcoffset().total_seconds()) // 60
+        for hour in range(24)
+    )
+
+
+def local_to_utc(year: int, month: int, day: int, hour: int = 0, minute: int = 0) -> datetime:
+    """Hora local de España -> datetime UTC naive. ValueError si la fecha/hora no es válida."""
+    local_dt = datetime(year, month, day, hour, minute, 0)
+    return local_dt - timedelta(minutes=_day_offsets_minutes(year, month, day)[hour])
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_fecha(fecha_str: str) -> Optional[tuple]:
+    """dd/mm/yyyy o yyyy-mm-dd -> (year, month, day); None si no tiene 3 partes"""
+    if "/" in fecha_str:
+        parts = fecha_str.split("/")
+        if len(parts) == 3:
+            return int(parts[2]), int(parts[1]), int(parts[0])
+    elif "-" in fecha_str:
+        parts = fecha_str.split("-")
+        if len(parts) == 3:
+            return int(parts[0]), int(parts[1]), int(parts[2])
+    return None
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_hora(hora_str: str) -> tuple:
+    """HH:mm -> (hour, minute)"""
+    hora_parts = hora_str.split(":")
+    hour = int(hora_parts[0]) if len(hora_parts) >= 1 else 0
+    minute = int(hora_parts[1]) if len(hora_parts) >= 2 else 0
+    return hour, minute
+
+
+def parse_spanish_date_to_utc(fecha_str: str, hora_str: str = "00:00") -> Optional[datetime]:
+    """
+    Convierte fecha dd/mm/yyyy O yyyy-mm-dd + hora HH:mm (hora de España) a datetime UTC.
+    Retorna None si el formato es inválido.
+    """
+    try:
+        if not fecha_str:
+            return None
+
+        # Si ya es un datetime, devolverlo (para datos que ya fueron migrados)
+        if isinstance(fecha_str, datetime):
+            return fecha_str
+
+        parsed = _parse_fecha(fecha_str)
+        if parsed is None:
+            return None
+        year, month, day = parsed
+
+        # Parsear hora (default 00:00 si no se proporciona)
+        hora_str = hora_str or "00:00"
+        if isinstance(hora_str, datetime):
+            hour, minute = hora_str.hour, hora_str.minute
+        else:
+            hour, minute = _parse_hora(hora_str)
+
+        return local_to_utc(year, month, day, hour, minute)
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        logger.warning(f"Error parsing date '{fecha_str}' + '{hora_str}': {e}")
+        return None
+
+
+def get_date_range_utc(start_date: str, end_date: str) -> tuple:
+    """
+    Convierte rango de fechas dd/mm/yyyy (España) a rango UTC para queries.
+    start_date 00:00:00 España -> UTC
+    end_date 23:59:59 España -> UTC
+    Retorna (start_utc, end_utc) o (None, None) si inválido.
+    """
+    start_utc = parse_spanish_date_to_utc(start_date, "00:00")
+    end_utc = parse_spanish_date_to_utc(end_date, "23:59")
+    if end_utc:
+        # Añadir 59 segundos para incluir todo el último minuto
+        end_utc = end_utc.replace(second=59, microsecond=999999)
+    return (start_utc, end_utc)
+
+
+def parse_spanish_dates_to_utc(fechas: Sequence, horas: Sequence) -> List[Optional[datetime]]:
+    """
+    Versión por lotes de parse_spanish_date_to_utc (mismo resultado elemento a
+    elemento, None en los inválidos, sin un warning por cada uno).
+    """
+    n = len(fechas)
+    if n == 0:
+        return []
+
+    # Cada fecha distinta: índice de día, medianoche local y offsets por hora
+    day_index = {}
+    day_midnight = []
+    day_offsets = []
+    fecha_idx = np.empty(n, dtype=np.int64)
+    passthrough = {}  # fechas que ya son datetime (datos migrados)
+    for i, fecha in enumerate(fechas):
+        if not isinstance(fecha, str):
+            if isinstance(fecha, datetime):
+                passthrough[i] = fecha
+            fecha_idx[i] = -1
+            continue
+        idx = day_index.get(fecha)
+        if idx is None:
+            idx = -1
+            try:
+                parsed = _parse_fecha(fecha)
+                if parsed is not None:
+                    year, month, day = parsed
+                    midnight = datetime(year, month, day)
+                    day_offsets.append(_day_offsets_minutes(year, month, day))
+                    day_midnight.append(midnight)
+                    idx = len(day_midnight) - 1
+            except (ValueError, OverflowError):
+                pass
+            day_index[fecha] = idx
+        fecha_idx[i] = idx
+
+    # Cada hora distinta -> minutos desde medianoche (-1 si inválida)
+    hora_minutes = {}
+    minute_of_day = np.empty(n, dtype=np.int64)
+    for i, hora in enumerate(horas):
+        hora = hora or "00:00"
+        if isinstance(hora, datetime):
+            minute_of_day[i] = hora.hour * 60 + hora.minute
+            continue
+        if not isinstance(hora, str):
+            minute_of_day[i] = -1
+            continue
+        minutes = hora_minutes.get(hora)
+        if minutes is None:
+            minutes = -1
+            try:
+                hour, minute = _parse_hora(hora)
+                if 0 <= hour < 24 and 0 <= minute < 60:
+                    minutes = hour * 60 + minute
+            except ValueError:
+                pass
+            hora_minutes[hora] = minutes
+        minute_of_day[i] = minutes
+
+    valid = (fecha_idx >= 0) & (minute_of_day >= 0)
+    if not day_midnight:
+        return [passthrough.get(i) for i in range(n)]
+    midnights = np.array(day_midnight, dtype="datetime64[m]")
+    offsets = np.array(day_offsets, dtype=np.int64)  # (días distintos, 24)
+    safe_day = np.where(valid, fecha_idx, 0)
+    safe_minute = np.where(valid, minute_of_day, 0)
+    utc = midnights[safe_day] + (safe_minute - offsets[safe_day, safe_minute // 60]) * _MINUTE
+
+    converted = utc.astype("datetime64[us]").tolist()
+    result = [dt if ok else None for dt, ok in zip(converted, valid.tolist())]
+    for i, fecha in passthrough.items():
+        result[i] = fecha
+    return result
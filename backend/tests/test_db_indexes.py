@@ -0,0 +1,191 @@
+"""
+Unit tests for the index manifest and prune recommendations in db_indexes.py
+(prefix_covers / index_usage_report / reconcile_plan). Pure functions: no database needed.
+
+    python -m pytest tests/test_db_indexes.py -v
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db_indexes import RETIRED_INDEXES, build_index_manifest, index_usage_report, prefix_covers, reconcile_plan  # noqa: E402
+
+NOW = datetime(2026, 1, 31)
+MIN_OBSERVED = 14 * 86400
+
+
+def info(*keys, **options):
+    """index_information() entry"""
+    return {"key": list(keys), "v": 2, **options}
+
+
+def report(existing, usage=None, sizes=None, managed=()):
+    usage = usage if usage is not None else {name: {"ops": 10, "since": NOW - timedelta(days=30)} for name in existing}
+    sizes = sizes if sizes is not None else {name: 1000 for name in existing}
+    result = index_usage_report(existing, usage, sizes, set(managed), NOW, MIN_OBSERVED)
+    return result, {entry["name"]: entry for entry in result["indexes"]}
+
+
+class TestPrefixCovers:
+
+    def test_chain_lists_longest_kept_coverer_first(self):
+        existing = {
+            "_id_": info(("_id", 1)),
+            "a_1": info(("a", 1)),
+            "a_1_b_1": info(("a", 1), ("b", 1)),
+            "a_1_b_1_c_1": info(("a", 1), ("b", 1), ("c", 1)),
+        }
+        covers = prefix_covers(existing)
+        # a_1_b_1 is itself redundant, so the index that survives comes first
+        assert covers["a_1"] == ["a_1_b_1_c_1", "a_1_b_1"]
+        assert covers["a_1_b_1"] == ["a_1_b_1_c_1"]
+        assert "a_1_b_1_c_1" not in covers
+        assert "_id_" not in covers
+
+    def test_shortest_kept_coverer_first(self):
+        existing = {
+            "a_1": info(("a", 1)),
+            "a_1_c_1": info(("a", 1), ("c", 1)),
+            "a_1_b_1_d_1": info(("a", 1), ("b", 1), ("d", 1)),
+        }
+        assert prefix_covers(existing)["a_1"] == ["a_1_c_1", "a_1_b_1_d_1"]
+
+    def test_exact_duplicate_keeps_lowest_name(self):
+        existing = {"dup_a": info(("a", 1)), "a_1": info(("a", 1))}
+        assert prefix_covers(existing) == {"dup_a": ["a_1"]}
+
+    def test_exact_duplicate_keeps_managed(self):
+        existing = {"dup_a": info(("a", 1)), "a_1": info(("a", 1))}
+        assert prefix_covers(existing, frozenset({"dup_a"})) == {"a_1": ["dup_a"]}
+
+    def test_direction_and_order_must_match(self):
+        existing = {
+            "a_1": info(("a", 1)),
+            "a_-1_b_1": info(("a", -1), ("b", 1)),
+            "b_1_a_1": info(("b", 1), ("a", 1)),
+        }
+        assert prefix_covers(existing) == {}
+
+    def test_float_directions_are_normalized(self):
+        existing = {"a_1": info(("a", 1)), "a_1_b_1": info(("a", 1.0), ("b", 1.0))}
+        assert prefix_covers(existing) == {"a_1": ["a_1_b_1"]}
+
+    def test_partial_or_sparse_index_does_not_cover(self):
+        existing = {
+            "a_1": info(("a", 1)),
+            "a_1_b_1_partial": info(("a", 1), ("b", 1), partialFilterExpression={"b": {"$gt": ""}}),
+            "a_1_c_1_sparse": info(("a", 1), ("c", 1), sparse=True),
+        }
+        assert prefix_covers(existing) == {}
+
+    def test_full_index_covers_partial_one(self):
+        existing = {
+            "a_1_partial": info(("a", 1), partialFilterExpression={"a": {"$gt": ""}}),
+            "a_1_b_1": info(("a", 1), ("b", 1)),
+        }
+        assert prefix_covers(existing) == {"a_1_partial": ["a_1_b_1"]}
+
+
+class TestIndexUsageReport:
+
+    def test_redundant_prefix_is_dropped(self):
+        existing = {"_id_": info(("_id", 1)), "a_1": info(("a", 1)), "a_1_b_1": info(("a", 1), ("b", 1))}
+        result, entries = report(existing)
+        assert entries["a_1"]["recommendation"] == "drop_redundant"
+        assert entries["a_1"]["reason"] == "prefijo de a_1_b_1"
+        assert entries["a_1_b_1"]["recommendation"] == "keep"
+        assert entries["_id_"]["recommendation"] == "keep"
+        assert result["indexes_per_insert"] == 3
+        assert result["indexes_per_insert_after_prune"] == 2
+        assert result["reclaimable_bytes"] == 1000
+        assert [step["name"] for step in result["prune_plan"]] == ["a_1"]
+
+    def test_unique_and_ttl_are_never_dropped(self):
+        existing = {
+            "ux_a": info(("a", 1), unique=True),
+            "a_1_b_1": info(("a", 1), ("b", 1)),
+            "ttl_updated_at": info(("updated_at", 1), expireAfterSeconds=3600),
+        }
+        usage = {name: {"ops": 0, "since": NOW - timedelta(days=60)} for name in existing}
+        result, entries = report(existing, usage=usage)
+        assert entries["ux_a"]["recommendation"] == "keep"
+        assert entries["ux_a"]["reason"] == "unique"
+        assert entries["ux_a"]["covered_by"] == ["a_1_b_1"]
+        assert entries["ttl_updated_at"]["recommendation"] == "keep"
+        assert entries["ttl_updated_at"]["reason"] == "ttl"
+        assert [step["name"] for step in result["prune_plan"]] == ["a_1_b_1"]
+
+    def test_unused_index_needs_enough_observed_time(self):
+        existing = {"a_1": info(("a", 1)), "b_1": info(("b", 1))}
+        usage = {
+            "a_1": {"ops": 0, "since": NOW - timedelta(days=15)},
+            "b_1": {"ops": 0, "since": NOW - timedelta(days=2)},
+        }
+        result, entries = report(existing, usage=usage)
+        assert entries["a_1"]["recommendation"] == "drop_unused"
+        assert entries["b_1"]["recommendation"] == "review"
+        # review is not part of the prune plan
+        assert [step["name"] for step in result["prune_plan"]] == ["a_1"]
+
+    def test_missing_stats_are_not_unused(self):
+        _, entries = report({"a_1": info(("a", 1))}, usage={})
+        assert entries["a_1"]["recommendation"] == "keep"
+        assert entries["a_1"]["ops"] is None
+
+    def test_coverer_absorbs_reads_of_redundant_index(self):
+        existing = {"a_1": info(("a", 1)), "a_1_b_1": info(("a", 1), ("b", 1))}
+        usage = {
+            "a_1": {"ops": 500, "since": NOW - timedelta(days=30)},
+            "a_1_b_1": {"ops": 0, "since": NOW - timedelta(days=30)},
+        }
+        result, entries = report(existing, usage=usage)
+        assert entries["a_1"]["recommendation"] == "drop_redundant"
+        assert entries["a_1_b_1"]["recommendation"] == "keep"
+        assert entries["a_1_b_1"]["reason"] == "absorbe las lecturas de a_1"
+        assert result["indexes_per_insert_after_prune"] == 1
+
+    def test_exact_duplicate_drops_only_one(self):
+        existing = {"a_1": info(("a", 1)), "dup_a": info(("a", 1))}
+        result, entries = report(existing, managed={"dup_a"})
+        assert entries["dup_a"]["recommendation"] == "keep"
+        assert entries["a_1"]["recommendation"] == "drop_redundant"
+        assert result["indexes_per_insert_after_prune"] == 1
+
+    def test_prune_action_depends_on_manifest(self):
+        existing = {"a_1": info(("a", 1)), "b_1": info(("b", 1)), "a_1_b_1": info(("a", 1), ("b", 1))}
+        usage = {name: {"ops": 5, "since": NOW - timedelta(days=30)} for name in existing}
+        usage["b_1"] = {"ops": 0, "since": NOW - timedelta(days=30)}
+        result, _ = report(existing, usage=usage, managed={"a_1"})
+        actions = {step["name"]: step["action"] for step in result["prune_plan"]}
+        assert actions == {
+            "a_1": "quitar de build_index_manifest() y añadir a RETIRED_INDEXES",
+            "b_1": "dropIndex('b_1')",
+        }
+
+    def test_dropped_indexes_listed_first_by_size(self):
+        existing = {"a_1": info(("a", 1)), "b_1": info(("b", 1)), "a_1_b_1": info(("a", 1), ("b", 1)), "c_1": info(("c", 1))}
+        usage = {name: {"ops": 5, "since": NOW - timedelta(days=30)} for name in existing}
+        usage["b_1"] = {"ops": 0, "since": NOW - timedelta(days=30)}
+        sizes = {"a_1": 100, "b_1": 900, "a_1_b_1": 5000, "c_1": 50}
+        result, _ = report(existing, usage=usage, sizes=sizes)
+        assert [entry["name"] for entry in result["indexes"]] == ["b_1", "a_1", "a_1_b_1", "c_1"]
+        assert result["reclaimable_bytes"] == 1000
+
+
+class TestManifest:
+
+    def test_no_index_is_a_prefix_of_another(self):
+        for collection, specs in build_index_manifest().items():
+            existing = {spec["name"]: {"key": spec["keys"], **spec["options"]} for spec in specs}
+            assert prefix_covers(existing) == {}, collection
+
+    def test_retired_prefixes_are_dropped_not_recreated(self):
+        specs = build_index_manifest()["services"]
+        existing = {spec["name"]: info(*spec["keys"], **spec["options"]) for spec in specs}
+        existing.update({"organization_id_1": info(("organization_id", 1)), "turno_id_1": info(("turno_id", 1))})
+        plan = reconcile_plan(specs, existing, RETIRED_INDEXES["services"])
+        assert sorted((step["action"], step["name"]) for step in plan) == [
+            ("drop_retired", "organization_id_1"), ("drop_retired", "turno_id_1"),
+        ]
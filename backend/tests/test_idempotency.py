@@ -33,13 +33,13 @@ class TestAuthAndHealth:
     """Basic health and auth tests - run first"""
     
     def test_api_health(self):
-        """Test API health endpoint"""
-        response = requests.get(f"{BASE_URL}/api/health")
+        """Test public readiness probe (the detailed /api/health needs METRICS_TOKEN or superadmin)"""
+        response = requests.get(f"{BASE_URL}/readyz")
         assert response.status_code == 200
         data = response.json()
-        assert data["status"] == "healthy"
-        assert data["database"] == "connected"
-        print(f"API healthy: {data}")
+        assert data == {"status": "ready"}
+        print(f"API ready: {data}")
+        assert requests.get(f"{BASE_URL}/api/health").status_code == 401
     
     def test_admin_login(self):
         """Test admin login for Taxitur org"""
@@ -0,0 +1,277 @@
+"""
+Query-plan regression suite: every Mongo read issued by the endpoints must use an index.
+
+Runs the app in-process (ASGI, no HTTP server) against a LOCAL mongod seeded with
+scripts/generate_dataset.py, captures every find/aggregate/count/distinct each
+endpoint issues (pymongo command monitoring), re-runs it with
+explain("executionStats") and fails if:
+- the winning plan has a COLLSCAN (unless the collection/endpoint is allowlisted)
+- it examines far more keys/documents than it returns
+  (> QUERY_PLAN_MAX_EXAMINED_RATIO x nReturned, ignoring anything under QUERY_PLAN_MIN_EXAMINED)
+
+Also checks that the index manifest (db_indexes.py) is fully applied on startup, so a
+failing plan points at a missing index or a bad filter, not at a half-built database.
+
+Opt-in, it creates and drops its own database:
+    QUERY_PLAN_MONGO_URL=mongodb://localhost:27017 python -m pytest tests/test_query_plans.py -v
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+MONGO_URL = os.environ.get("QUERY_PLAN_MONGO_URL")
+if not MONGO_URL:
+    pytest.skip("QUERY_PLAN_MONGO_URL not set (needs a local mongod)", allow_module_level=True)
+
+from pymongo import MongoClient, monitoring  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "scripts"))
+
+import generate_dataset  # noqa: E402
+from db_indexes import RETIRED_INDEXES, reconcile_plan  # noqa: E402
+from loadtest import ASGIClient, service_payload, turno_payload  # noqa: E402
+
+DB_NAME = os.environ.get("QUERY_PLAN_DB", f"taxifast_query_plans_{os.getpid()}")
+MAX_EXAMINED_RATIO = float(os.environ.get("QUERY_PLAN_MAX_EXAMINED_RATIO", "10"))
+MIN_EXAMINED = int(os.environ.get("QUERY_PLAN_MIN_EXAMINED", "100"))
+
+# Accepted COLLSCANs: single-document collections or ones listed in full on purpose
+ALLOWED_COLLSCANS = {
+    ("*", "config"): "single config document",
+    ("GET /api/organizations", "organizations"): "superadmin lists every organization",
+    ("GET /api/superadmin/vehiculos", "vehiculos"): "superadmin lists every vehiculo",
+}
+
+# (label, role, method, path, params); {placeholders} are filled from the seeded data
+ENDPOINTS = [
+    ("GET /api/auth/me", "admin", "GET", "/api/auth/me", None),
+    ("GET /api/my-organization", "admin", "GET", "/api/my-organization", None),
+    ("GET /api/users", "admin", "GET", "/api/users", None),
+    ("GET /api/companies", "admin", "GET", "/api/companies", None),
+    ("GET /api/vehiculos", "admin", "GET", "/api/vehiculos", None),
+    ("GET /api/turnos", "admin", "GET", "/api/turnos", {"limit": 200}),
+    ("GET /api/turnos?taxista_id", "admin", "GET", "/api/turnos", {"taxista_id": "{taxista_id}"}),
+    ("GET /api/turnos?fecha_inicio&fecha_fin", "admin", "GET", "/api/turnos",
+     {"fecha_inicio": "{week_start}", "fecha_fin": "{yesterday}"}),
+    ("GET /api/turnos?cerrado=false", "admin", "GET", "/api/turnos", {"cerrado": "false"}),
+    ("GET /api/turnos?liquidado=false", "admin", "GET", "/api/turnos", {"liquidado": "false"}),
+    ("GET /api/turnos?repostado=true", "admin", "GET", "/api/turnos", {"repostado": "true"}),
+    ("GET /api/turnos?vehiculo_id", "admin", "GET", "/api/turnos", {"repostado": "true", "vehiculo_id": "{vehiculo_id}"}),
+    ("GET /api/turnos (taxista)", "taxista", "GET", "/api/turnos", None),
+    ("GET /api/turnos/activo", "taxista", "GET", "/api/turnos/activo", None),
+    ("GET /api/turnos/estadisticas", "admin", "GET", "/api/turnos/estadisticas", {"fecha_inicio": "{week_start}"}),
+    ("GET /api/turnos/combustible/estadisticas", "admin", "GET", "/api/turnos/combustible/estadisticas",
+     {"from": "{month_start_iso}", "to": "{yesterday_iso}"}),
+    ("GET /api/turnos/export/csv", "admin", "GET", "/api/turnos/export/csv",
+     {"fecha_inicio": "{week_start}", "fecha_fin": "{yesterday}"}),
+    ("GET /api/reportes/diario", "admin", "GET", "/api/reportes/diario", {"fecha": "{yesterday}"}),
+    ("GET /api/services", "admin", "GET", "/api/services", {"limit": 1000}),
+    ("GET /api/services?fecha_inicio&fecha_fin", "admin", "GET", "/api/services",
+     {"fecha_inicio": "{week_start}", "fecha_fin": "{yesterday}"}),
+    ("GET /api/services?taxista_id", "admin", "GET", "/api/services", {"taxista_id": "{taxista_id}"}),
+    ("GET /api/services?turno_id", "admin", "GET", "/api/services", {"turno_id": "{turno_id}"}),
+    ("GET /api/services?empresa_id", "admin", "GET", "/api/services", {"empresa_id": "{empresa_id}"}),
+    ("GET /api/services (taxista)", "taxista", "GET", "/api/services", {"limit": 100}),
+    ("GET /api/services/export/csv", "admin", "GET", "/api/services/export/csv",
+     {"fecha_inicio": "{week_start}", "fecha_fin": "{yesterday}"}),
+    ("GET /api/facturacion/batches", "admin", "GET", "/api/facturacion/batches", None),
+    ("GET /api/feeds/services", "admin", "GET", "/api/feeds/services", {"limit": 500}),
+    ("GET /api/feeds/turnos", "admin", "GET", "/api/feeds/turnos", {"limit": 500}),
+    ("GET /api/organizations", "superadmin", "GET", "/api/organizations", None),
+    ("GET /api/superadmin/admins", "superadmin", "GET", "/api/superadmin/admins", None),
+    ("GET /api/superadmin/taxistas", "superadmin", "GET", "/api/superadmin/taxistas", None),
+    ("GET /api/superadmin/vehiculos", "superadmin", "GET", "/api/superadmin/vehiculos", None),
+    ("POST /api/services", "taxista", "POST", "/api/services", "service"),
+    ("POST /api/services/sync", "taxista", "POST", "/api/services/sync", "sync"),
+]
+
+_current_endpoint: contextvars.ContextVar = contextvars.ContextVar("query_plan_endpoint", default=None)
+
+
+class QueryCapture(monitoring.CommandListener):
+    """Records the explainable commands issued while _current_endpoint is set"""
+
+    def __init__(self, explainable: frozenset, strip):
+        self.explainable = explainable
+        self.strip = strip
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        label = _current_endpoint.get()
+        if label is None or event.command_name not in self.explainable:
+            return
+        with self._lock:
+            self.commands.append((label, event.command_name, self.strip(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self, label: str) -> list:
+        with self._lock:
+            taken = [(name, command) for lbl, name, command in self.commands if lbl == label]
+            self.commands = [c for c in self.commands if c[0] != label]
+        return taken
+
+
+def seed_database() -> dict:
+    """3 organizations x 8 taxistas x 6 months of history, manifest indexes included"""
+    args = argparse.Namespace(
+        mongo_url=MONGO_URL, db=DB_NAME, seed=48, years=0.5, min_taxistas=8, max_taxistas=8,
+        work_probability=5 / 7, services_per_turno=10, refuel_fraction=0.15, legacy_fraction=0.0,
+        malformed_fraction=0.0, password_hash="!", batch=10000,
+    )
+    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=3000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"mongod not reachable at {MONGO_URL}: {e}")
+    client.drop_database(DB_NAME)
+    for org_n in range(3):
+        generate_dataset.load_org(org_n, args)
+    db = client[DB_NAME]
+    generate_dataset.create_indexes(db)
+    db.users.insert_one({"username": "plan_superadmin", "nombre": "Superadmin", "role": "superadmin",
+                         "password": "!", "organization_id": None, "created_at": datetime.utcnow()})
+    org = db.organizations.find_one({"slug": "sintetico-0"})
+    org_id = str(org["_id"])
+    taxista = db.users.find_one({"organization_id": org_id, "role": "taxista"})
+    turno = db.turnos.find_one({"taxista_id": str(taxista["_id"])}, sort=[("_id", -1)])
+    empresa = db.companies.find_one({"organization_id": org_id})
+    client.close()
+
+    today = date.today()
+    return {
+        "admin": "admin_0",
+        "taxista_doc": taxista,
+        "taxista": taxista["username"],
+        "superadmin": "plan_superadmin",
+        "placeholders": {
+            "taxista_id": str(taxista["_id"]),
+            "vehiculo_id": taxista["vehiculo_id"],
+            "turno_id": str(turno["_id"]),
+            "empresa_id": str(empresa["_id"]),
+            "yesterday": (today - timedelta(days=1)).strftime("%d/%m/%Y"),
+            "week_start": (today - timedelta(days=7)).strftime("%d/%m/%Y"),
+            "yesterday_iso": (today - timedelta(days=1)).isoformat(),
+            "month_start_iso": (today - timedelta(days=30)).isoformat(),
+        },
+    }
+
+
+def plan_problems(label: str, collection: str, summary: dict) -> list:
+    problems = []
+    if summary["collscan"] and ("*", collection) not in ALLOWED_COLLSCANS and (label, collection) not in ALLOWED_COLLSCANS:
+        problems.append("COLLSCAN")
+    examined = max(summary["docs_examined"] or 0, summary["keys_examined"] or 0)
+    returned = summary["n_returned"] or 0
+    if examined > max(MIN_EXAMINED, MAX_EXAMINED_RATIO * returned):
+        problems.append(f"examines {examined} to return {returned}")
+    return problems
+
+
+async def collect_plan_reports() -> dict:
+    seeded = seed_database()
+    os.environ["MONGO_URL"] = MONGO_URL
+    os.environ["DB_NAME"] = DB_NAME
+    import server
+
+    # Own client: the app's listeners plus the capture one
+    capture = QueryCapture(server.EXPLAINABLE_COMMANDS, server._explainable_command)
+    server.client = server.AsyncIOMotorClient(
+        MONGO_URL, event_listeners=[server.RequestCommandListener(), server.pool_stats, capture]
+    )
+    server.db = server.client[DB_NAME]
+    placeholders = seeded["placeholders"]
+
+    await server.app.router.startup()
+    try:
+        # Indexes and migrations finished before anything is explained
+        await server.index_reconciler.wait()
+        await server.migration_runner.wait()
+        client = ASGIClient(server.app)
+        tokens = {role: server.create_access_token({"sub": seeded[role]}) for role in ("admin", "taxista", "superadmin")}
+        await client.request("POST", "/api/turnos", token=tokens["taxista"], json_body=turno_payload(seeded["taxista_doc"]))
+
+        rnd = random.Random(48)
+        reports = {
+            "_manifest": {
+                collection: reconcile_plan(specs, await server.db[collection].index_information(), RETIRED_INDEXES.get(collection))
+                for collection, specs in server.INDEX_MANIFEST.items()
+            }
+        }
+        for label, role, method, path, params in ENDPOINTS:
+            json_body = None
+            if params == "service":
+                params, json_body = None, service_payload(seeded["taxista_doc"], rnd, str(uuid.uuid4()))
+            elif params == "sync":
+                json_body = {"services": [service_payload(seeded["taxista_doc"], rnd, str(uuid.uuid4())) for _ in range(5)]}
+                params = None
+            params = {k: str(v).format(**placeholders) for k, v in (params or {}).items()}
+
+            token = _current_endpoint.set(label)
+            try:
+                status, body = await client.request(method, path, token=tokens[role], json_body=json_body, params=params)
+            finally:
+                _current_endpoint.reset(token)
+
+            queries = []
+            for command_name, command in capture.take(label):
+                explain = await server.db.command({"explain": command, "verbosity": "executionStats"})
+                summary = server.summarize_explain(explain)
+                summary.pop("winning_plan")
+                collection = command.get(command_name)
+                queries.append({
+                    "collection": collection,
+                    "command": json.dumps(command, default=str)[:500],
+                    "summary": summary,
+                    "problems": plan_problems(label, collection, summary),
+                })
+            reports[label] = {"status": status, "body": body[:300], "queries": queries}
+        return reports
+    finally:
+        # Shutdown first (MetricsAggregator.stop() writes to the database) and it closes the app's client
+        await server.app.router.shutdown()
+        cleanup_client = MongoClient(MONGO_URL)
+        cleanup_client.drop_database(DB_NAME)
+        cleanup_client.close()
+
+
+@pytest.fixture(scope="module")
+def plan_reports():
+    return asyncio.run(collect_plan_reports())
+
+
+def test_index_manifest_applied(plan_reports):
+    """Startup reconciliation leaves nothing pending in the manifest"""
+    pending = {collection: actions for collection, actions in plan_reports["_manifest"].items() if actions}
+    assert not pending, f"Index manifest not applied: {pending}"
+
+
+@pytest.mark.parametrize("label", [endpoint[0] for endpoint in ENDPOINTS])
+def test_endpoint_queries_use_indexes(plan_reports, label):
+    report = plan_reports[label]
+    assert report["status"] < 400, f"{label} returned {report['status']}: {report['body']!r}"
+    failing = [query for query in report["queries"] if query["problems"]]
+    assert not failing, f"{label}: {len(failing)} of {len(report['queries'])} queries without a usable index\n" + "\n".join(
+        f"{'FAIL' if query['problems'] else 'ok  '} {query['collection']}: {query['summary']['stages']} "
+        f"index={query['summary']['index_used']} keys={query['summary']['keys_examined']} "
+        f"docs={query['summary']['docs_examined']} returned={query['summary']['n_returned']}"
+        + (f" -> {', '.join(query['problems'])}: {query['command']}" if query["problems"] else "")
+        for query in report["queries"]
+    )
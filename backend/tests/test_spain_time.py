@@ -0,0 +1,110 @@
+"""
+spain_time.py must give exactly what the previous per-call pytz implementation gave
+(scripts/bench_spain_time.legacy_parse), scalar and batch, including DST days.
+
+    python -m pytest tests/test_spain_time.py -v
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+import pytz
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "scripts"))
+
+from bench_spain_time import legacy_parse  # noqa: E402
+from spain_time import SPAIN_TZ, get_date_range_utc, parse_spanish_date_to_utc, parse_spanish_dates_to_utc  # noqa: E402
+
+INVALID = [
+    ("31/02/2024", "10:00"), ("01/01/2024", "24:00"), ("01/01/2024", "10:75"), ("", "10:00"),
+    ("2024-01", "10:00"), ("xx/yy/zzzz", "10:00"), ("01/01/2024", "9"), ("01/01/2024", ""),
+    (None, "10:00"), ("01/01/2024", None), ("1/1/2024", "7:5"), ("2024-13-01", "10:00"),
+]
+
+
+def dst_days(first_year: int = 2019, last_year: int = 2027) -> list:
+    """Local dates of every DST transition in Europe/Madrid between the given years"""
+    return sorted({
+        pytz.UTC.localize(transition).astimezone(SPAIN_TZ).date()
+        for transition in SPAIN_TZ._utc_transition_times
+        if first_year <= transition.year <= last_year
+    })
+
+
+def every_minute(day) -> tuple:
+    fechas, horas = [], []
+    for fecha in (day.strftime("%d/%m/%Y"), day.isoformat()):
+        for minute_of_day in range(24 * 60):
+            fechas.append(fecha)
+            horas.append(f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}")
+    return fechas, horas
+
+
+@pytest.fixture(autouse=True)
+def quiet_spain_time(caplog):
+    # Invalid inputs are intentional: no warning per case
+    caplog.set_level("ERROR", logger="spain_time")
+
+
+def test_dst_days_found():
+    days = dst_days()
+    assert len(days) == 18
+    assert {day.month for day in days} == {3, 10}
+
+
+@pytest.mark.parametrize("day", dst_days(), ids=str)
+def test_dst_day_matches_pytz(day):
+    fechas, horas = every_minute(day)
+    batch = parse_spanish_dates_to_utc(fechas, horas)
+    for fecha, hora, vectorized in zip(fechas, horas, batch):
+        expected = legacy_parse(fecha, hora)
+        assert parse_spanish_date_to_utc(fecha, hora) == expected, (fecha, hora)
+        assert vectorized == expected, (fecha, hora)
+
+
+def test_nonexistent_march_hour_is_read_as_cet():
+    # 31/03/2024 02:30 does not exist in Madrid: like localize(is_dst=False), +1
+    assert parse_spanish_date_to_utc("31/03/2024", "02:30") == datetime(2024, 3, 31, 1, 30)
+    assert parse_spanish_date_to_utc("31/03/2024", "01:59") == datetime(2024, 3, 31, 0, 59)
+    assert parse_spanish_date_to_utc("31/03/2024", "03:00") == datetime(2024, 3, 31, 1, 0)
+
+
+def test_repeated_october_hour_takes_the_second():
+    # 27/10/2024 02:30 happens twice: the CET one (+1)
+    assert parse_spanish_date_to_utc("27/10/2024", "02:30") == datetime(2024, 10, 27, 1, 30)
+    assert parse_spanish_date_to_utc("27/10/2024", "01:30") == datetime(2024, 10, 26, 23, 30)
+    assert parse_spanish_date_to_utc("27/10/2024", "03:00") == datetime(2024, 10, 27, 2, 0)
+
+
+@pytest.mark.parametrize("fecha,hora", INVALID)
+def test_invalid_inputs_match_pytz(fecha, hora):
+    expected = legacy_parse(fecha, hora)
+    assert parse_spanish_date_to_utc(fecha, hora) == expected
+    assert parse_spanish_dates_to_utc([fecha], [hora]) == [expected]
+
+
+def test_batch_mixed_with_invalid_and_datetimes():
+    migrated = datetime(2024, 5, 1, 8, 0)
+    fechas = ["01/05/2024", "31/02/2024", migrated, None, "2024-05-01", 20240501]
+    horas = ["10:00", "10:00", "99:99", "10:00", datetime(2024, 1, 1, 10, 0), "10:00"]
+    assert parse_spanish_dates_to_utc(fechas, horas) == [
+        datetime(2024, 5, 1, 8, 0), None, migrated, None, datetime(2024, 5, 1, 8, 0), None,
+    ]
+    # Same passthrough as the scalar version
+    assert parse_spanish_date_to_utc(migrated, "99:99") == migrated
+
+
+def test_batch_only_invalid_or_datetimes():
+    migrated = datetime(2024, 5, 1, 8, 0)
+    assert parse_spanish_dates_to_utc([migrated, "xx", None], ["10:00", "10:00", "10:00"]) == [migrated, None, None]
+    assert parse_spanish_dates_to_utc([], []) == []
+
+
+def test_date_range_covers_whole_local_days():
+    assert get_date_range_utc("01/07/2024", "31/07/2024") == (
+        datetime(2024, 6, 30, 22, 0), datetime(2024, 7, 31, 21, 59, 59, 999999)
+    )
+    assert get_date_range_utc("x", "31/07/2024")[0] is None